@@ -1,4 +1,3 @@
-import os
 from logging.config import fileConfig
 
 from dotenv import load_dotenv
@@ -33,11 +32,9 @@ target_metadata = Base.metadata
 
 
 def get_database_url() -> str:
-    user = os.getenv("POSTGRES_USER", "postgres")
-    password = os.getenv("POSTGRES_PASSWORD", "")
-    server = os.getenv("POSTGRES_SERVER", "localhost")
-    db = os.getenv("POSTGRES_DB", "db")
-    return f"postgresql+psycopg://{user}:{password}@{server}/{db}"
+    from core.config import settings
+
+    return settings.DATABASE_URI
 
 
 def run_migrations_offline() -> None:
@@ -82,7 +79,10 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            # SQLite can only alter tables by copying them
+            render_as_batch=connection.dialect.name == "sqlite",
         )
 
         with context.begin_transaction():
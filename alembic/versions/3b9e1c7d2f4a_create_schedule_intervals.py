@@ -0,0 +1,102 @@
+"""create schedule intervals
+
+Revision ID: 3b9e1c7d2f4a
+Revises: cd1f2fef5e9b
+Create Date: 2024-11-04 18:12:40.219532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e1c7d2f4a'
+down_revision: Union[str, None] = 'cd1f2fef5e9b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MINUTES_PER_DAY = 24 * 60
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def split_schedule(days, opening_time, closing_time):
+    # Frozen copy of core.week.schedule_intervals as of this revision
+    opening = opening_time.hour * 60 + opening_time.minute
+    closing = closing_time.hour * 60 + closing_time.minute
+    for day in days.split(','):
+        if day not in WEEKDAYS:
+            continue
+        index = WEEKDAYS.index(day)
+        day_start = index * MINUTES_PER_DAY
+        if closing > opening:
+            yield day_start + opening, day_start + closing + 1
+        else:
+            next_day_start = (index + 1) % len(WEEKDAYS) * MINUTES_PER_DAY
+            yield day_start + opening, day_start + MINUTES_PER_DAY
+            yield next_day_start, next_day_start + closing + 1
+
+
+def upgrade() -> None:
+    schedule_intervals = op.create_table(
+        'schedule_intervals',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('start_minute', sa.Integer(), nullable=False),
+        sa.Column('end_minute', sa.Integer(), nullable=False),
+        sa.Column('schedule_id', sa.Integer(), nullable=False),
+        sa.Column('restaurant_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['schedule_id'], ['schedules.id'],
+        name='schedule_intervals_schedules_id_fkey', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'],
+        name='schedule_intervals_restaurants_id_fkey', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_schedule_intervals_start_minute_end_minute',
+        'schedule_intervals',
+        ['start_minute', 'end_minute'],
+        unique=False,
+    )
+    op.create_index(
+        op.f('ix_schedule_intervals_restaurant_id'),
+        'schedule_intervals',
+        ['restaurant_id'],
+        unique=False,
+    )
+
+    # Backfill the intervals of the schedules that are already stored
+    schedules_table = sa.table(
+        'schedules',
+        sa.column('id', sa.Integer),
+        sa.column('restaurant_id', sa.Integer),
+        sa.column('days', sa.String),
+        sa.column('opening_time', sa.Time),
+        sa.column('closing_time', sa.Time),
+    )
+    # Typed columns so that SQLite's stored strings come back as times
+    schedules = op.get_bind().execute(sa.select(
+        schedules_table.c.id,
+        schedules_table.c.restaurant_id,
+        schedules_table.c.days,
+        schedules_table.c.opening_time,
+        schedules_table.c.closing_time,
+    ))
+    rows = [
+        {
+            'schedule_id': schedule_id,
+            'restaurant_id': restaurant_id,
+            'start_minute': start,
+            'end_minute': end,
+        }
+        for schedule_id, restaurant_id, days, opening_time, closing_time in schedules
+        if days and opening_time is not None and closing_time is not None
+        for start, end in split_schedule(days, opening_time, closing_time)
+    ]
+    if rows:
+        op.bulk_insert(schedule_intervals, rows)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_schedule_intervals_restaurant_id'), table_name='schedule_intervals')
+    op.drop_index('ix_schedule_intervals_start_minute_end_minute', table_name='schedule_intervals')
+    op.drop_table('schedule_intervals')
@@ -0,0 +1,33 @@
+"""index schedule foreign keys
+
+Revision ID: 5c7e9a1f3d2b
+Revises: 8f2a4d6e1b3c
+Create Date: 2024-11-08 09:41:52.118204
+
+Indexes the foreign keys that ON DELETE CASCADE follows from restaurants to
+schedules and from schedules to their intervals. Without them, replacing
+every restaurant scans both tables once per deleted row. The schedule
+foreign keys in database_app/models.py are marked `index=True` to match.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '5c7e9a1f3d2b'
+down_revision: Union[str, None] = '8f2a4d6e1b3c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_schedules_restaurant_id'), 'schedules', ['restaurant_id'], unique=False)
+    op.create_index(
+        op.f('ix_schedule_intervals_schedule_id'), 'schedule_intervals', ['schedule_id'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_schedule_intervals_schedule_id'), table_name='schedule_intervals')
+    op.drop_index(op.f('ix_schedules_restaurant_id'), table_name='schedules')
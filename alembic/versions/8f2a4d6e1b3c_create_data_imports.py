@@ -0,0 +1,33 @@
+"""create data imports
+
+Revision ID: 8f2a4d6e1b3c
+Revises: 3b9e1c7d2f4a
+Create Date: 2024-11-06 10:02:17.584310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2a4d6e1b3c'
+down_revision: Union[str, None] = '3b9e1c7d2f4a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'data_imports',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=False),
+        sa.Column('loaded_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('data_imports')
@@ -0,0 +1,26 @@
+"""add restaurant timezone
+
+Revision ID: a4d8c2e6f1b9
+Revises: 5c7e9a1f3d2b
+Create Date: 2024-11-11 14:22:05.301947
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d8c2e6f1b9'
+down_revision: Union[str, None] = '5c7e9a1f3d2b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('restaurants', sa.Column('timezone', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('restaurants') as batch_op:
+        batch_op.drop_column('timezone')
@@ -0,0 +1,40 @@
+"""create schedule exceptions
+
+Revision ID: b7e3f1a9c5d2
+Revises: a4d8c2e6f1b9
+Create Date: 2024-11-13 09:41:36.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3f1a9c5d2'
+down_revision: Union[str, None] = 'a4d8c2e6f1b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'schedule_exceptions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('opening_time', sa.Time(), nullable=True),
+        sa.Column('closing_time', sa.Time(), nullable=True),
+        sa.Column('restaurant_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_schedule_exceptions_date'), 'schedule_exceptions', ['date'], unique=False)
+    op.create_index(
+        op.f('ix_schedule_exceptions_restaurant_id'), 'schedule_exceptions', ['restaurant_id'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_schedule_exceptions_restaurant_id'), table_name='schedule_exceptions')
+    op.drop_index(op.f('ix_schedule_exceptions_date'), table_name='schedule_exceptions')
+    op.drop_table('schedule_exceptions')
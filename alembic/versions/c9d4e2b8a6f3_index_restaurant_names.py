@@ -0,0 +1,47 @@
+"""index restaurant names
+
+Revision ID: c9d4e2b8a6f3
+Revises: b7e3f1a9c5d2
+Create Date: 2024-11-20 14:12:07.530481
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9d4e2b8a6f3'
+down_revision: Union[str, None] = 'b7e3f1a9c5d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_trigram_extension(bind) -> bool:
+    # Only an extension already installed: creating one takes privileges
+    # the migrating role often lacks on managed databases
+    if bind.dialect.name != 'postgresql':
+        return False
+    return bind.execute(
+        sa.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    ).first() is not None
+
+
+def upgrade() -> None:
+    # Substring searches can only use a trigram index, where there is one;
+    # a btree index on the names could not serve them
+    if _has_trigram_extension(op.get_bind()):
+        op.create_index(
+            'ix_restaurants_restaurant_name_trgm',
+            'restaurants',
+            ['restaurant_name'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'restaurant_name': 'gin_trgm_ops'},
+        )
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS ix_restaurants_restaurant_name_trgm')
+    # Created by earlier versions of this revision
+    op.execute('DROP INDEX IF EXISTS ix_restaurants_restaurant_name')
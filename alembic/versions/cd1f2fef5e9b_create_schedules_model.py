@@ -36,7 +36,8 @@ def upgrade() -> None:
 
 def downgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_constraint('schedules_restaurants_id_fkey', 'schedules', type_='foreignkey')
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('schedules_restaurants_id_fkey', 'schedules', type_='foreignkey')
     op.drop_index(op.f('ix_schedules_id'), table_name='schedules')
     op.drop_table('schedules')
     # ### end Alembic commands ###
@@ -1,33 +1,286 @@
-from dateutil.parser import parse
+import json
+import secrets
+from contextlib import aclosing
+from json.encoder import encode_basestring
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
 
-from typing import Any
-
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from api.deps import get_db
+from api.deps import get_async_db, get_db
+from core.config import settings
+from core.events import transition_feed
+from core.ingest import reload_csv
+from core.metrics import rows_returned, stage
+from core.occupancy import bucket_counts, occupancy_cache
+from core.overrides import NO_CHANGES, apply_changes
+from core.response_cache import CachedResponse, etag_matches, response_cache, response_etag
+from core.schedule_index import opening_hours_index, page_after
+from core.single_flight import open_restaurants_flight
+from core.utils import check_datetime_range, parse_datetime, parse_weekday_time
+from core.week import MINUTES_PER_WEEK, local_dates, minute_of_week, minutes_by_zone, next_change, zone_info
 from crud.restaurant import crud_restaurant
+from crud.schedule_exception import crud_schedule_exception
+from database_app.database import AsyncSessionLocal, SessionLocal
 from schemas.restaurant import (
+    MAX_NAME_QUERY_LENGTH,
+    MAX_PAGE_LIMIT,
+    NextChangeBatchRequest,
+    OpenBatchRequest,
     RestaurantNameRead,
 )
+from schemas.schedule_exception import (
+    ScheduleExceptionBase,
+    ScheduleExceptionCreate,
+    ScheduleExceptionRead,
+)
 
 router = APIRouter()
 
 
+def _check_range(*values):
+    try:
+        for value in values:
+            check_datetime_range(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _zones_in_use(db: AsyncSession):
+    if opening_hours_index.is_ready:
+        return opening_hours_index.zones
+    return await crud_restaurant.aget_timezones(db)
+
+
+@router.post(
+    "/open:batch",
+)
+async def get_open_restaurants_batch(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    background_tasks: BackgroundTasks,
+    batch_in: OpenBatchRequest,
+) -> Any:
+    """
+    Get ids of the restaurants open at each of many timestamps; those with
+    a UTC offset are read on each restaurant's local clock. Schedule
+    exceptions on the date of a timestamp replace the weekly hours, as for
+    a single one.
+    """
+    timestamps = batch_in.timestamps
+    _check_range(*timestamps)
+    zones = ()
+    if any(timestamp.tzinfo is not None for timestamp in timestamps):
+        zones = await _zones_in_use(db)
+    zone_minutes = [minutes_by_zone(timestamp, zones, settings.DEFAULT_TIMEZONE) for timestamp in timestamps]
+    if opening_hours_index.is_ready:
+        open_ids = opening_hours_index.open_ids_by_zone_minutes(zone_minutes)
+    else:
+        open_ids = await crud_restaurant.aget_open_ids_by_zone_minutes(db=db, zone_minutes_list=zone_minutes)
+        background_tasks.add_task(opening_hours_index.rebuild_if_stale, SessionLocal)
+    overrides = await crud_schedule_exception.aget_overrides(db)
+    return {
+        'description': "Open restaurants retrieved successfully",
+        'data': [
+            {
+                'timestamp': timestamp,
+                'restaurant_ids': _apply_id_changes(
+                    restaurant_ids, overrides.changes(minutes, local_dates(timestamp, minutes))
+                ),
+            }
+            for timestamp, minutes, restaurant_ids in zip(timestamps, zone_minutes, open_ids)
+        ],
+    }
+
+
+def _apply_id_changes(restaurant_ids, changes):
+    closed, opened = changes
+    if not closed and not opened:
+        return restaurant_ids
+    return sorted(set(restaurant_ids).difference(closed).union(opened))
+
+
+def _next_change_item(restaurant_id, points, at: datetime, zone=None, overrides=None) -> dict:
+    """
+    When a restaurant next opens or closes after `at`, by its weekly hours
+    and the schedule exceptions in `overrides`. An aware `at` is read on
+    the clock of the restaurant's time zone, and the change is given at
+    the UTC offset of `at`.
+    """
+    local = at if at.tzinfo is None else at.astimezone(zone_info(zone or settings.DEFAULT_TIMEZONE))
+    if overrides is not None and restaurant_id in overrides.restaurants:
+        is_open, minutes_until, opens = overrides.next_change(restaurant_id, points, local.replace(tzinfo=None))
+    else:
+        is_open, minutes_until, opens = next_change(points, minute_of_week(local))
+    if minutes_until is None:
+        return {'restaurant_id': restaurant_id, 'is_open': is_open, 'next_change': None, 'changes_at': None}
+    # First minute in the new state; the closing minute itself is still open
+    changes_at = local.replace(second=0, microsecond=0) + timedelta(minutes=minutes_until)
+    return {
+        'restaurant_id': restaurant_id,
+        'is_open': is_open,
+        'next_change': 'open' if opens else 'close',
+        'changes_at': changes_at if at.tzinfo is None else changes_at.astimezone(at.tzinfo),
+    }
+
+
+async def _restaurant_zones(db: AsyncSession, restaurant_ids, at: datetime) -> dict:
+    """
+    Time zones by id of the restaurants to read an aware `at` in.
+    """
+    if at.tzinfo is None:
+        return {}
+    return await crud_restaurant.aget_timezones_by_id(db, restaurant_ids)
+
+
+async def _change_points(db: AsyncSession, background_tasks: BackgroundTasks, restaurant_ids) -> dict:
+    if opening_hours_index.is_ready:
+        return opening_hours_index.change_points(restaurant_ids)
+    background_tasks.add_task(opening_hours_index.rebuild_if_stale, SessionLocal)
+    return await crud_restaurant.aget_change_points(db=db, restaurant_ids=restaurant_ids)
+
+
+@router.post(
+    "/next-change:batch",
+)
+async def get_next_changes_batch(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    background_tasks: BackgroundTasks,
+    batch_in: NextChangeBatchRequest,
+) -> Any:
+    """
+    Get when each of many restaurants, or all of them, next opens or
+    closes, schedule exceptions included.
+    """
+    at = batch_in.at or datetime.now(timezone.utc)
+    _check_range(at)
+    changes = await _change_points(db, background_tasks, batch_in.restaurant_ids)
+    zones = await _restaurant_zones(db, batch_in.restaurant_ids, at)
+    overrides = await crud_schedule_exception.aget_overrides(db)
+    return {
+        'description': "Next changes retrieved successfully",
+        'data': [
+            _next_change_item(restaurant_id, points, at, zones.get(restaurant_id), overrides)
+            for restaurant_id, points in sorted(changes.items())
+        ],
+    }
+
+
 @router.get(
-    "/{opening_hours}",
+    "/{restaurant_id}/next-change",
 )
-def get_album_by_id(*, db: Session = Depends(get_db), opening_hours: str) -> Any:
+async def get_next_change(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    background_tasks: BackgroundTasks,
+    restaurant_id: int,
+    at: Optional[datetime] = None,
+) -> Any:
     """
-    Get restaurant per opening hours.
+    Get when a restaurant next opens or closes after the given time, by
+    default now, schedule exceptions included; a time with a UTC offset is
+    read on the restaurant's local clock.
     """
+    changes = await _change_points(db, background_tasks, [restaurant_id])
+    if restaurant_id not in changes:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Restaurant not found",
+        )
+    at = at or datetime.now(timezone.utc)
+    _check_range(at)
+    zones = await _restaurant_zones(db, [restaurant_id], at)
+    overrides = await crud_schedule_exception.aget_overrides(db)
+    return {
+        'description': "Next change retrieved successfully",
+        'data': _next_change_item(restaurant_id, changes[restaurant_id], at, zones.get(restaurant_id), overrides),
+    }
+
+
+def _require_admin(x_admin_token: Optional[str]):
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, settings.SECRET_KEY):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+
+
+async def _get_restaurant(db: AsyncSession, restaurant_id: int):
+    restaurant = await db.get(crud_restaurant.model, restaurant_id)
+    if restaurant is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Restaurant not found",
+        )
+    return restaurant
+
+
+@router.get(
+    "/{restaurant_id}/exceptions",
+)
+async def get_schedule_exceptions(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    restaurant_id: int,
+) -> Any:
+    """
+    Get the holiday closures and special hours of a restaurant by date.
+    """
+    await _get_restaurant(db, restaurant_id)
+    exceptions = await crud_schedule_exception.aget_by_restaurant(db, restaurant_id)
+    return {
+        'description': "Schedule exceptions retrieved successfully",
+        'data': [ScheduleExceptionRead.model_validate(exception).model_dump() for exception in exceptions],
+    }
+
+
+@router.post(
+    "/{restaurant_id}/exceptions",
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_schedule_exception(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    restaurant_id: int,
+    exception_in: ScheduleExceptionBase,
+    x_admin_token: Optional[str] = Header(None),
+) -> Any:
+    """
+    Close a restaurant on a date, or give it special hours there, in place
+    of its weekly hours; requires the SECRET_KEY in an X-Admin-Token header.
+    Several exceptions on a date are several opening periods.
+    """
+    _require_admin(x_admin_token)
+    await _get_restaurant(db, restaurant_id)
     try:
-        parsed_datetime = parse(opening_hours)
-    except ValueError:
-        # Raise an HTTPException if parsing fails
-        raise HTTPException(status_code=400, detail="Invalid opening_hours datetime format")
+        exception = await crud_schedule_exception.acreate(
+            db, obj_in=ScheduleExceptionCreate(restaurant_id=restaurant_id, **exception_in.model_dump())
+        )
+    except IntegrityError:
+        # e.g. the restaurant was deleted in the meantime
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Schedule exception conflicts with the stored restaurants",
+        )
+    return {
+        'description': "Schedule exception created successfully",
+        'data': ScheduleExceptionRead.model_validate(exception).model_dump(),
+    }
+
+
+def _check_window(start: datetime, end: datetime):
+    if (start.tzinfo is None) != (end.tzinfo is None):
+        raise HTTPException(
+            status_code=400, detail="Window start and end must both have a UTC offset or neither"
+        )
+    _check_range(start, end)
+    if end < start:
+        raise HTTPException(status_code=400, detail="Window end is before its start")
+
 
-    restaurants = crud_restaurant.get_by_opening_hours(db=db, opening_hours=parsed_datetime)
+def _window_response(restaurants) -> Any:
     if not restaurants:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -40,3 +293,445 @@ def get_album_by_id(*, db: Session = Depends(get_db), opening_hours: str) -> Any
             for restaurant in restaurants
         ],
     }
+
+
+@router.get(
+    "/open-during",
+)
+async def get_open_during(
+    *, db: AsyncSession = Depends(get_async_db), start: datetime, end: datetime
+) -> Any:
+    """
+    Get restaurants open for the whole window from start to end; a window
+    with a UTC offset is read on each restaurant's local clock. Schedule
+    exceptions on its dates replace the weekly hours.
+    """
+    _check_window(start, end)
+    return _window_response(await crud_restaurant.aopen_during(db=db, start=start, end=end))
+
+
+@router.get(
+    "/open-any",
+)
+async def get_open_any(
+    *, db: AsyncSession = Depends(get_async_db), start: datetime, end: datetime
+) -> Any:
+    """
+    Get restaurants open at any point of the window from start to end; a
+    window with a UTC offset is read on each restaurant's local clock.
+    Schedule exceptions on its dates replace the weekly hours.
+    """
+    _check_window(start, end)
+    return _window_response(await crud_restaurant.aopen_any(db=db, start=start, end=end))
+
+
+@router.get(
+    "/stats/cache",
+)
+async def get_cache_stats() -> Any:
+    """
+    Get hit and miss counters of the open-restaurants response cache, and
+    how many of the requests it missed were computed or joined another
+    request computing the same minute.
+    """
+    return {
+        'description': "Cache statistics retrieved successfully",
+        'data': {**response_cache.stats(), **open_restaurants_flight.stats()},
+    }
+
+
+@router.post(
+    "/reload",
+)
+def reload_restaurants(
+    *,
+    db: Session = Depends(get_db),
+    x_admin_token: Optional[str] = Header(None),
+) -> Any:
+    """
+    Apply the changes in restaurants.csv to the stored restaurants without
+    a restart; requires the SECRET_KEY in an X-Admin-Token header.
+    """
+    _require_admin(x_admin_token)
+    report = reload_csv(db)
+    return {
+        'description': "Restaurants reloaded successfully",
+        'data': {
+            'inserted': report.inserted,
+            'updated': report.updated,
+            'deleted': report.deleted,
+            'unchanged': report.unchanged,
+            'error_count': report.error_count,
+            'errors': [error._asdict() for error in report.errors],
+            'seconds': report.seconds,
+        },
+    }
+
+
+async def _transition_events(request: Request, last_event_id):
+    async with aclosing(transition_feed.subscribe(last_event_id)) as messages:
+        async for message in messages:
+            # Servers may drop writes to a closed connection without an
+            # error, so a client that left is noticed at the next message
+            if await request.is_disconnected():
+                return
+            yield message
+
+
+@router.get(
+    "/events",
+)
+async def get_transition_events(
+    *,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+) -> Any:
+    """
+    Subscribe to server-sent events of restaurants opening and closing.
+
+    Each minute with changes brings an `opened` and a `closed` event, whose
+    data holds the minute and the restaurants, and a `resync` event means
+    the restaurants changed or events were missed, so the open ones should
+    be fetched again. Reconnecting with a Last-Event-ID header resumes
+    after that event, or is told to resync if another worker or an earlier
+    run of this one sent it.
+    """
+    if transition_feed.subscribers >= settings.EVENTS_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many event subscribers")
+    return StreamingResponse(
+        _transition_events(request, last_event_id),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@router.get(
+    "/stats/occupancy",
+)
+async def get_occupancy(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    bucket: int = Query(60, ge=1, le=MINUTES_PER_WEEK),
+    aggregate: str = "max",
+) -> Any:
+    """
+    Get how many restaurants are open over the week, in their local time,
+    per bucket of `bucket` minutes starting Monday 00:00.
+
+    Each bucket holds the max, min or mean of its per-minute counts; the
+    bucket has to divide the week, and 1 gives every minute. The week has
+    no dates, so the counts are of the weekly hours alone and schedule
+    exceptions do not apply.
+    """
+    occupancy = occupancy_cache.get()
+    if occupancy is None:
+        generation = response_cache.generation
+        with stage('lookup'):
+            occupancy = await crud_restaurant.aget_weekly_occupancy(db=db)
+        occupancy_cache.put(occupancy, generation)
+    try:
+        with stage('aggregate'):
+            counts = bucket_counts(occupancy.counts, bucket, aggregate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        'description': "Occupancy by the weekly hours retrieved successfully",
+        'data': {
+            'bucket_minutes': bucket,
+            'aggregate': aggregate,
+            'restaurants': occupancy.restaurants,
+            'memory_bytes': occupancy.nbytes,
+            'counts': counts.tolist(),
+        },
+    }
+
+
+def _render(content) -> bytes:
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _render_restaurant_names(names) -> bytes:
+    """
+    Encode the body `RestaurantNameRead` rows would produce straight from
+    the names, without building a model and a dict per restaurant.
+    """
+    data = ','.join(['{"restaurant_name":' + encode_basestring(name) + '}' for name in names])
+    return ('{"description":"Restaurants retrieved successfully","data":[' + data + ']}').encode("utf-8")
+
+
+def _render_ndjson(rows) -> bytes:
+    return ''.join([
+        '{"id":%d,"restaurant_name":%s}\n' % (restaurant_id, encode_basestring(restaurant_name))
+        for restaurant_id, restaurant_name in rows
+    ]).encode("utf-8")
+
+
+async def _minutes_by_zone(db: AsyncSession, parsed_datetime: datetime) -> dict:
+    if parsed_datetime.tzinfo is not None and opening_hours_index.is_ready:
+        return minutes_by_zone(parsed_datetime, opening_hours_index.zones, settings.DEFAULT_TIMEZONE)
+    return await crud_restaurant.aminutes_by_zone(db, parsed_datetime)
+
+
+def _cache_key(zone_minutes: dict, changes):
+    # A single minute for every zone answers the same as a naive datetime
+    if len(zone_minutes) == 1 and None in zone_minutes.values():
+        key = next(iter(zone_minutes))
+    else:
+        key = tuple(sorted(zone_minutes.items()))
+    closed, opened = changes
+    if closed or opened:
+        # Schedule exceptions of the date change the answer at that minute
+        return key, tuple(sorted(closed)), tuple(sorted(opened))
+    return key
+
+
+def _lookup_index(zone_minutes: dict, changes, q=None):
+    restaurants = apply_changes(opening_hours_index.lookup_zones(zone_minutes), *changes)
+    if q is not None:
+        restaurants = opening_hours_index.name_index().matching(q, restaurants)
+    return restaurants
+
+
+async def _stream_restaurants(parsed_datetime: datetime, zone_minutes: dict, changes, q, after_id, limit):
+    batch_size = settings.STREAM_BATCH_SIZE
+    if opening_hours_index.is_ready:
+        rows = page_after(_lookup_index(zone_minutes, changes, q), after_id, limit)
+        for start in range(0, len(rows), batch_size):
+            yield _render_ndjson(rows[start:start + batch_size])
+        return
+    # Request dependencies are closed before the body is streamed
+    async with AsyncSessionLocal() as db:
+        async for rows in crud_restaurant.astream_names_by_opening_hours(
+            db,
+            parsed_datetime,
+            after_id=after_id,
+            limit=limit,
+            batch_size=batch_size,
+            zone_minutes=zone_minutes,
+            changes=changes,
+            q=q,
+        ):
+            yield _render_ndjson(rows)
+
+
+async def _restaurants_page(
+    db: AsyncSession,
+    background_tasks: BackgroundTasks,
+    parsed_datetime: datetime,
+    zone_minutes: dict,
+    changes,
+    q,
+    after_id,
+    limit,
+):
+    page_size = limit or MAX_PAGE_LIMIT
+    # One row more than the page tells whether there is a next one
+    if opening_hours_index.is_ready:
+        rows = page_after(_lookup_index(zone_minutes, changes, q), after_id, page_size + 1)
+    else:
+        rows = await crud_restaurant.aget_names_by_opening_hours(
+            db=db,
+            opening_hours=parsed_datetime,
+            after_id=after_id,
+            limit=page_size + 1,
+            zone_minutes=zone_minutes,
+            changes=changes,
+            q=q,
+        )
+        background_tasks.add_task(opening_hours_index.rebuild_if_stale, SessionLocal)
+    if not rows and after_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Restaurants not found",
+        )
+    page = rows[:page_size]
+    return {
+        'description': "Restaurants retrieved successfully",
+        'data': [{'restaurant_name': restaurant_name} for _, restaurant_name in page],
+        'next_after_id': page[-1][0] if len(rows) > page_size else None,
+    }
+
+
+def _flight_minute(parsed_datetime: datetime) -> datetime:
+    """
+    The minute requests for a datetime share: its local minute when naive,
+    else its instant in UTC. The date is kept, as exceptions depend on it.
+    """
+    if parsed_datetime.tzinfo is not None:
+        # In range, as `parse_datetime` checked
+        parsed_datetime = parsed_datetime.astimezone(timezone.utc)
+    return parsed_datetime.replace(second=0, microsecond=0)
+
+
+async def _zone_minutes_and_changes(db: AsyncSession, parsed_datetime: datetime, weekly: bool):
+    """
+    Minutes by time zone and exception changes at a datetime. A weekly
+    one, a weekday and time, is local time everywhere and only has the
+    weekly hours.
+    """
+    if weekly:
+        return {minute_of_week(parsed_datetime): None}, NO_CHANGES
+    zone_minutes = await _minutes_by_zone(db, parsed_datetime)
+    return zone_minutes, await crud_restaurant.aoverride_changes(db, parsed_datetime, zone_minutes)
+
+
+async def _open_restaurants_response(parsed_datetime: datetime, weekly: bool, q) -> CachedResponse:
+    """
+    The response of the restaurants open at a datetime, from the response
+    cache or rendered and put there. It runs in a session of its own, since
+    it may be shared by requests that started and end apart from it.
+    """
+    # Taken before anything is read, so a write committed meanwhile leaves
+    # the answer uncached rather than cached as current
+    generation = response_cache.generation
+    async with AsyncSessionLocal() as db:
+        zone_minutes, changes = await _zone_minutes_and_changes(db, parsed_datetime, weekly)
+        # Typed names would crowd the minutes out of the cache
+        key = _cache_key(zone_minutes, changes) if q is None else None
+        with stage('cache'):
+            cached = response_cache.get(key) if key is not None else None
+        if cached is not None:
+            return cached
+        with stage('lookup'):
+            if opening_hours_index.is_ready:
+                restaurants = _lookup_index(zone_minutes, changes, q)
+            else:
+                restaurants = await crud_restaurant.aget_names_by_opening_hours(
+                    db=db, opening_hours=parsed_datetime, zone_minutes=zone_minutes, changes=changes, q=q
+                )
+    rows_returned.observe(len(restaurants))
+    with stage('serialize'):
+        if restaurants:
+            status_code = status.HTTP_200_OK
+            body = _render_restaurant_names(restaurant_name for _, restaurant_name in restaurants)
+        else:
+            status_code = status.HTTP_404_NOT_FOUND
+            body = _render({'detail': "Restaurants not found"})
+    if key is not None:
+        return response_cache.put(key, status_code, body, generation=generation)
+    return CachedResponse(status_code, body, response_etag(body))
+
+
+async def _open_restaurants(
+    db: AsyncSession,
+    background_tasks: BackgroundTasks,
+    parsed_datetime: datetime,
+    weekly: bool,
+    q,
+    limit,
+    after_id,
+    accept,
+    if_none_match,
+):
+    streamed = accept is not None and "application/x-ndjson" in accept
+    if streamed or limit is not None or after_id is not None:
+        zone_minutes, changes = await _zone_minutes_and_changes(db, parsed_datetime, weekly)
+        if streamed:
+            return StreamingResponse(
+                _stream_restaurants(parsed_datetime, zone_minutes, changes, q, after_id, limit),
+                media_type="application/x-ndjson",
+            )
+        return await _restaurants_page(
+            db, background_tasks, parsed_datetime, zone_minutes, changes, q, after_id, limit
+        )
+
+    if settings.COALESCE_REQUESTS:
+        cached = await open_restaurants_flight.do(
+            (_flight_minute(parsed_datetime), weekly, q),
+            lambda: _open_restaurants_response(parsed_datetime, weekly, q),
+        )
+    else:
+        cached = await _open_restaurants_response(parsed_datetime, weekly, q)
+    if not opening_hours_index.is_ready:
+        background_tasks.add_task(opening_hours_index.rebuild_if_stale, SessionLocal)
+
+    headers = {
+        'ETag': cached.etag,
+        'Cache-Control': f"public, max-age={settings.RESPONSE_CACHE_MAX_AGE}",
+    }
+    if cached.status_code == status.HTTP_200_OK and etag_matches(if_none_match, cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(
+        content=cached.body,
+        status_code=cached.status_code,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+@router.get(
+    "/open",
+)
+async def get_open_restaurants_weekly(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    background_tasks: BackgroundTasks,
+    weekday: str,
+    time: str,
+    q: Optional[str] = Query(None, min_length=1, max_length=MAX_NAME_QUERY_LENGTH),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_LIMIT),
+    after_id: Optional[int] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+) -> Any:
+    """
+    Get the restaurants open at a weekday (`Mon` or `Monday`) and time
+    (`14:30`, `2:30 pm`) by their weekly hours, local time wherever each
+    restaurant is; schedule exceptions, which fall on dates, do not apply.
+
+    Otherwise the same as the restaurants open at a datetime, without
+    parsing one.
+    """
+    try:
+        parsed_datetime = parse_weekday_time(weekday, time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid weekday or time")
+    return await _open_restaurants(
+        db, background_tasks, parsed_datetime, True, q, limit, after_id, accept, if_none_match
+    )
+
+
+@router.get(
+    "/{opening_hours}",
+)
+async def get_album_by_id(
+    *,
+    db: AsyncSession = Depends(get_async_db),
+    background_tasks: BackgroundTasks,
+    opening_hours: str,
+    q: Optional[str] = Query(None, min_length=1, max_length=MAX_NAME_QUERY_LENGTH),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_LIMIT),
+    after_id: Optional[int] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+) -> Any:
+    """
+    Get restaurant per opening hours.
+
+    A naive datetime is local time wherever each restaurant is, while one
+    with a UTC offset, or a Unix time, is an instant, matched against each
+    restaurant in its own time zone. Schedule exceptions on the date
+    replace the weekly hours. With `q` only the restaurants whose name
+    contains it, ignoring case, are returned.
+
+    Responses depend only on the minute of the week in each time zone,
+    and the exceptions in effect, and are served from the response cache,
+    with an ETag clients can revalidate against; those filtered by name
+    are not cached. Concurrent requests for the same minute share one
+    computation.
+
+    With `limit` or `after_id` one page of restaurants ordered by id is
+    returned along with the cursor of the next page, and with an
+    `application/x-ndjson` Accept header the restaurants are streamed one
+    per line.
+    """
+    try:
+        with stage('parse'):
+            parsed_datetime = parse_datetime(opening_hours)
+    except (ValueError, OverflowError):
+        # Raise an HTTPException if parsing fails
+        raise HTTPException(status_code=400, detail="Invalid opening_hours datetime format")
+    return await _open_restaurants(
+        db, background_tasks, parsed_datetime, False, q, limit, after_id, accept, if_none_match
+    )
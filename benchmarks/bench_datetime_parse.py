@@ -0,0 +1,54 @@
+"""
+Measure datetime parsing for the open-restaurants endpoint, dateutil vs
+the fast path.
+
+Each input is parsed `--number` times by dateutil's parser, which the
+endpoint used for every request, and by `parse_datetime`, which reads ISO
+8601 and Unix times directly and leaves other formats to dateutil; the
+weekday and time form is timed as well.
+
+    python -m benchmarks.bench_datetime_parse --number 100000
+"""
+import argparse
+import timeit
+
+from dateutil.parser import parse
+
+from core.utils import parse_datetime, parse_weekday_time
+
+INPUTS = [
+    '2024-01-01T12:30:00',
+    '2024-01-01 12:30',
+    '2024-01-01T12:30:00Z',
+    '2024-01-01T12:30:00.250+05:30',
+    '1704112200',
+    'Jan 1 2024 12:30',
+]
+
+
+def microseconds_per_call(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f'{"input":>32}  {"dateutil":>10}  {"fast path":>10}')
+    for datetime_str in INPUTS:
+        try:
+            parse(datetime_str)
+        except ValueError:
+            dateutil_column = 'rejected'
+        else:
+            dateutil_us = microseconds_per_call(lambda: parse(datetime_str), args.number)
+            dateutil_column = f'{dateutil_us:7.2f} us'
+        fast_us = microseconds_per_call(lambda: parse_datetime(datetime_str), args.number)
+        print(f'{datetime_str:>32}  {dateutil_column:>10}  {fast_us:7.2f} us')
+    weekday_us = microseconds_per_call(lambda: parse_weekday_time('Mon', '12:30'), args.number)
+    print(f'{"weekday=Mon&time=12:30":>32}  {"":>10}  {weekday_us:7.2f} us')
+
+
+if __name__ == '__main__':
+    main()
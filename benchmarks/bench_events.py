@@ -0,0 +1,119 @@
+"""
+Time the opened/closed event sweeps and their fan-out to many subscribers.
+
+A transition wheel over synthetic restaurants, spread over a few time
+zones, is swept minute by minute over a week starting at a UTC instant,
+timing each sweep. Then `--subscribers` in-process subscribers (no sockets
+involved) consume the feed while the busiest minute's messages are
+published `--rounds` times, timing how long it takes every subscriber to
+receive each message, along with the memory each subscriber holds.
+
+    python -m benchmarks.bench_events --restaurants 100000 --subscribers 10000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.bench_snapshot import synthetic_rows
+from core.events import TransitionFeed, TransitionWheel, render_event
+from core.week import MINUTES_PER_WEEK
+
+ZONES = (None, 'Europe/Berlin', 'America/New_York', 'Asia/Tokyo')
+
+
+def sweep_week(wheel):
+    """
+    Seconds of each sweep over the week, and the events of the busiest
+    minute.
+    """
+    previous = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    seconds = []
+    busiest = []
+    for _ in range(MINUTES_PER_WEEK):
+        at = previous + timedelta(minutes=1)
+        start = time.perf_counter()
+        opened, closed = wheel.transitions(previous, at)
+        seconds.append(time.perf_counter() - start)
+        if len(opened) + len(closed) > sum(len(data['restaurants']) for _, data in busiest):
+            busiest = [
+                (event, {
+                    'at': at.isoformat(),
+                    'restaurants': [{'id': entry.id, 'restaurant_name': entry.restaurant_name} for entry in entries],
+                })
+                for event, entries in (('opened', opened), ('closed', closed)) if entries
+            ]
+        previous = at
+    return seconds, busiest
+
+
+async def fan_out(subscribers, rounds, events):
+    feed = TransitionFeed(history=256)
+    expected = rounds * len(events)
+    received = [0] * subscribers
+    done = asyncio.Event()
+    remaining = subscribers
+
+    async def consume(number):
+        nonlocal remaining
+        async for message in feed.subscribe():
+            if message.startswith(b'id:'):
+                received[number] += 1
+                if received[number] == expected:
+                    remaining -= 1
+                    if not remaining:
+                        done.set()
+                    return
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.create_task(consume(number)) for number in range(subscribers)]
+    while feed.subscribers < subscribers:
+        await asyncio.sleep(0)
+    per_subscriber = (tracemalloc.get_traced_memory()[0] - baseline) / subscribers
+    tracemalloc.stop()
+
+    latencies = []
+    for _ in range(rounds):
+        delivered = sum(received)
+        start = time.perf_counter()
+        for event, data in events:
+            feed.publish(event, data)
+        target = delivered + subscribers * len(events)
+        while sum(received) < target:
+            await asyncio.sleep(0)
+        latencies.append(time.perf_counter() - start)
+    await done.wait()
+    await asyncio.gather(*tasks)
+    return latencies, per_subscriber
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--restaurants', type=int, default=100_000)
+    parser.add_argument('--subscribers', type=int, default=10_000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    rows, intervals = synthetic_rows(args.restaurants)
+    zones = {restaurant_id: ZONES[restaurant_id % len(ZONES)] for restaurant_id, _ in rows}
+    start = time.perf_counter()
+    wheel = TransitionWheel(rows, intervals, zones)
+    build_seconds = time.perf_counter() - start
+    seconds, busiest = sweep_week(wheel)
+    latencies, per_subscriber = asyncio.run(fan_out(args.subscribers, args.rounds, busiest))
+
+    size = sum(len(render_event(0, event, data)) for event, data in busiest)
+    print(f'restaurants: {args.restaurants:,} in {len(ZONES)} zones, wheel built in {build_seconds * 1000:.0f} ms')
+    print(f'sweep per minute: median {statistics.median(seconds) * 1e6:.0f} us, '
+          f'max {max(seconds) * 1000:.2f} ms')
+    print(f'busiest minute: {sum(len(data["restaurants"]) for _, data in busiest):,} transitions, ~{size / 1024:.0f} KiB')
+    print(f'{args.subscribers:,} subscribers, {per_subscriber / 1024:.1f} KiB each')
+    print(f'  all received: median {statistics.median(latencies) * 1000:.1f} ms, '
+          f'max {max(latencies) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure the cost of request metrics on the open-restaurants endpoint.
+
+Requests go through the whole app in-process over httpx's ASGI transport,
+in rounds that each time the same requests with metrics enabled and
+disabled, in a random order. The minutes asked for are warmed into the
+response cache first, so the fastest path is measured and the relative
+overhead is at its largest.
+
+The overhead of a round is the ratio of its two times, which cancels drift
+between rounds. A few rounds of noise make single ratios swing by several
+percent either way, so the median and spread over many rounds are reported,
+with a 95% confidence interval of the mean.
+
+    python -m benchmarks.bench_metrics_overhead --requests 2000 --rounds 40 --warmup 5
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from core.metrics import metrics
+from main import app
+
+
+async def run_round(client, urls):
+    start = time.perf_counter()
+    for url in urls:
+        response = await client.get(url)
+        response.read()
+    return (time.perf_counter() - start) / len(urls)
+
+
+async def measure(requests, rounds, warmup, seed=0):
+    rng = random.Random(seed)
+    week_start = datetime(2024, 1, 1)
+    minutes = [rng.randrange(7 * 24 * 60) for _ in range(50)]
+    urls = [
+        f"/api/v1/restaurants/{(week_start + timedelta(minutes=rng.choice(minutes))).isoformat()}"
+        for _ in range(requests)
+    ]
+    per_request = {True: [], False: []}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(warmup):
+            for enabled in (False, True):
+                metrics.enabled = enabled
+                await run_round(client, urls)
+        for _ in range(rounds):
+            order = [False, True]
+            rng.shuffle(order)
+            for enabled in order:
+                metrics.enabled = enabled
+                per_request[enabled].append(await run_round(client, urls))
+    metrics.enabled = True
+    return per_request
+
+
+def summarize(per_request):
+    """
+    Median, standard deviation and 95% confidence interval of the mean of
+    the per-round overheads, in percent.
+    """
+    overheads = [
+        (enabled / disabled - 1) * 100 for disabled, enabled in zip(per_request[False], per_request[True])
+    ]
+    mean = statistics.fmean(overheads)
+    stdev = statistics.stdev(overheads)
+    margin = 1.96 * stdev / len(overheads) ** 0.5
+    return statistics.median(overheads), stdev, (mean - margin, mean + margin)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per round')
+    parser.add_argument('--rounds', type=int, default=40)
+    parser.add_argument('--warmup', type=int, default=5, help='untimed rounds before measuring')
+    args = parser.parse_args()
+    if args.rounds < 2:
+        parser.error('--rounds must be at least 2')
+
+    per_request = asyncio.run(measure(args.requests, args.rounds, args.warmup))
+    disabled = statistics.median(per_request[False])
+    enabled = statistics.median(per_request[True])
+    median, stdev, (low, high) = summarize(per_request)
+    print(f'requests per round: {args.requests}, rounds: {args.rounds}, warmup: {args.warmup}')
+    print(f'metrics disabled: {disabled * 1e6:.1f} us/request (median)')
+    print(f' metrics enabled: {enabled * 1e6:.1f} us/request (median)')
+    print(f'        overhead: {median:+.2f}% ± {stdev:.2f}% (median ± stdev of rounds)')
+    print(f'          95% CI: {low:+.2f}% to {high:+.2f}% (mean)')
+
+
+if __name__ == '__main__':
+    main()
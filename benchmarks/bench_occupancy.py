@@ -0,0 +1,75 @@
+"""
+Time the weekly occupancy computation on synthetic restaurants.
+
+Intervals are generated in memory from the synthetic hours of
+benchmarks.dataset, ordered by restaurant the way the SQL query returns
+them, so only the NumPy work is measured.
+
+    python -m benchmarks.bench_occupancy --restaurants 1000000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from benchmarks.dataset import synthetic_hours
+from core.occupancy import WeeklyOccupancy, bucket_counts
+from core.utils import parse_opening_hours
+from core.week import schedule_intervals
+
+
+def synthetic_intervals(restaurants, distinct=10_000, seed=0):
+    """
+    (restaurant_ids, starts, ends) arrays with each restaurant's intervals
+    sorted by start.
+    """
+    rng = random.Random(seed)
+    templates = []
+    for _ in range(distinct):
+        intervals = sorted(
+            interval
+            for schedule in parse_opening_hours(synthetic_hours(rng))
+            for interval in schedule_intervals(schedule['days'], schedule['opening_time'], schedule['closing_time'])
+        )
+        templates.append(np.array(intervals or [(0, 0)], dtype=np.int64).reshape(-1, 2))
+    lengths = np.array([len(template) for template in templates])
+    starts_by_template = np.concatenate([template[:, 0] for template in templates])
+    ends_by_template = np.concatenate([template[:, 1] for template in templates])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    choices = np.random.default_rng(seed).integers(0, distinct, restaurants)
+    counts = lengths[choices]
+    restaurant_ids = np.repeat(np.arange(restaurants), counts)
+    # Position of every interval within its template
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = np.repeat(offsets[choices], counts) + positions
+    return restaurant_ids, starts_by_template[rows], ends_by_template[rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--restaurants', type=int, default=1_000_000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    restaurant_ids, starts, ends = synthetic_intervals(args.restaurants)
+    durations = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        occupancy = WeeklyOccupancy.from_intervals(restaurant_ids, starts, ends)
+        durations.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for bucket in (1, 15, 60, 1440):
+        bucket_counts(occupancy.counts, bucket, 'mean')
+    bucket_seconds = time.perf_counter() - start
+
+    print(f'restaurants: {occupancy.restaurants:,}, intervals: {len(starts):,}, runs: {len(occupancy.run_starts):,}')
+    print(f'full week: best {min(durations) * 1000:.1f} ms, worst {max(durations) * 1000:.1f} ms')
+    print(f'buckets of 1, 15, 60 and 1440 minutes: {bucket_seconds * 1000:.2f} ms')
+    print(f'run-length form: {occupancy.nbytes / 2**20:.1f} MiB')
+    print(f'packed bit matrix: {occupancy.bit_matrix_nbytes / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Compare the in-process opening hours index against the SQL lookup.
+
+Synthetic restaurants are generated from the hours in restaurants.csv and
+inserted inside a transaction that is rolled back at the end, so the
+database is left untouched. With --zones they are spread over that many
+US time zones and lookups at aware datetimes are timed as well.
+
+    python -m benchmarks.bench_open_lookup --restaurants 100000 --zones 4
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+
+from core.schedule_index import OpeningHoursIndex
+from core.utils import parse_opening_hours, read_csv_data
+from core.config import settings
+from core.week import minutes_by_zone, schedule_intervals
+from crud.restaurant import crud_restaurant
+from database_app.database import SessionLocal
+from database_app.models import Restaurant, Schedule, ScheduleInterval
+
+ID_OFFSET = 1_000_000_000
+ZONES = ['America/New_York', 'America/Chicago', 'America/Denver', 'America/Los_Angeles', 'Pacific/Honolulu']
+
+
+def insert_synthetic_restaurants(db, count, seed=0, zones=()):
+    rng = random.Random(seed)
+    templates = [row['hours'] for row in read_csv_data('restaurants.csv')]
+    restaurant_rows = []
+    schedule_rows = []
+    interval_rows = []
+    for i in range(count):
+        hours = rng.choice(templates)
+        restaurant_id = ID_OFFSET + i
+        restaurant_rows.append({
+            'id': restaurant_id,
+            'restaurant_name': f'Synthetic {i}',
+            'working_hours': hours,
+            'timezone': zones[i % len(zones)] if zones else None,
+        })
+        for schedule in parse_opening_hours(hours):
+            schedule_id = ID_OFFSET + len(schedule_rows)
+            schedule_rows.append({
+                'id': schedule_id,
+                'restaurant_id': restaurant_id,
+                'days': Schedule.days_list_to_string(schedule['days']),
+                'opening_time': schedule['opening_time'],
+                'closing_time': schedule['closing_time'],
+            })
+            interval_rows.extend(
+                {
+                    'schedule_id': schedule_id,
+                    'restaurant_id': restaurant_id,
+                    'start_minute': start,
+                    'end_minute': end,
+                }
+                for start, end in schedule_intervals(
+                    schedule['days'], schedule['opening_time'], schedule['closing_time']
+                )
+            )
+    db.execute(insert(Restaurant), restaurant_rows)
+    db.execute(insert(Schedule), schedule_rows)
+    db.execute(insert(ScheduleInterval), interval_rows)
+    db.flush()
+
+
+def timed(func, moments):
+    durations = []
+    for moment in moments:
+        start = time.perf_counter()
+        func(moment)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return {
+        'mean_ms': statistics.fmean(durations) * 1000,
+        'p50_ms': durations[len(durations) // 2] * 1000,
+        'p99_ms': durations[int(len(durations) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--restaurants', type=int, default=10_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--zones', type=int, default=0, help=f'time zones, at most {len(ZONES)}')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    week_start = datetime(2024, 1, 1)
+    moments = [
+        week_start + timedelta(minutes=rng.randrange(7 * 24 * 60))
+        for _ in range(args.queries)
+    ]
+
+    db = SessionLocal()
+    try:
+        insert_synthetic_restaurants(db, args.restaurants, zones=ZONES[:args.zones])
+
+        index = OpeningHoursIndex()
+        start = time.perf_counter()
+        index.build(db)
+        build_seconds = time.perf_counter() - start
+
+        sql = timed(lambda moment: crud_restaurant.get_by_opening_hours(db, moment), moments)
+        in_process = timed(index.lookup, moments)
+        results = [('sql', sql), ('index', in_process)]
+        if args.zones:
+            instants = [moment.replace(tzinfo=timezone.utc) for moment in moments]
+            results.append((
+                'sql tz',
+                timed(lambda instant: crud_restaurant.get_by_opening_hours(db, instant), instants),
+            ))
+            results.append((
+                'index tz',
+                timed(
+                    lambda instant: index.lookup_zones(
+                        minutes_by_zone(instant, index.zones, settings.DEFAULT_TIMEZONE)
+                    ),
+                    instants,
+                ),
+            ))
+    finally:
+        db.rollback()
+        db.close()
+
+    print(f'restaurants: {args.restaurants}, queries: {args.queries}')
+    print(f'index build: {build_seconds:.3f}s')
+    for label, result in results:
+        print(
+            f"{label:>8}: mean {result['mean_ms']:.3f} ms, "
+            f"p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Compare building the open-restaurants response from ORM entities and
+`RestaurantNameRead` models against the projection query and direct JSON
+encoding.
+
+Synthetic restaurants that are all open at the queried minute are inserted
+inside a transaction that is rolled back at the end, and each path is
+timed and traced with tracemalloc.
+
+    python -m benchmarks.bench_open_response --restaurants 50000
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import insert
+
+from api.api_v1.endpoints.restaurant import _render_restaurant_names
+from benchmarks.bench_open_lookup import ID_OFFSET
+from core.utils import parse_opening_hours
+from core.week import schedule_intervals
+from crud.restaurant import crud_restaurant
+from database_app.database import SessionLocal
+from database_app.models import Restaurant, Schedule, ScheduleInterval
+from schemas.restaurant import RestaurantNameRead
+
+MOMENT = datetime(2024, 1, 3, 12, 0)
+
+
+def insert_open_restaurants(db, count):
+    # Two overlapping schedules each, so the join yields every restaurant twice
+    hours = "Mon-Sun 9 am - 5 pm / Wed 11 am - 2 pm"
+    schedules = parse_opening_hours(hours)
+    restaurant_rows = []
+    schedule_rows = []
+    interval_rows = []
+    for i in range(count):
+        restaurant_id = ID_OFFSET + i
+        restaurant_rows.append({
+            'id': restaurant_id,
+            'restaurant_name': f'Synthetic "{i}" café',
+            'working_hours': hours,
+        })
+        for schedule in schedules:
+            schedule_id = ID_OFFSET + len(schedule_rows)
+            schedule_rows.append({
+                'id': schedule_id,
+                'restaurant_id': restaurant_id,
+                'days': Schedule.days_list_to_string(schedule['days']),
+                'opening_time': schedule['opening_time'],
+                'closing_time': schedule['closing_time'],
+            })
+            interval_rows.extend(
+                {
+                    'schedule_id': schedule_id,
+                    'restaurant_id': restaurant_id,
+                    'start_minute': start,
+                    'end_minute': end,
+                }
+                for start, end in schedule_intervals(
+                    schedule['days'], schedule['opening_time'], schedule['closing_time']
+                )
+            )
+    db.execute(insert(Restaurant), restaurant_rows)
+    db.execute(insert(Schedule), schedule_rows)
+    db.execute(insert(ScheduleInterval), interval_rows)
+    db.flush()
+
+
+def entity_response(db):
+    restaurants = crud_restaurant.get_by_opening_hours(db, MOMENT)
+    return JSONResponse({
+        'description': "Restaurants retrieved successfully",
+        'data': [
+            RestaurantNameRead.model_validate(restaurant).model_dump()
+            for restaurant in restaurants
+        ],
+    }).body
+
+
+def projection_response(db):
+    rows = crud_restaurant.get_names_by_opening_hours(db, MOMENT)
+    return _render_restaurant_names(restaurant_name for _, restaurant_name in rows)
+
+
+def measure(func, db, repeats):
+    durations = []
+    for _ in range(repeats):
+        db.expunge_all()
+        start = time.perf_counter()
+        func(db)
+        durations.append(time.perf_counter() - start)
+    db.expunge_all()
+    tracemalloc.start()
+    body = func(db)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'bytes': len(body),
+        'p50_ms': statistics.median(durations) * 1000,
+        'min_ms': min(durations) * 1000,
+        'peak_mib': peak / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--restaurants', type=int, default=50_000)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        insert_open_restaurants(db, args.restaurants)
+        results = [
+            ('entities', measure(entity_response, db, args.repeats)),
+            ('projection', measure(projection_response, db, args.repeats)),
+        ]
+    finally:
+        db.rollback()
+        db.close()
+
+    print(f'open restaurants: {args.restaurants} (plus loaded data), repeats: {args.repeats}')
+    for label, result in results:
+        print(
+            f"{label:>10}: p50 {result['p50_ms']:.1f} ms, min {result['min_ms']:.1f} ms, "
+            f"peak {result['peak_mib']:.1f} MiB, body {result['bytes']:,} bytes"
+        )
+
+
+if __name__ == '__main__':
+    main()
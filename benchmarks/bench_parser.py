@@ -0,0 +1,83 @@
+"""
+Measure opening hours parsing throughput, dateutil vs the fast path.
+
+A synthetic CSV in the restaurants.csv format is written to a temporary
+file; rows repeat a limited number of distinct hours strings the way chain
+restaurants do. The dateutil parser only runs on the first --legacy-rows
+rows since it is too slow for the full file.
+
+    python -m benchmarks.bench_parser --rows 1000000
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from benchmarks.dataset import write_synthetic_csv
+from core.utils import (
+    _parse_opening_hours_cached,
+    parse_days,
+    parse_opening_hours,
+    parse_time_dateutil,
+    read_csv_data,
+)
+
+
+def legacy_parse_opening_hours(hours_str):
+    """
+    The parser before the fast path: a regex per segment, dateutil per time.
+    """
+    schedules = []
+    for part in [part.strip() for part in hours_str.split('/')]:
+        match = re.match(
+            r'(.+?)\s+(\d{1,2}(:\d{2})?\s*(am|pm)?\s*-\s*\d{1,2}(:\d{2})?\s*(am|pm)?)',
+            part,
+            re.IGNORECASE
+        )
+        if not match:
+            continue
+        opening_str, closing_str = [t.strip() for t in match.group(2).split('-')]
+        schedules.append({
+            'days': parse_days(match.group(1)),
+            'opening_time': parse_time_dateutil(opening_str),
+            'closing_time': parse_time_dateutil(closing_str),
+        })
+    return schedules
+
+
+def rows_per_second(parser, hours):
+    start = time.perf_counter()
+    for hours_str in hours:
+        parser(hours_str)
+    return len(hours) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--distinct', type=int, default=10_000)
+    parser.add_argument('--legacy-rows', type=int, default=50_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'restaurants.csv')
+        write_synthetic_csv(path, args.rows, args.distinct)
+        hours = [row['hours'] for row in read_csv_data(path)]
+
+    uncached = _parse_opening_hours_cached.__wrapped__
+    results = {
+        'dateutil': rows_per_second(legacy_parse_opening_hours, hours[:args.legacy_rows]),
+        'fast path, no cache': rows_per_second(uncached, hours),
+    }
+    _parse_opening_hours_cached.cache_clear()
+    results['fast path, cached'] = rows_per_second(parse_opening_hours, hours)
+
+    print(f'rows: {len(hours)}, distinct hours: {args.distinct}')
+    for label, rate in results.items():
+        print(f'{label:>20}: {rate:,.0f} rows/sec')
+    print(f'{"":>20}  {_parse_opening_hours_cached.cache_info()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare worker start and memory with a shared snapshot against building
+the opening hours index in every worker.
+
+An index over synthetic restaurants is built in memory and published to a
+snapshot file. Worker processes then either map the snapshot or build
+their own index from the same rows, look up random minutes, and report
+how long they took to become ready and their proportional set size (PSS,
+which splits shared pages between the processes mapping them; Linux only).
+
+    python -m benchmarks.bench_snapshot --restaurants 100000 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_occupancy import synthetic_intervals
+from core.schedule_index import OpeningHoursIndex
+from core.snapshot import SnapshotStore
+from core.week import MINUTES_PER_WEEK
+
+
+def proportional_set_size() -> int:
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def synthetic_rows(restaurants):
+    restaurant_ids, starts, ends = synthetic_intervals(restaurants)
+    rows = [(restaurant_id, f'Synthetic {restaurant_id}') for restaurant_id in range(restaurants)]
+    return rows, list(zip(restaurant_ids.tolist(), starts.tolist(), ends.tolist()))
+
+
+def worker(mode, path, restaurants, lookups, barrier, results):
+    index = OpeningHoursIndex()
+    if mode == 'build':
+        rows, intervals = synthetic_rows(restaurants)
+        barrier.wait()
+        start = time.perf_counter()
+        index.load(rows, intervals)
+    else:
+        barrier.wait()
+        start = time.perf_counter()
+        index.use_snapshot(SnapshotStore(path))
+        index.map_snapshot()
+    ready = time.perf_counter() - start
+
+    rng = random.Random(os.getpid())
+    start = time.perf_counter()
+    for _ in range(lookups):
+        # Names are read as the endpoint reads them
+        for _ in index.lookup_minute(rng.randrange(MINUTES_PER_WEEK)):
+            pass
+    results.put((ready, (time.perf_counter() - start) / lookups, proportional_set_size()))
+
+
+def run(mode, path, restaurants, workers, lookups):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(mode, path, restaurants, lookups, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return measurements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--restaurants', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    index = OpeningHoursIndex()
+    index.load(*synthetic_rows(args.restaurants))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'index.snapshot')
+        start = time.perf_counter()
+        SnapshotStore(path).publish(index._table)
+        print(f'restaurants: {args.restaurants:,}, workers: {args.workers}')
+        print(f'snapshot: {os.path.getsize(path) / 2**20:.1f} MiB written in {time.perf_counter() - start:.2f}s')
+        del index
+
+        for mode in ('build', 'map'):
+            measurements = run(mode, path, args.restaurants, args.workers, args.lookups)
+            ready = max(ready for ready, _, _ in measurements)
+            lookup = sum(lookup for _, lookup, _ in measurements) / len(measurements)
+            pss = sum(pss for _, _, pss in measurements)
+            print(
+                f'{mode:>6}: ready in {ready * 1000:.1f} ms, lookup {lookup * 1000:.2f} ms, '
+                f'PSS of all workers {pss / 2**20:.0f} MiB'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Compare a cold startup load, which reads and parses the CSV, with a warm
+one, which reads the parsed rows back from the parse cache.
+
+A synthetic CSV is loaded into the configured database the way startup
+loads restaurants.csv into an empty one; building the opening hours index
+afterwards takes as long either way and is left out. Each round deletes
+the parse cache before the cold load and keeps it for the warm one.
+Parsing alone (CSV or cache to parsed chunks, no database) is timed as
+well.
+
+Loading replaces the restaurants in the configured database, so point it
+at a scratch database; restaurants.csv is loaded back at the end:
+
+    python -m benchmarks.bench_startup --rows 100000 --rounds 3
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.dataset import write_synthetic_csv
+from core.config import settings
+from core.ingest import iter_csv_chunks, parse_chunk
+from core.parse_cache import ParseCache
+from core.utils import _parse_opening_hours_cached, file_content_hash, populate_database_with_restaurants
+from database_app.base import Base
+from database_app.database import SessionLocal, engine, is_sqlite_memory
+from database_app.models import DataImport
+
+
+def startup(path, workers):
+    """
+    Seconds to ingest the CSV, and whether the parsed rows came from the
+    cache. Deleting the restaurants loaded before is left out, as each load
+    deletes what the previous one inserted.
+    """
+    db = SessionLocal()
+    try:
+        report = populate_database_with_restaurants(db, str(path), workers=workers, force=True)
+        return report.seconds, report.from_cache
+    finally:
+        db.close()
+
+
+def parse_only(path, cache_path, content_hash, chunk_size):
+    """
+    Seconds to parse the CSV and to read the same chunks from the cache.
+    """
+    _parse_opening_hours_cached.cache_clear()
+    start = time.perf_counter()
+    for chunk in iter_csv_chunks(path, chunk_size):
+        parse_chunk(chunk)
+    parsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in ParseCache(cache_path).read(content_hash):
+        pass
+    return parsed, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=0, help='parse processes for cold loads')
+    args = parser.parse_args()
+
+    if is_sqlite_memory(engine.url):
+        Base.metadata.create_all(bind=engine)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'restaurants.csv'
+        settings.PARSE_CACHE_PATH = str(Path(directory) / 'restaurants.parsed')
+        write_synthetic_csv(path, args.rows)
+        content_hash = file_content_hash(path)
+
+        timings = {False: [], True: []}
+        try:
+            for _ in range(args.rounds):
+                if os.path.exists(settings.PARSE_CACHE_PATH):
+                    os.remove(settings.PARSE_CACHE_PATH)
+                # The in-process memo of hours strings would make later
+                # cold rounds warmer than a new process
+                _parse_opening_hours_cached.cache_clear()
+                for _ in range(2):
+                    seconds, from_cache = startup(path, args.workers)
+                    timings[from_cache].append(seconds)
+            cache_size = os.path.getsize(settings.PARSE_CACHE_PATH)
+            parse_seconds, cache_seconds = parse_only(
+                path, settings.PARSE_CACHE_PATH, content_hash, settings.INGEST_CHUNK_SIZE
+            )
+        finally:
+            db = SessionLocal()
+            try:
+                db.query(DataImport).filter(DataImport.source == str(path)).delete()
+                db.commit()
+                settings.PARSE_CACHE_PATH = None
+                populate_database_with_restaurants(db, force=True)
+            finally:
+                db.close()
+
+    cold = statistics.median(timings[False])
+    warm = statistics.median(timings[True])
+    print(f'rows: {args.rows:,}, rounds: {args.rounds}, database: {engine.dialect.name}')
+    print(f'parse cache: {cache_size / 2 ** 20:.1f} MiB, CSV {path.name} content hash {content_hash[:12]}')
+    print(f'  parse CSV only: {parse_seconds * 1000:8.0f} ms')
+    print(f' read cache only: {cache_seconds * 1000:8.0f} ms')
+    print(f' cold startup load: {cold * 1000:8.0f} ms')
+    print(f' warm startup load: {warm * 1000:8.0f} ms ({(1 - warm / cold) * 100:.0f}% less)')
+
+
+if __name__ == '__main__':
+    main()
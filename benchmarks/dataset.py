@@ -0,0 +1,100 @@
+"""
+Generate synthetic restaurants in the restaurants.csv format.
+
+Hours follow the grammar of the real file: day ranges and lists
+("Mon-Thu, Sun"), one to three `/` separated segments that split the week,
+times with and without minutes, and late hours that close after midnight.
+Rows repeat a limited number of distinct hours strings the way chain
+restaurants do. The output only depends on the arguments.
+
+    python -m benchmarks.dataset restaurants-100k.csv --rows 100000
+"""
+import argparse
+import csv
+import random
+
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+# Spellings found in the wild besides the three letter ones
+DAY_ALIASES = {'Tue': ['Tue', 'Tues'], 'Thu': ['Thu', 'Thurs']}
+NAME_WORDS = [
+    "Sushi", "Burger", "Bar", "Grill", "Kitchen", "Taqueria", "Noodle",
+    "House", "Cafe", "Diner", "Bistro", "Pho", "Chicken + Honey", "Food Hall",
+    "Pizzeria", "Tavern", "Smokehouse", "& Co.", "Brasserie", "Cantina",
+]
+OWNERS = ["Beasley's", "Morgan St", "The Cowfish", "Garland", "Mama's", "Big Ed's", "Sitti", "Bida Manda"]
+
+
+def day_token(rng, index):
+    day = DAYS[index]
+    return rng.choice(DAY_ALIASES.get(day, [day]))
+
+
+def day_expression(rng, indexes):
+    """
+    Spell sorted day indexes as ranges and single days joined by commas.
+    """
+    runs = []
+    for index in indexes:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return ', '.join(
+        day_token(rng, first) if first == last else f'{day_token(rng, first)}-{day_token(rng, last)}'
+        for first, last in runs
+    )
+
+
+def time_token(rng, minute_of_day):
+    hour, minute = divmod(minute_of_day % (24 * 60), 60)
+    meridiem = 'am' if hour < 12 else 'pm'
+    if minute:
+        return f'{hour % 12 or 12}:{minute:02d} {meridiem}'
+    return f'{hour % 12 or 12}{rng.choice(["", "", ":00"])} {meridiem}'
+
+
+def synthetic_hours(rng):
+    # Split the week into groups of days with their own hours
+    groups = [[] for _ in range(rng.choice([1, 1, 2, 2, 2, 3]))]
+    for index in range(len(DAYS)):
+        if rng.random() < 0.05:
+            continue  # closed that day
+        groups[rng.randrange(len(groups))].append(index)
+
+    segments = []
+    for days in groups:
+        if not days:
+            continue
+        opening = rng.choice([6, 7, 8, 9, 10, 11, 11, 11, 12, 17]) * 60 + rng.choice([0, 0, 0, 30, 15, 45])
+        # Some places close after midnight, a few at 4 am
+        closing = opening + rng.choice([6, 8, 10, 11, 12, 13, 14, 15]) * 60 + rng.choice([0, 0, 30])
+        segments.append(f'{day_expression(rng, days)} {time_token(rng, opening)} - {time_token(rng, closing)}')
+    return '  / '.join(segments) or 'Mon-Sun 11 am - 10 pm'
+
+
+def synthetic_name(rng, i):
+    return f'{rng.choice(OWNERS)} {rng.choice(NAME_WORDS)} #{i}'
+
+
+def write_synthetic_csv(path, rows, distinct=10_000, seed=0):
+    rng = random.Random(seed)
+    hours = [synthetic_hours(rng) for _ in range(distinct)]
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+        writer.writerow(['Restaurant Name', 'Hours'])
+        for i in range(rows):
+            writer.writerow([synthetic_name(rng, i), rng.choice(hours)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--distinct', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_csv(args.path, args.rows, args.distinct, args.seed)
+
+
+if __name__ == '__main__':
+    main()
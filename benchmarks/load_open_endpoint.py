@@ -0,0 +1,102 @@
+"""
+Load test the open-restaurants endpoint with many concurrent clients.
+
+Runs the async endpoint of the app next to a sync variant that uses the
+threadpool and the sync session, both in-process through httpx's ASGI
+transport and both on the SQL path (the in-process index is not built).
+The sync variant opens its session inside the endpoint: with a `get_db`
+dependency, sessions wait for a free thread to be closed while threads
+wait for their connections, and the run stalls on pool timeouts.
+
+Compare on Postgres. On SQLite the async session goes through aiosqlite,
+whose thread per connection makes the async variant the slower one.
+
+    python -m benchmarks.load_open_endpoint --clients 500 --requests 4
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+import httpx
+from dateutil.parser import parse
+from fastapi import FastAPI
+
+from crud.restaurant import crud_restaurant
+from database_app.database import SessionLocal
+from main import app
+from schemas.restaurant import RestaurantNameRead
+
+sync_app = FastAPI()
+
+
+@sync_app.get("/api/v1/restaurants/{opening_hours}")
+def get_open_restaurants_sync(*, opening_hours: str) -> Any:
+    with SessionLocal() as db:
+        restaurants = crud_restaurant.get_by_opening_hours(db=db, opening_hours=parse(opening_hours))
+    return {
+        'description': "Restaurants retrieved successfully",
+        'data': [
+            RestaurantNameRead.model_validate(restaurant).model_dump()
+            for restaurant in restaurants
+        ],
+    }
+
+
+async def run_clients(application, clients, requests_per_client, seed=0):
+    rng = random.Random(seed)
+    week_start = datetime(2024, 1, 1)
+    latencies = []
+    errors = []
+
+    async def client_loop(client):
+        for _ in range(requests_per_client):
+            moment = week_start + timedelta(minutes=rng.randrange(7 * 24 * 60))
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"/api/v1/restaurants/{moment.isoformat()}")
+                # 404 is the app's answer for a minute with nothing open
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            except Exception as e:
+                # e.g. pool checkout timeouts once the pool is exhausted
+                errors.append(type(e).__name__)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    completed = len(latencies)
+    latencies = sorted(latencies) or [float('nan')]
+    return {
+        'errors': len(errors),
+        'requests_per_second': completed / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=4, help='requests per client')
+    args = parser.parse_args()
+
+    print(f'clients: {args.clients}, requests per client: {args.requests}')
+    for label, application in (('sync', sync_app), ('async', app)):
+        result = asyncio.run(run_clients(application, args.clients, args.requests))
+        print(
+            f"{label:>6}: {result['requests_per_second']:,.0f} req/s, "
+            f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+            f"{result['errors']} errors"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Load test a thundering herd on the open-restaurants endpoint, with and
+without coalescing of identical requests.
+
+Each burst sends `--clients` concurrent requests for the same minute, as
+clients asking what is open now do at the top of each minute, with the
+response cache cleared first so that none of them is served from it. The
+app runs in-process through httpx's ASGI transport on the SQL path (the
+in-process index is not built), and the statements executed by the async
+engine are counted.
+
+    python -m benchmarks.load_thundering_herd --clients 500 --bursts 5
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy import event
+
+from core.config import settings
+from core.response_cache import response_cache
+from core.single_flight import open_restaurants_flight
+from database_app.database import async_engine
+from main import app
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.count_statement)
+
+    def count_statement(self, *args):
+        self.count += 1
+
+
+async def run_bursts(clients, bursts, counter):
+    start_minute = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    latencies = []
+    errors = 0
+    statements = counter.count
+    flight = open_restaurants_flight.stats()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def request(url):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                response = await client.get(url)
+                # 404 is the app's answer for a minute with nothing open
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            except Exception:
+                # e.g. pool checkout timeouts once the pool is exhausted
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for burst in range(bursts):
+            response_cache.clear()
+            url = f"/api/v1/restaurants/{(start_minute + timedelta(minutes=burst)).isoformat()}"
+            await asyncio.gather(*(request(url) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    after = open_restaurants_flight.stats()
+    latencies = sorted(latencies) or [float('nan')]
+    return {
+        'statements': counter.count - statements,
+        'executed': after['executed'] - flight['executed'],
+        'coalesced': after['coalesced'] - flight['coalesced'],
+        'errors': errors,
+        'seconds': elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--bursts', type=int, default=5)
+    args = parser.parse_args()
+
+    counter = StatementCounter(async_engine.sync_engine)
+    print(f'clients per burst: {args.clients}, bursts: {args.bursts}, database: {async_engine.dialect.name}')
+    for coalesce in (False, True):
+        settings.COALESCE_REQUESTS = coalesce
+        result = asyncio.run(run_bursts(args.clients, args.bursts, counter))
+        if not coalesce:
+            # Every request computes its own response
+            result['executed'] = args.clients * args.bursts - result['errors']
+        print(
+            f"{'coalesced' if coalesce else 'separate':>9}: {result['statements']:,} statements, "
+            f"{result['executed']:,} computed, {result['coalesced']:,} joined, "
+            f"{result['seconds']:.2f} s, p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+            f"{result['errors']} errors"
+        )
+
+
+if __name__ == '__main__':
+    main()
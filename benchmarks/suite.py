@@ -0,0 +1,158 @@
+"""
+Time the main code paths on synthetic datasets and write JSON results.
+
+For each size a restaurants.csv-compatible file is generated, then
+read_csv_data, parse_opening_hours, populate_database_with_restaurants,
+get_by_opening_hours and the open-restaurants endpoint (through
+TestClient, with and without the response cache) are timed.
+
+Loading replaces the restaurants in the configured database, so point it
+at a local scratch database. Unless --no-restore is given, restaurants.csv
+is loaded back at the end. Results carry the git commit so runs can be
+compared between commits:
+
+    python -m benchmarks.suite --sizes 10000 100000 1000000 --output results.json
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from benchmarks.dataset import write_synthetic_csv
+from core.response_cache import response_cache
+from core.utils import _parse_opening_hours_cached, parse_opening_hours, populate_database_with_restaurants, read_csv_data
+from crud.restaurant import crud_restaurant
+from database_app.database import SessionLocal, engine
+from database_app.models import DataImport
+from main import app
+
+WEEK_START = datetime(2024, 1, 1)
+
+
+def summary(durations) -> dict:
+    durations = sorted(durations)
+    return {
+        'runs': len(durations),
+        'mean_ms': statistics.fmean(durations) * 1000,
+        'p50_ms': durations[len(durations) // 2] * 1000,
+        'p99_ms': durations[int(len(durations) * 0.99)] * 1000,
+        'min_ms': durations[0] * 1000,
+    }
+
+
+def timed_once(func) -> dict:
+    start = time.perf_counter()
+    func()
+    return summary([time.perf_counter() - start])
+
+
+def timed_each(func, arguments) -> dict:
+    durations = []
+    for argument in arguments:
+        start = time.perf_counter()
+        func(argument)
+        durations.append(time.perf_counter() - start)
+    return summary(durations)
+
+
+def random_moments(count, seed):
+    rng = random.Random(seed)
+    return [WEEK_START + timedelta(minutes=rng.randrange(7 * 24 * 60)) for _ in range(count)]
+
+
+def run_size(db, client, path, rows, queries, seed):
+    write_synthetic_csv(path, rows, seed=seed)
+    results = {'rows': rows, 'file_bytes': Path(path).stat().st_size}
+
+    csv_rows = []
+    results['read_csv_data'] = timed_once(lambda: csv_rows.extend(read_csv_data(path)))
+
+    hours = [row['hours'] for row in csv_rows]
+    _parse_opening_hours_cached.cache_clear()
+    results['parse_opening_hours'] = timed_once(lambda: [parse_opening_hours(h) for h in hours])
+    results['parse_opening_hours']['rows_per_second'] = rows / (results['parse_opening_hours']['min_ms'] / 1000)
+
+    reports = []
+    results['populate_database_with_restaurants'] = timed_once(
+        lambda: reports.append(populate_database_with_restaurants(db, str(path), force=True))
+    )
+    results['populate_database_with_restaurants']['error_count'] = reports[0].error_count
+
+    moments = random_moments(queries, seed)
+    results['get_by_opening_hours'] = timed_each(
+        lambda moment: crud_restaurant.get_by_opening_hours(db, moment), moments
+    )
+
+    def request(moment, clear_cache):
+        if clear_cache:
+            response_cache.clear()
+        client.get(f"/api/v1/restaurants/{moment.isoformat()}")
+
+    results['endpoint_uncached'] = timed_each(lambda moment: request(moment, True), moments)
+    results['endpoint_cached'] = timed_each(lambda moment: request(moment, False), moments + moments)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--queries', type=int, default=200, help='lookups and requests per size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--no-restore', action='store_true', help='leave the last dataset loaded')
+    args = parser.parse_args()
+
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'database': engine.dialect.name,
+        'queries': args.queries,
+        'seed': args.seed,
+        'sizes': [],
+    }
+    # Without the lifespan the in-process index is not built, so the endpoint
+    # is measured on its SQL path
+    client = TestClient(app)
+    db = SessionLocal()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'restaurants.csv'
+            for rows in args.sizes:
+                print(f'{rows:,} rows...', file=sys.stderr)
+                results['sizes'].append(run_size(db, client, path, rows, args.queries, args.seed))
+            db.query(DataImport).filter(DataImport.source == str(path)).delete()
+            db.commit()
+        if not args.no_restore:
+            populate_database_with_restaurants(db, force=True)
+    finally:
+        db.close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 import secrets
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import Any, List, Literal, Optional
 
 from pydantic import PostgresDsn, field_validator
 from pydantic_core.core_schema import ValidationInfo
@@ -13,11 +13,58 @@ class Settings(BaseSettings):
     API_V1_STR: str = "/api/v1"
     SECRET_KEY: str = secrets.token_urlsafe(32)
     BACKEND_CORS_ORIGINS: List[str] = ["*"]
-    POSTGRES_SERVER: str
-    POSTGRES_USER: str
-    POSTGRES_PASSWORD: str
-    POSTGRES_DB: str
-    DATABASE_URI: Optional[PostgresDsn] = None
+    # postgres, sqlite (a file at SQLITE_PATH) or sqlite-memory
+    DB_BACKEND: Literal["postgres", "sqlite", "sqlite-memory"] = "postgres"
+    POSTGRES_SERVER: Optional[str] = None
+    POSTGRES_USER: Optional[str] = None
+    POSTGRES_PASSWORD: Optional[str] = None
+    POSTGRES_DB: Optional[str] = None
+    SQLITE_PATH: str = "restaurants.db"
+    # Bytes of a SQLite database file read through memory mapping
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    # Seconds a SQLite connection waits for another one's write lock, such
+    # as that of a worker loading the data at startup
+    SQLITE_BUSY_TIMEOUT: float = 60.0
+    DATABASE_URI: Optional[str] = None
+    # Connection pool of each engine (sync and async)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+    # Server-side statement timeout in milliseconds; None keeps the default
+    DB_STATEMENT_TIMEOUT: Optional[int] = None
+    # Parse processes for CSV ingestion; None uses every CPU
+    INGEST_WORKERS: Optional[int] = None
+    INGEST_CHUNK_SIZE: int = 5000
+    # File the parsed rows of the last CSV loaded are kept in, so that
+    # loading the same content again skips parsing; None disables it
+    PARSE_CACHE_PATH: Optional[str] = None
+    # Cached open-restaurant responses, at most one per minute of the week
+    RESPONSE_CACHE_SIZE: int = 10080
+    # Seconds clients may reuse a response before revalidating its ETag
+    RESPONSE_CACHE_MAX_AGE: int = 0
+    # Concurrent open-restaurant requests for the same minute share one
+    # computation
+    COALESCE_REQUESTS: bool = True
+    # Rows fetched per server-side cursor round trip when streaming NDJSON
+    STREAM_BATCH_SIZE: int = 1000
+    # File the opening hours index is shared through between worker
+    # processes; None builds it in every process
+    SNAPSHOT_PATH: Optional[str] = None
+    # Seconds between checks for a snapshot replaced by another worker
+    SNAPSHOT_POLL_INTERVAL: float = 1.0
+    # Seconds between checks for data loaded by another process, such as
+    # `python -m core.ingest --diff`
+    DATA_POLL_INTERVAL: float = 2.0
+    # Opened and closed messages kept for subscribers that fall behind or
+    # reconnect, and the most subscribers each process serves
+    EVENTS_HISTORY: int = 256
+    EVENTS_MAX_SUBSCRIBERS: int = 10_000
+    # Time zone of restaurants without one, for queries at an aware datetime
+    DEFAULT_TIMEZONE: str = "UTC"
+    # Request timing, Server-Timing headers and the /metrics endpoint
+    METRICS_ENABLED: bool = True
 
     @field_validator("DATABASE_URI", mode="before")
     @classmethod
@@ -26,13 +73,24 @@ class Settings(BaseSettings):
     ) -> Any:
         if isinstance(v, str):
             return v
+        backend = values.data.get("DB_BACKEND")
+        if backend == "sqlite":
+            return f"sqlite:///{values.data.get('SQLITE_PATH')}"
+        if backend == "sqlite-memory":
+            # Shared cache so that the sync and async engines see one database
+            return "sqlite:///file:restaurants?mode=memory&cache=shared&uri=true"
+        missing = [
+            name for name in ("POSTGRES_SERVER", "POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB")
+            if values.data.get(name) is None
+        ]
+        if missing:
+            raise ValueError(f"{', '.join(missing)} must be set for the postgres backend")
         return PostgresDsn.build(
             scheme="postgresql+psycopg",
             username=values.data.get("POSTGRES_USER"),
             password=values.data.get("POSTGRES_PASSWORD"),
             host=values.data.get("POSTGRES_SERVER"),
             path=f"{values.data.get('POSTGRES_DB') or ''}",
-        )
-
+        ).unicode_string()
 
 settings = Settings(_env_file='.env', _env_file_encoding="utf-8")
@@ -0,0 +1,276 @@
+"""
+Live opened and closed events of the restaurants, for server-sent events.
+
+One wheel holds, for every time zone, the minutes of the week at which
+restaurants open or close. Once a minute a single sweep reads the slots
+the minute passed over in each zone, works out which of those restaurants
+opened or closed, and renders one message per kind; every subscriber is
+woken by the same event and is sent the same bytes. Subscribers cost no
+timer and no query of their own, however many there are.
+"""
+import asyncio
+import datetime
+import json
+import secrets
+from collections import deque
+from itertools import islice
+from operator import attrgetter
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.metrics import Gauge, metrics
+from core.response_cache import response_cache
+from core.schedule_index import RestaurantEntry
+from core.week import MINUTES_PER_WEEK, change_points, minute_of_week, next_change, zone_info
+from database_app.models import Restaurant, ScheduleInterval
+
+HEARTBEAT = b': keepalive\n\n'
+SUBSCRIBED = b': subscribed\n\n'
+
+entry_id = attrgetter('id')
+
+
+def wall_clock(at: datetime.datetime, zone: str) -> datetime.datetime:
+    """
+    Naive local time of `at` in a zone, truncated to the minute; a naive
+    `at` already is local time everywhere.
+    """
+    if at.tzinfo is not None:
+        at = at.astimezone(zone_info(zone)).replace(tzinfo=None)
+    return at.replace(second=0, microsecond=0)
+
+
+def render_event(event_id: str, event: str, data) -> bytes:
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f'id: {event_id}\nevent: {event}\ndata: {payload}\n\n'.encode('utf-8')
+
+
+class TransitionWheel:
+    """
+    Restaurant ids by the minute of the week they open or close at, one
+    wheel per time zone, along with each restaurant's change points.
+    """
+
+    def __init__(self, restaurants, intervals, zones=None):
+        self.entries = {
+            restaurant_id: RestaurantEntry(restaurant_id, name)
+            for restaurant_id, name in restaurants
+        }
+        zones = zones or {}
+        self.zones = {restaurant_id: zones.get(restaurant_id) for restaurant_id in self.entries}
+        restaurant_intervals = {restaurant_id: [] for restaurant_id in self.entries}
+        for restaurant_id, start, end in intervals:
+            if restaurant_id in restaurant_intervals:
+                restaurant_intervals[restaurant_id].append((start, end))
+        self.changes = {
+            restaurant_id: change_points(restaurant_intervals[restaurant_id])
+            for restaurant_id in self.entries
+        }
+        self.slots = {zone: {} for zone in self.zones.values()}
+        for restaurant_id, points in self.changes.items():
+            slots = self.slots[self.zones[restaurant_id]]
+            for minute in points.minutes:
+                slots.setdefault(minute, []).append(restaurant_id)
+        # The last local minute swept in each zone
+        self.swept = {}
+
+    @classmethod
+    def build(cls, db: Session) -> 'TransitionWheel':
+        rows = db.query(Restaurant.id, Restaurant.restaurant_name, Restaurant.timezone).all()
+        intervals = db.query(
+            ScheduleInterval.restaurant_id,
+            ScheduleInterval.start_minute,
+            ScheduleInterval.end_minute,
+        ).all()
+        return cls(
+            [(restaurant_id, name) for restaurant_id, name, _ in rows],
+            intervals,
+            zones={restaurant_id: zone for restaurant_id, _, zone in rows},
+        )
+
+    def is_open(self, restaurant_id, wall: datetime.datetime, overrides=None) -> bool:
+        """
+        Whether a restaurant is open at a local time, the schedule
+        exceptions of its date taking precedence over the weekly hours.
+        """
+        if overrides is not None:
+            return overrides.is_open(restaurant_id, self.changes[restaurant_id], wall)
+        return next_change(self.changes[restaurant_id], minute_of_week(wall))[0]
+
+    def _candidates(self, zone, before, now, overrides):
+        """
+        Ids of the restaurants of a zone that may have opened or closed
+        after the local time `before` up to `now`.
+        """
+        elapsed = int((now - before).total_seconds()) // 60
+        if elapsed >= MINUTES_PER_WEEK:
+            return {restaurant_id for restaurant_id, restaurant_zone in self.zones.items() if restaurant_zone == zone}
+        slots = self.slots[zone]
+        candidates = set()
+        first = minute_of_week(before) + 1
+        # A single minute but for catching up, or hours skipped by the
+        # clocks going forward
+        for minute in range(first, first + elapsed):
+            candidates.update(slots.get(minute % MINUTES_PER_WEEK, ()))
+        if overrides is not None:
+            day = before.date()
+            while day <= now.date():
+                candidates.update(
+                    restaurant_id for restaurant_id, override in overrides.on(day).items()
+                    if override.zone == zone and restaurant_id in self.entries
+                )
+                day += datetime.timedelta(days=1)
+        return candidates
+
+    def transitions(self, previous: datetime.datetime, at: datetime.datetime, overrides=None, default_zone='UTC'):
+        """
+        Entries, ordered by id, of the restaurants that opened and of those
+        that closed after the minute of `previous` up to that of `at`.
+
+        Each zone is swept over the local minutes between the two, so
+        restaurants changing in an hour the clocks skip are caught. When the
+        clocks go back, nothing happens until they pass the last local
+        minute swept, so an hour repeated is swept once. A restaurant
+        opening and closing again in between has no net change.
+        """
+        opened = []
+        closed = []
+        for zone in self.slots:
+            before = wall_clock(previous, zone or default_zone)
+            now = wall_clock(at, zone or default_zone)
+            before = max(before, self.swept.get(zone, before))
+            if now <= before:
+                continue
+            self.swept[zone] = now
+            for restaurant_id in self._candidates(zone, before, now, overrides):
+                is_open = self.is_open(restaurant_id, now, overrides)
+                if is_open != self.is_open(restaurant_id, before, overrides):
+                    (opened if is_open else closed).append(self.entries[restaurant_id])
+        return sorted(opened, key=entry_id), sorted(closed, key=entry_id)
+
+
+class TransitionFeed:
+    """
+    Opened and closed events swept from a `TransitionWheel`, broadcast to
+    every subscriber.
+
+    The last `history` messages are kept, numbered, so a subscriber that
+    falls behind, or reconnects with the id of the last event it got, is
+    sent what it missed; one asking for messages no longer kept is told to
+    resync instead. Ids are prefixed with an epoch drawn when the feed is
+    created, so an id handed out by another worker, or before a restart,
+    is told to resync rather than taken for one of this feed's.
+    """
+
+    def __init__(self, history, epoch=None):
+        self.epoch = epoch or secrets.token_hex(4)
+        self._wheel = (None, None)
+        self._messages = deque(maxlen=history)
+        self._sequence = 0
+        # (loop, event) made by the first subscriber to wait, in its running
+        # loop: the feed is built at import, before any loop runs
+        self._published = None
+        self.subscribers = 0
+
+    def sweep(self, db: Session, previous, at, overrides=None, default_zone='UTC'):
+        """
+        (event, data) pairs of the restaurants that opened and closed after
+        `previous` up to `at`. The wheel is rebuilt whenever the response
+        cache is cleared, and subscribers are then told to resync, since
+        changes to the data are not transitions.
+        """
+        generation, wheel = self._wheel
+        events = []
+        if wheel is None or generation != response_cache.generation:
+            generation = response_cache.generation
+            if wheel is not None:
+                events.append(('resync', {'at': at.isoformat()}))
+            swept = wheel.swept if wheel is not None else {}
+            wheel = TransitionWheel.build(db)
+            wheel.swept.update(swept)
+            self._wheel = (generation, wheel)
+        opened, closed = wheel.transitions(previous, at, overrides, default_zone)
+        for event, entries in (('opened', opened), ('closed', closed)):
+            if entries:
+                events.append((event, {
+                    'at': at.isoformat(),
+                    'restaurants': [{'id': entry.id, 'restaurant_name': entry.restaurant_name} for entry in entries],
+                }))
+        return events
+
+    def _append(self, message: bytes):
+        self._messages.append(message)
+        self._sequence += 1
+        published, self._published = self._published, None
+        if published is not None:
+            published[1].set()
+
+    async def _wait_published(self):
+        """
+        Wait for the next message, on an event of the running loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._published is None or self._published[0] is not loop:
+            self._published = (loop, asyncio.Event())
+        await self._published[1].wait()
+
+    def _event_id(self, sequence: int) -> str:
+        return f'{self.epoch}-{sequence}'
+
+    def _resume_from(self, last_event_id: str):
+        """
+        Sequence number of an id this feed handed out, None for any other.
+        """
+        epoch, _, sequence = last_event_id.rpartition('-')
+        if epoch != self.epoch or not sequence.isdigit() or int(sequence) > self._sequence:
+            return None
+        return int(sequence)
+
+    def publish(self, event: str, data):
+        self._append(render_event(self._event_id(self._sequence + 1), event, data))
+
+    def heartbeat(self):
+        """
+        Keep idle connections from timing out in proxies.
+        """
+        self._append(HEARTBEAT)
+
+    async def subscribe(self, last_event_id=None):
+        """
+        Yield the messages published from now on, or after `last_event_id`.
+        """
+        self.subscribers += 1
+        try:
+            sequence = self._sequence
+            resumed = sequence
+            if last_event_id is not None:
+                resumed = self._resume_from(last_event_id)
+            yield SUBSCRIBED
+            if resumed is None:
+                yield render_event(self._event_id(sequence), 'resync', {})
+            else:
+                sequence = resumed
+            while True:
+                if sequence == self._sequence:
+                    await self._wait_published()
+                first = self._sequence - len(self._messages) + 1
+                if sequence + 1 < first:
+                    sequence = first - 1
+                    yield render_event(self._event_id(sequence), 'resync', {})
+                # Copied first, the deque moves on while the messages are sent
+                last = self._sequence
+                pending = list(islice(self._messages, sequence + 1 - first, None))
+                sequence = last
+                for message in pending:
+                    yield message
+        finally:
+            self.subscribers -= 1
+
+
+transition_feed = TransitionFeed(history=settings.EVENTS_HISTORY)
+
+metrics.register(Gauge(
+    'event_subscribers', 'Clients subscribed to opened and closed events.',
+    lambda: transition_feed.subscribers,
+))
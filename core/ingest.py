@@ -0,0 +1,451 @@
+"""
+Streaming CSV ingestion: chunked reader -> parse processes -> batched writer.
+
+    python -m core.ingest restaurants.csv
+    python -m core.ingest schedule_exceptions.csv --exceptions
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.parse_cache import ParseCache
+from core.response_cache import response_cache
+from core.schedule_index import invalidate_opening_hours, opening_hours_index
+from core.utils import (
+    acquire_loader_lock,
+    bulk_insert_restaurants,
+    file_content_hash,
+    insert_rows,
+    insert_schedules,
+    parse_opening_hours,
+    parse_times,
+    populate_database_with_restaurants,
+    record_import,
+    unparsed_segments,
+)
+from core.week import zone_info
+from database_app.database import SessionLocal
+from database_app.models import Restaurant, Schedule, ScheduleException
+
+logger = logging.getLogger(__name__)
+
+# Smaller files are parsed in-process; starting workers would cost more
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+# Errors kept on the report; every error is logged either way
+MAX_REPORTED_ERRORS = 1000
+
+RowError = namedtuple('RowError', ['line', 'name', 'message'])
+
+
+@dataclass
+class IngestReport:
+    rows: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+    seconds: float = 0.0
+    # Whether the parsed rows came from the parse cache
+    from_cache: bool = False
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class ReloadReport:
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def report_errors(report, csv_file_path, errors):
+    report.error_count += len(errors)
+    for error in errors:
+        logger.warning('%s line %s: %s', csv_file_path, error.line, error.message)
+    report.errors.extend(errors[:MAX_REPORTED_ERRORS - len(report.errors)])
+
+
+def iter_csv_chunks(csv_file_path, chunk_size):
+    """
+    Yield lists of (line, name, hours) rows, skipping the header.
+    """
+    with open(csv_file_path, 'r', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)
+        rows = ((reader.line_num, row) for row in reader)
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            yield chunk
+
+
+def row_fields(row):
+    """
+    Name, hours and time zone (None if not given) of a CSV row of two or
+    three columns.
+    """
+    timezone = row[2].strip() if len(row) == 3 else ''
+    return row[0].strip('"'), row[1].strip(), timezone or None
+
+
+def parse_row(line, row):
+    """
+    Parse one CSV row into a restaurant for `bulk_insert_restaurants`, or
+    None if it cannot be used, and a `RowError` for every problem found.
+    """
+    if len(row) not in (2, 3):
+        return None, [RowError(line, None, f'expected 2 or 3 columns, got {len(row)}')]
+    # An optional third column holds the restaurant's time zone
+    name, hours, timezone = row_fields(row)
+    if timezone is not None:
+        try:
+            zone_info(timezone)
+        except (KeyError, ValueError):
+            return None, [RowError(line, name, f'unknown time zone {timezone!r}')]
+    try:
+        schedules = parse_opening_hours(hours)
+    except ValueError as e:
+        return None, [RowError(line, name, f'invalid hours {hours!r}: {e}')]
+    errors = [
+        RowError(line, name, f'unrecognised hours segment {segment!r}')
+        for segment in unparsed_segments(hours)
+    ]
+    return {'name': name, 'hours': hours, 'timezone': timezone, 'schedules': schedules}, errors
+
+
+def parse_chunk(chunk):
+    """
+    Parse one chunk of CSV rows; runs in a worker process.
+
+    Returns the restaurants ready for `bulk_insert_restaurants` and a
+    `RowError` for every row or hours segment that could not be used.
+    """
+    restaurants = []
+    errors = []
+    for line, row in chunk:
+        restaurant, row_errors = parse_row(line, row)
+        if restaurant is not None:
+            restaurants.append(restaurant)
+        errors.extend(row_errors)
+    return restaurants, errors
+
+
+def ingest_csv(
+    db: Session, csv_file_path, *, workers=None, chunk_size=None, cache_path=None, content_hash=None,
+):
+    """
+    Stream a restaurants CSV into the database without committing.
+
+    At most two chunks per worker are in flight at any time, so memory stays
+    bounded regardless of file size, and chunks are written in file order.
+
+    With a `cache_path`, chunks are loaded from the `ParseCache` there when
+    it holds this content, and saved to it as they are parsed otherwise.
+    """
+    workers = settings.INGEST_WORKERS if workers is None else workers
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunk_size = chunk_size or settings.INGEST_CHUNK_SIZE
+    if os.path.getsize(csv_file_path) < PARALLEL_MIN_BYTES:
+        workers = 0
+
+    report = IngestReport()
+    start = time.perf_counter()
+    cache = ParseCache(cache_path) if cache_path else None
+    if cache is not None:
+        content_hash = content_hash or file_content_hash(csv_file_path)
+    save = None
+
+    def write(row_count, parsed):
+        if save is not None:
+            save(row_count, parsed)
+        restaurants, errors = parsed
+        bulk_insert_restaurants(db, restaurants)
+        report.rows += row_count
+        report_errors(report, csv_file_path, errors)
+
+    cached = cache.read(content_hash) if cache is not None else None
+    if cached is not None:
+        report.from_cache = True
+        for row_count, parsed in cached:
+            write(row_count, parsed)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    with cache.writer(content_hash) if cache is not None else nullcontext() as save:
+        chunks = iter_csv_chunks(csv_file_path, chunk_size)
+        if workers <= 1:
+            for chunk in chunks:
+                write(len(chunk), parse_chunk(chunk))
+        else:
+            # Spawned workers do not inherit the parent's database connections
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                pending = deque()
+
+                def write_oldest():
+                    row_count, future = pending.popleft()
+                    write(row_count, future.result())
+
+                for chunk in chunks:
+                    # Backpressure: wait for the oldest chunk before reading on
+                    if len(pending) >= 2 * workers:
+                        write_oldest()
+                    pending.append((len(chunk), executor.submit(parse_chunk, chunk)))
+                while pending:
+                    write_oldest()
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def row_hash(hours, timezone) -> bytes:
+    return hashlib.blake2b(f'{hours or ""}\0{timezone or ""}'.encode(), digest_size=16).digest()
+
+
+def _delete_restaurants(db: Session, restaurant_ids, batch_size):
+    for start in range(0, len(restaurant_ids), batch_size):
+        db.execute(
+            delete(Restaurant).where(Restaurant.id.in_(restaurant_ids[start:start + batch_size])),
+            execution_options={'synchronize_session': False},
+        )
+
+
+def _apply_changes(db: Session, updated, inserted):
+    """
+    Give updated (restaurant_id, restaurant) pairs new hours and schedules,
+    and insert new restaurants.
+    """
+    if updated:
+        restaurant_ids = [restaurant_id for restaurant_id, _ in updated]
+        db.execute(update(Restaurant), [
+            {'id': restaurant_id, 'working_hours': restaurant['hours'], 'timezone': restaurant['timezone']}
+            for restaurant_id, restaurant in updated
+        ])
+        # Intervals go with their schedules through ON DELETE CASCADE
+        db.execute(
+            delete(Schedule).where(Schedule.restaurant_id.in_(restaurant_ids)),
+            execution_options={'synchronize_session': False},
+        )
+        insert_schedules(db, restaurant_ids, [restaurant for _, restaurant in updated])
+    bulk_insert_restaurants(db, inserted)
+
+
+def diff_csv(db: Session, csv_file_path, report: ReloadReport, chunk_size=None):
+    """
+    Apply the rows of a restaurants CSV that differ from the stored
+    restaurants, without committing, counting them in `report`.
+
+    Rows are matched to restaurants by name, the n-th row of a name to the
+    n-th restaurant of that name by id, and compared by a hash of their
+    hours and time zone, so only new and changed rows are parsed. Changed
+    restaurants keep their id, and so their schedule exceptions, and get
+    new schedules; restaurants no longer in the file are deleted. A row
+    that cannot be parsed leaves its restaurant as it was.
+    """
+    chunk_size = chunk_size or settings.INGEST_CHUNK_SIZE
+    stored = {}
+    for restaurant_id, name, hours, timezone in db.execute(
+        select(
+            Restaurant.id, Restaurant.restaurant_name, Restaurant.working_hours, Restaurant.timezone,
+        ).order_by(Restaurant.id)
+    ):
+        stored.setdefault(name, deque()).append((restaurant_id, row_hash(hours, timezone)))
+
+    for chunk in iter_csv_chunks(csv_file_path, chunk_size):
+        updated = []
+        inserted = []
+        for line, row in chunk:
+            matches = stored.get(row[0].strip('"')) if row else None
+            restaurant_id, stored_hash = matches.popleft() if matches else (None, None)
+            if len(row) in (2, 3) and stored_hash == row_hash(*row_fields(row)[1:]):
+                report.unchanged += 1
+                continue
+            restaurant, errors = parse_row(line, row)
+            report_errors(report, csv_file_path, errors)
+            if restaurant is None:
+                continue
+            if restaurant_id is None:
+                inserted.append(restaurant)
+            else:
+                updated.append((restaurant_id, restaurant))
+        _apply_changes(db, updated, inserted)
+        report.updated += len(updated)
+        report.inserted += len(inserted)
+
+    deleted_ids = [restaurant_id for matches in stored.values() for restaurant_id, _ in matches]
+    _delete_restaurants(db, deleted_ids, chunk_size)
+    report.deleted = len(deleted_ids)
+
+
+def reload_csv(db: Session, csv_file_path='restaurants.csv', *, chunk_size=None) -> ReloadReport:
+    """
+    Bring the stored restaurants in line with a restaurants CSV in a single
+    transaction, touching only what changed; see `diff_csv`.
+
+    Once committed, the response cache is cleared and a built opening hours
+    index is rebuilt, replacing the old table in one swap. Servers running
+    apart from this process notice the import and do the same within
+    DATA_POLL_INTERVAL seconds.
+    """
+    report = ReloadReport()
+    start = time.perf_counter()
+    content_hash = file_content_hash(csv_file_path)
+    try:
+        acquire_loader_lock(db)
+        diff_csv(db, csv_file_path, report, chunk_size)
+        record_import(db, csv_file_path, content_hash)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    invalidate_opening_hours()
+    opening_hours_index.rebuild_if_stale(SessionLocal)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def parse_exception_row(line, row):
+    """
+    Parse a schedule exceptions CSV row of restaurant name, ISO date and
+    hours into (name, date, [(opening_time, closing_time)]), or None if it
+    cannot be used, and a `RowError` for every problem found.
+
+    The hours are "Closed" (or empty) for a closure, or opening periods
+    such as "11 am - 3 pm / 5 pm - 11 pm"; a closure has a single period
+    without times.
+    """
+    if len(row) != 3:
+        return None, [RowError(line, None, f'expected 3 columns, got {len(row)}')]
+    name, date_str, hours = row[0].strip('"'), row[1].strip(), row[2].strip()
+    try:
+        day = datetime.date.fromisoformat(date_str)
+    except ValueError:
+        return None, [RowError(line, name, f'invalid date {date_str!r}')]
+    if hours.lower() in ('', 'closed'):
+        return (name, day, [(None, None)]), []
+    try:
+        periods = [parse_times(period) for period in hours.split('/')]
+    except ValueError as e:
+        return None, [RowError(line, name, f'invalid hours {hours!r}: {e}')]
+    return (name, day, periods), []
+
+
+def load_exceptions_csv(db: Session, csv_file_path, *, chunk_size=None) -> IngestReport:
+    """
+    Replace every schedule exception with those of a CSV, in a single
+    transaction.
+
+    An exception applies to every restaurant of its name; rows naming no
+    restaurant are reported and skipped. The response cache is cleared
+    once committed, and the import recorded for servers running apart from
+    this process.
+    """
+    chunk_size = chunk_size or settings.INGEST_CHUNK_SIZE
+    report = IngestReport()
+    start = time.perf_counter()
+    content_hash = file_content_hash(csv_file_path)
+    try:
+        acquire_loader_lock(db)
+        restaurant_ids = {}
+        for restaurant_id, name in db.execute(select(Restaurant.id, Restaurant.restaurant_name)):
+            restaurant_ids.setdefault(name, []).append(restaurant_id)
+        db.execute(delete(ScheduleException))
+
+        for chunk in iter_csv_chunks(csv_file_path, chunk_size):
+            rows = []
+            for line, row in chunk:
+                exception, errors = parse_exception_row(line, row)
+                if exception is not None and exception[0] not in restaurant_ids:
+                    errors.append(RowError(line, exception[0], 'unknown restaurant'))
+                    exception = None
+                report_errors(report, csv_file_path, errors)
+                if exception is None:
+                    continue
+                name, day, periods = exception
+                rows.extend(
+                    (restaurant_id, day, opening_time, closing_time)
+                    for restaurant_id in restaurant_ids[name]
+                    for opening_time, closing_time in periods
+                )
+            insert_rows(db, ScheduleException, ('restaurant_id', 'date', 'opening_time', 'closing_time'), rows)
+            report.rows += len(chunk)
+        record_import(db, csv_file_path, content_hash)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    response_cache.clear()
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load a restaurants CSV into the database.')
+    parser.add_argument('csv_file_path')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='load even if the file is unchanged')
+    parser.add_argument(
+        '--diff', action='store_true', help='only apply the rows that differ from the stored restaurants'
+    )
+    parser.add_argument(
+        '--exceptions', action='store_true', help='replace the schedule exceptions with those in the file'
+    )
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.exceptions:
+            report = load_exceptions_csv(db, args.csv_file_path)
+        elif args.diff:
+            report = reload_csv(db, args.csv_file_path)
+        else:
+            report = populate_database_with_restaurants(
+                db, args.csv_file_path, workers=args.workers, force=args.force
+            )
+    finally:
+        db.close()
+
+    if isinstance(report, ReloadReport):
+        for error in report.errors:
+            print(f'line {error.line}: {error.message}', file=sys.stderr)
+        print(
+            f'{report.inserted} inserted, {report.updated} updated, {report.deleted} deleted, '
+            f'{report.unchanged} unchanged in {report.seconds:.2f}s, {report.error_count} errors'
+        )
+        return 0
+
+    if report is None:
+        print(f'{args.csv_file_path} is unchanged since the last load, nothing to do')
+        return 0
+    for error in report.errors:
+        print(f'line {error.line}: {error.message}', file=sys.stderr)
+    print(
+        f'{report.rows} rows in {report.seconds:.2f}s '
+        f'({report.rows_per_second:,.0f} rows/sec), {report.error_count} errors'
+        + (', parsed rows loaded from the cache' if report.from_cache else '')
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
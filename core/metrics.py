@@ -0,0 +1,272 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from core.config import settings
+from core.response_cache import response_cache
+from core.single_flight import open_restaurants_flight
+
+# Upper bounds in seconds, from sub-millisecond lookups to slow loads
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+# (stage, seconds) pairs recorded while serving the current request
+_request_stages: ContextVar = ContextVar('request_stages', default=None)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with fixed buckets, one series per set of
+    label values.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labelvalues, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(
+                    f'{self.name}_bucket{_format_labels(self.labelnames, labelvalues, [("le", le)])} {cumulative}'
+                )
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {total!r}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labelvalues)} {count}')
+        return lines
+
+
+class Gauge:
+    """
+    Metric read from a callback when the metrics are rendered.
+    """
+
+    def __init__(self, name, documentation, read, kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+            f'{self.name} {self.read()!r}',
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry(enabled=settings.METRICS_ENABLED)
+
+request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Time to serve HTTP requests.', ['method', 'route', 'status'],
+)
+stage_seconds = metrics.histogram(
+    'request_stage_duration_seconds', 'Time spent in each stage of serving a request.', ['stage'],
+)
+pool_wait_seconds = metrics.histogram(
+    'db_pool_checkout_wait_seconds', 'Time waiting to check a connection out of the pool.', ['engine'],
+)
+query_seconds = metrics.histogram(
+    'db_query_duration_seconds', 'Time to execute SQL statements.', ['engine'],
+)
+rows_returned = metrics.histogram(
+    'open_restaurants_returned', 'Restaurants in each open-restaurants response.', buckets=ROW_BUCKETS,
+)
+metrics.register(Gauge(
+    'response_cache_hits_total', 'Open-restaurant responses served from the cache.',
+    lambda: response_cache.hits, kind='counter',
+))
+metrics.register(Gauge(
+    'response_cache_misses_total', 'Open-restaurant responses missing from the cache.',
+    lambda: response_cache.misses, kind='counter',
+))
+metrics.register(Gauge(
+    'response_cache_entries', 'Open-restaurant responses in the cache.',
+    lambda: response_cache.stats()['size'],
+))
+
+metrics.register(Gauge(
+    'open_requests_executed_total', 'Open-restaurant requests that computed their response.',
+    lambda: open_restaurants_flight.executed, kind='counter',
+))
+metrics.register(Gauge(
+    'open_requests_coalesced_total', 'Open-restaurant requests that shared a computation already running.',
+    lambda: open_restaurants_flight.coalesced, kind='counter',
+))
+
+
+def observe_stage(name, seconds):
+    """
+    Record a stage of the current request; repeated stages add up in its
+    Server-Timing header.
+    """
+    if not metrics.enabled:
+        return
+    stage_seconds.observe(seconds, name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+class _TimedCheckout:
+    engine_label = 'sync'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if metrics.enabled:
+                seconds = time.perf_counter() - start
+                pool_wait_seconds.observe(seconds, self.engine_label)
+                observe_stage('pool', seconds)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    """
+    Queue pool recording how long checkouts wait for a connection.
+    """
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    engine_label = 'async'
+
+
+def instrument_engine(engine, label):
+    """
+    Record the execution time of every statement run on the engine.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        if metrics.enabled:
+            query_seconds.observe(seconds, label)
+            observe_stage('db', seconds)
+
+    @event.listens_for(engine, 'handle_error')
+    def drop_query_timer(exception_context):
+        if exception_context.connection is None:
+            return
+        started = exception_context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+
+def server_timing(stages, total) -> str:
+    durations = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations['total'] = total
+    return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in durations.items())
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware timing each request, collecting the stages recorded
+    while it is served and reporting them in a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        stages = []
+        token = _request_stages.set(stages)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', server_timing(stages, time.perf_counter() - start).encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stages.reset(token)
+            route = scope.get('route')
+            request_seconds.observe(
+                time.perf_counter() - start,
+                scope['method'],
+                getattr(route, 'path', 'unmatched'),
+                status_code,
+            )
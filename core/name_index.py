@@ -0,0 +1,72 @@
+"""
+Trigram index of restaurant names, to find the open restaurants whose name
+contains what the user typed.
+
+Each trigram of a lowercased name maps to the positions, in id order, of
+the restaurants whose name has it. A name containing the query has every
+trigram of the query, so the restaurants under the query's rarest trigram
+are the only candidates.
+"""
+from array import array
+from bisect import bisect_left
+from operator import attrgetter
+
+EMPTY_POSTINGS = array('i')
+
+entry_id = attrgetter('id')
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameIndex:
+    def __init__(self, entries):
+        self._entries = entries
+        self._names = []
+        self._postings = {}
+        for position, entry in enumerate(entries):
+            name = (entry.restaurant_name or '').lower()
+            self._names.append(name)
+            for trigram in trigrams(name):
+                postings = self._postings.get(trigram)
+                if postings is None:
+                    postings = self._postings[trigram] = array('i')
+                postings.append(position)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def matching(self, query: str, restaurants):
+        """
+        The entries of `restaurants`, ordered by id, whose name contains
+        the query, ignoring case.
+
+        The smaller side is walked: the open restaurants, checking their
+        names, when there are fewer of them than candidates under the
+        rarest trigram of the query, and otherwise the candidates, looking
+        each up among the open restaurants with a binary search. Queries
+        shorter than a trigram always walk the open restaurants.
+        """
+        needle = query.lower()
+        postings = [self._postings.get(trigram, EMPTY_POSTINGS) for trigram in trigrams(needle)]
+        candidates = min(postings, key=len) if postings else None
+        if candidates is None or len(restaurants) <= len(candidates):
+            return tuple(
+                entry for entry in restaurants if needle in (entry.restaurant_name or '').lower()
+            )
+
+        matches = []
+        # Candidates come in id order, so each search starts where the last
+        # one ended
+        low = 0
+        for position in candidates:
+            if needle not in self._names[position]:
+                continue
+            restaurant_id = self._entries[position].id
+            low = bisect_left(restaurants, restaurant_id, low, key=entry_id)
+            if low == len(restaurants):
+                break
+            if restaurants[low].id == restaurant_id:
+                matches.append(restaurants[low])
+        return tuple(matches)
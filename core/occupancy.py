@@ -0,0 +1,109 @@
+"""
+Weekly occupancy: how many restaurants are open at each minute of the week.
+
+Rather than a restaurants x 10,080 bit matrix (1.26 GB packed for a million
+restaurants) the open minutes are kept in run-length form: each
+restaurant's intervals merged into disjoint [start, end) runs, held in two
+int16 arrays. The counts for the whole week are then a difference array
+over the runs and one cumulative sum.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from core.response_cache import GenerationCache, response_cache
+from core.week import MINUTES_PER_WEEK
+
+AGGREGATES = {
+    'max': np.max,
+    'min': np.min,
+    'mean': np.mean,
+}
+
+
+def merge_runs(restaurant_ids, starts, ends):
+    """
+    Merge overlapping and touching [start, end) intervals of each
+    restaurant into disjoint runs, returned as (starts, ends) int16 arrays
+    along with the number of restaurants.
+
+    Intervals already ordered by restaurant and start, as SQL can return
+    them, are not sorted again.
+    """
+    restaurant_ids = np.asarray(restaurant_ids, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if not len(starts):
+        return np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int16), 0
+
+    # Shift every restaurant into a range of its own so one running maximum
+    # over all intervals never carries an end into the next restaurant
+    key = restaurant_ids * (2 * MINUTES_PER_WEEK) + starts
+    if np.any(key[1:] < key[:-1]):
+        order = np.argsort(key, kind='stable')
+        restaurant_ids, starts, ends = restaurant_ids[order], starts[order], ends[order]
+    offset = restaurant_ids * (2 * MINUTES_PER_WEEK)
+    reach = np.maximum.accumulate(ends + offset)
+
+    new_run = np.empty(len(starts), dtype=bool)
+    new_run[0] = True
+    new_run[1:] = starts[1:] + offset[1:] > reach[:-1]
+    run_indexes = np.flatnonzero(new_run)
+    return (
+        starts[run_indexes].astype(np.int16),
+        np.maximum.reduceat(ends, run_indexes).astype(np.int16),
+        int(np.count_nonzero(restaurant_ids[1:] != restaurant_ids[:-1])) + 1,
+    )
+
+
+def open_counts(run_starts, run_ends):
+    """
+    Restaurants open at each minute of the week from disjoint runs.
+    """
+    changes = (
+        np.bincount(run_starts, minlength=MINUTES_PER_WEEK + 1)
+        - np.bincount(run_ends, minlength=MINUTES_PER_WEEK + 1)
+    )
+    return np.cumsum(changes[:MINUTES_PER_WEEK], dtype=np.int32)
+
+
+def bucket_counts(counts, bucket_minutes: int, aggregate='max'):
+    """
+    Aggregate per-minute counts over consecutive buckets of minutes, which
+    must divide the week.
+    """
+    if bucket_minutes < 1 or MINUTES_PER_WEEK % bucket_minutes:
+        raise ValueError(f"bucket must divide the {MINUTES_PER_WEEK} minutes of the week")
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"aggregate must be one of {', '.join(AGGREGATES)}")
+    return AGGREGATES[aggregate](counts.reshape(-1, bucket_minutes), axis=1)
+
+
+@dataclass(frozen=True)
+class WeeklyOccupancy:
+    restaurants: int
+    run_starts: np.ndarray
+    run_ends: np.ndarray
+    counts: np.ndarray
+
+    @classmethod
+    def from_intervals(cls, restaurant_ids, starts, ends) -> 'WeeklyOccupancy':
+        run_starts, run_ends, restaurants = merge_runs(restaurant_ids, starts, ends)
+        return cls(
+            restaurants=restaurants,
+            run_starts=run_starts,
+            run_ends=run_ends,
+            counts=open_counts(run_starts, run_ends),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.run_starts.nbytes + self.run_ends.nbytes + self.counts.nbytes
+
+    @property
+    def bit_matrix_nbytes(self) -> int:
+        # What the restaurants x minutes matrix would take packed to bits
+        return self.restaurants * MINUTES_PER_WEEK // 8
+
+
+occupancy_cache = GenerationCache(response_cache)
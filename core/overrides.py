@@ -0,0 +1,267 @@
+"""
+Date-specific hours layered over the weekly schedules.
+
+A schedule exception replaces a restaurant's weekly hours for one date of
+its local calendar: closed all day, or open for the special hours of the
+exceptions on that date. Special hours closing after midnight carry on
+into the next date, which otherwise keeps its weekly hours.
+
+Exceptions are few next to weekly schedules, so all of them are held in a
+dict keyed by date. Looking a date up costs one dict probe, and a date
+without exceptions, the common case, leaves the weekly result as it is.
+Answers over a span of time, a window or the next change, are worked out
+for the few restaurants with exceptions in the span, at the minutes where
+their weekly hours or exceptions may switch, and the weekly answer is kept
+for the rest.
+"""
+import datetime
+from collections import namedtuple
+from operator import attrgetter
+
+from core.response_cache import GenerationCache, response_cache
+from core.schedule_index import RestaurantEntry
+from core.week import ChangePoints, MINUTES_PER_DAY, minute_of_day, minute_of_week, next_change, zone_info
+
+# What one restaurant's exceptions make of a date: its entry and time zone,
+# whether they replace the weekly hours (False when the date only gets
+# special hours carried over from the day before), and the [start, end)
+# minutes of the day it is open
+DayOverride = namedtuple('DayOverride', ['entry', 'zone', 'replaces', 'intervals'])
+
+NO_OVERRIDES = {}
+# (closed ids, opened entries) of a time without exceptions
+NO_CHANGES = (frozenset(), {})
+# Change points of a restaurant without weekly hours
+NEVER_OPEN = ChangePoints((), (), False)
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def shift_date(day: datetime.date, days: int) -> datetime.date:
+    """
+    The date some days away, stopping at the ends of the calendar.
+    """
+    try:
+        return day + datetime.timedelta(days=days)
+    except OverflowError:
+        return datetime.date.min if days < 0 else datetime.date.max
+
+
+def exception_intervals(day: datetime.date, opening_time, closing_time):
+    """
+    (date, start, end) pieces of the special hours of an exception on
+    `day`, split at midnight like weekly hours; none for a closure.
+    """
+    if opening_time is None or closing_time is None:
+        return []
+    opening = minute_of_day(opening_time)
+    closing = minute_of_day(closing_time)
+    # The closing minute is inclusive
+    if closing > opening:
+        return [(day, opening, closing + 1)]
+    return [(day, opening, MINUTES_PER_DAY), (day + datetime.timedelta(days=1), 0, closing + 1)]
+
+
+class ScheduleOverrides:
+    """
+    Schedule exceptions of every restaurant by date.
+    """
+
+    def __init__(self, days=None):
+        self.days = days or {}
+        # Sorted dates with exceptions, and the entry and time zone, by
+        # restaurant id
+        self.restaurant_days = {}
+        self.restaurants = {}
+        for day in sorted(self.days):
+            for restaurant_id, override in self.days[day].items():
+                self.restaurant_days.setdefault(restaurant_id, []).append(day)
+                self.restaurants[restaurant_id] = (override.entry, override.zone)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'ScheduleOverrides':
+        """
+        Build from (restaurant_id, restaurant_name, timezone, date,
+        opening_time, closing_time) rows.
+        """
+        replaced = set()
+        pieces = {}
+        entries = {}
+        for restaurant_id, name, zone, day, opening_time, closing_time in rows:
+            entries[restaurant_id] = (RestaurantEntry(restaurant_id, name), zone)
+            replaced.add((day, restaurant_id))
+            pieces.setdefault((day, restaurant_id), [])
+            for piece_day, start, end in exception_intervals(day, opening_time, closing_time):
+                pieces.setdefault((piece_day, restaurant_id), []).append((start, end))
+
+        days = {}
+        for (day, restaurant_id), intervals in pieces.items():
+            entry, zone = entries[restaurant_id]
+            days.setdefault(day, {})[restaurant_id] = DayOverride(
+                entry, zone, (day, restaurant_id) in replaced, tuple(sorted(intervals)),
+            )
+        return cls(days)
+
+    def on(self, day: datetime.date) -> dict:
+        """
+        `DayOverride` by restaurant id on a date.
+        """
+        return self.days.get(day, NO_OVERRIDES)
+
+    def changes(self, zone_minutes: dict, dates: dict):
+        """
+        Ids of the restaurants open by their weekly hours that are closed at
+        the minutes of `minutes_by_zone` on the `local_dates`, and entries by
+        id of those open there by their exceptions.
+        """
+        closed = set()
+        opened = {}
+        for minute, zones in zone_minutes.items():
+            overrides = self.on(dates[minute])
+            if not overrides:
+                continue
+            minute_of_the_day = minute % MINUTES_PER_DAY
+            for restaurant_id, override in overrides.items():
+                if zones is not None and override.zone not in zones:
+                    continue
+                if any(start <= minute_of_the_day < end for start, end in override.intervals):
+                    opened[restaurant_id] = override.entry
+                elif override.replaces:
+                    closed.add(restaurant_id)
+        return closed, opened
+
+    def is_open(self, restaurant_id, points: ChangePoints, wall: datetime.datetime) -> bool:
+        """
+        Whether a restaurant is open at a local time, the exceptions of its
+        date taking precedence over the weekly hours.
+        """
+        override = self.on(wall.date()).get(restaurant_id)
+        if override is not None:
+            minute = minute_of_day(wall.time())
+            if any(start <= minute < end for start, end in override.intervals):
+                return True
+            if override.replaces:
+                return False
+        return next_change(points, minute_of_week(wall))[0]
+
+    def restaurants_between(self, first: datetime.date, last: datetime.date):
+        """
+        Ids of the restaurants with exceptions from one date to another.
+        """
+        return [
+            restaurant_id for restaurant_id, days in self.restaurant_days.items()
+            if any(first <= day <= last for day in days)
+        ]
+
+    def _switches(self, restaurant_id, points: ChangePoints, day: datetime.date):
+        """
+        Local times on a date at which a restaurant may open or close: its
+        midnight, its weekly change points and the ends of its exceptions.
+        """
+        midnight = datetime.datetime.combine(day, datetime.time())
+        first = day.weekday() * MINUTES_PER_DAY
+        minutes = {0}
+        minutes.update(minute - first for minute in points.minutes if first <= minute < first + MINUTES_PER_DAY)
+        override = self.on(day).get(restaurant_id)
+        if override is not None:
+            for start, end in override.intervals:
+                minutes.update((start, end))
+        return [
+            midnight + datetime.timedelta(minutes=minute) for minute in sorted(minutes) if minute < MINUTES_PER_DAY
+        ]
+
+    def next_change(self, restaurant_id, points: ChangePoints, wall: datetime.datetime):
+        """
+        Like `core.week.next_change` at a local time, with the exceptions:
+        whether the restaurant is open, the minutes until it next opens or
+        closes and whether that is an opening. Weekly hours change within a
+        week, so the search ends a week past the last exception.
+        """
+        wall = wall.replace(second=0, microsecond=0)
+        is_open = self.is_open(restaurant_id, points, wall)
+        days = self.restaurant_days.get(restaurant_id, [wall.date()])
+        last = shift_date(max(shift_date(wall.date(), 7), days[-1]), 1)
+        day = wall.date()
+        while True:
+            for switch in self._switches(restaurant_id, points, day):
+                if switch > wall and self.is_open(restaurant_id, points, switch) != is_open:
+                    return is_open, int((switch - wall).total_seconds()) // 60, not is_open
+            if day >= last:
+                return is_open, None, None
+            day += ONE_DAY
+
+    def window_state(self, restaurant_id, points: ChangePoints, start: datetime.datetime, end: datetime.datetime):
+        """
+        Whether a restaurant is open at any point, and for the whole time,
+        of a local window, both ends inclusive and truncated to the minute.
+
+        Only the first and last dates, those with exceptions and a week of
+        the others are read; the rest repeat the weekly hours of one of them.
+        """
+        start = start.replace(second=0, microsecond=0)
+        end = end.replace(second=0, microsecond=0)
+        exception_days = set(self.restaurant_days.get(restaurant_id, ()))
+        days = {start.date(), end.date()} | {day for day in exception_days if start.date() <= day <= end.date()}
+        day = shift_date(start.date(), 1)
+        weekdays = set()
+        while day < end.date() and len(weekdays) < 7:
+            if day not in exception_days and day.weekday() not in weekdays:
+                weekdays.add(day.weekday())
+                days.add(day)
+            day += ONE_DAY
+        open_any = False
+        open_throughout = True
+        for day in sorted(days):
+            # The window's part of the day, and the state at each switch in it
+            times = [max(start, datetime.datetime.combine(day, datetime.time()))]
+            last = min(end, datetime.datetime.combine(day, datetime.time(23, 59)))
+            times.extend(switch for switch in self._switches(restaurant_id, points, day) if times[0] < switch <= last)
+            states = [self.is_open(restaurant_id, points, at) for at in times]
+            open_any = open_any or any(states)
+            open_throughout = open_throughout and all(states)
+        return open_any, open_throughout
+
+    def window_changes(self, change_points: dict, start, end, default_zone: str, throughout: bool):
+        """
+        (closed ids, opened entries) the exceptions make to the restaurants
+        open at any point of a window, or for the whole of it, by their
+        weekly hours; an aware window is read on each restaurant's clock.
+        `change_points` holds the weekly hours of `window_restaurants`.
+        """
+        closed = set()
+        opened = {}
+        for restaurant_id, points in change_points.items():
+            entry, zone = self.restaurants[restaurant_id]
+            local_start, local_end = start, end
+            if start.tzinfo is not None:
+                info = zone_info(zone or default_zone)
+                local_start = start.astimezone(info).replace(tzinfo=None)
+                # The clocks going back can bring the end before the start
+                local_end = max(local_start, end.astimezone(info).replace(tzinfo=None))
+            open_any, open_throughout = self.window_state(restaurant_id, points, local_start, local_end)
+            if (open_throughout if throughout else open_any):
+                opened[restaurant_id] = entry
+            else:
+                closed.add(restaurant_id)
+        return closed, opened
+
+    def window_restaurants(self, start: datetime.datetime, end: datetime.datetime):
+        """
+        Ids of the restaurants that may have exceptions within a window,
+        whatever their time zone.
+        """
+        return self.restaurants_between(shift_date(start.date(), -1), shift_date(end.date(), 1))
+
+
+def apply_changes(restaurants, closed, opened):
+    """
+    Entries open by their weekly hours, ordered by id, without the closed
+    ones and with the opened ones, still ordered by id.
+    """
+    if not closed and not opened:
+        return restaurants
+    merged = {entry.id: entry for entry in restaurants if entry.id not in closed}
+    merged.update(opened)
+    return tuple(sorted(merged.values(), key=attrgetter('id')))
+
+
+overrides_cache = GenerationCache(response_cache)
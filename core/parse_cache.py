@@ -0,0 +1,112 @@
+"""
+On-disk cache of parsed restaurants CSVs.
+
+Loading a CSV into an empty database, as every start of an in-memory
+database and every fresh deploy does, spends most of its time parsing
+hours. The parsed chunks are written to the cache as they are loaded, and
+a later load of the same file content by the same parser version reads
+them back instead of reading and parsing the CSV.
+
+The file holds a header with the magic, the parser version and the
+content hash of the CSV, followed by one pickled record per chunk. Hours
+strings repeat, so each record keeps the schedules of a distinct hours
+string once.
+"""
+import os
+import pickle
+import struct
+from contextlib import contextmanager
+
+from core.utils import PARSER_VERSION
+
+MAGIC = b'OHPARSE1'
+HEADER = struct.Struct('=8sQ64s')
+
+
+def _encode_chunk(row_count, parsed):
+    restaurants, errors = parsed
+    schedules = {}
+    rows = []
+    for restaurant in restaurants:
+        hours = restaurant['hours']
+        if hours not in schedules:
+            schedules[hours] = tuple(
+                (tuple(schedule['days']), schedule['opening_time'], schedule['closing_time'])
+                for schedule in restaurant['schedules']
+            )
+        rows.append((restaurant['name'], hours, restaurant.get('timezone')))
+    return row_count, rows, schedules, errors
+
+
+def _decode_chunk(record):
+    row_count, rows, schedules, errors = record
+    # Restaurants with the same hours share one list, which is only read
+    parsed = {
+        hours: [
+            {'days': list(days), 'opening_time': opening_time, 'closing_time': closing_time}
+            for days, opening_time, closing_time in hours_schedules
+        ]
+        for hours, hours_schedules in schedules.items()
+    }
+    restaurants = [
+        {'name': name, 'hours': hours, 'timezone': timezone, 'schedules': parsed[hours]}
+        for name, hours, timezone in rows
+    ]
+    return row_count, (restaurants, errors)
+
+
+class ParseCache:
+    """
+    The parsed CSV cached at `path`, valid for one content hash and
+    parser version.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, content_hash):
+        """
+        (row count, (restaurants, errors)) of each cached chunk, in the
+        shape `parse_chunk` returns, or None if the cache does not hold
+        this content.
+        """
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return None
+        header = file.read(HEADER.size)
+        if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, PARSER_VERSION, content_hash.encode()):
+            file.close()
+            return None
+        return self._chunks(file)
+
+    @staticmethod
+    def _chunks(file):
+        with file:
+            while True:
+                try:
+                    record = pickle.load(file)
+                except EOFError:
+                    return
+                yield _decode_chunk(record)
+
+    @contextmanager
+    def writer(self, content_hash):
+        """
+        Yield a function saving (row count, parsed chunk) pairs. The cache
+        is replaced in one rename once the block exits without an error,
+        and left as it was otherwise.
+        """
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, PARSER_VERSION, content_hash.encode()))
+
+                def save(row_count, parsed):
+                    pickle.dump(_encode_chunk(row_count, parsed), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+                yield save
+            os.replace(temporary, self.path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from core.config import settings
+from core.week import MINUTES_PER_WEEK
+
+CachedResponse = namedtuple('CachedResponse', ['status_code', 'body', 'etag'])
+
+
+def response_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class MinuteResponseCache:
+    """
+    Serialized responses of the open-restaurants endpoint keyed by
+    minute-of-week, or by the minutes of several groups of time zones for
+    aware datetimes, evicted least recently used first.
+
+    Every write to restaurants or schedules clears the cache. A response
+    computed from data read before a clear is not stored, so a slow request
+    cannot put a stale answer back.
+    """
+
+    def __init__(self, maxsize=MINUTES_PER_WEEK):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, minute):
+        with self._lock:
+            entry = self._entries.get(minute)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(minute)
+            self.hits += 1
+            return entry
+
+    def put(self, minute, status_code, body: bytes, generation=None) -> CachedResponse:
+        entry = CachedResponse(status_code, body, response_etag(body))
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return entry
+            self._entries[minute] = entry
+            self._entries.move_to_end(minute)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class GenerationCache:
+    """
+    The last value derived from the stored data, valid until the response
+    cache it follows is next cleared, which every write to the data does.
+    A value computed from data read before a clear is not stored.
+    """
+
+    def __init__(self, cache: MinuteResponseCache):
+        self._cache = cache
+        self._entry = (None, None)
+        self._lock = threading.Lock()
+
+    def get(self):
+        generation, value = self._entry
+        return value if generation == self._cache.generation else None
+
+    def put(self, value, generation):
+        with self._lock:
+            if generation == self._cache.generation:
+                self._entry = (generation, value)
+
+
+def etag_matches(if_none_match, etag) -> bool:
+    """
+    Whether an If-None-Match header value matches the entity tag, using the
+    weak comparison that RFC 9110 prescribes for If-None-Match.
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or any(
+        candidate.removeprefix('W/') == etag for candidate in candidates
+    )
+
+
+response_cache = MinuteResponseCache(settings.RESPONSE_CACHE_SIZE)
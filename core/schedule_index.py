@@ -0,0 +1,342 @@
+import heapq
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from operator import attrgetter
+
+from sqlalchemy.orm import Session
+
+from core.name_index import NameIndex
+from core.response_cache import response_cache
+from core.utils import import_stamp
+from core.week import MINUTES_PER_WEEK, change_points, minute_of_week, zone_sort_key
+from database_app.models import Restaurant, ScheduleInterval
+
+RestaurantEntry = namedtuple('RestaurantEntry', ['id', 'restaurant_name'])
+# Segment starts and segments, change points by restaurant id, (starts,
+# segments) by time zone, and every restaurant's entry ordered by id
+IndexTable = namedtuple('IndexTable', ['starts', 'segments', 'changes', 'zone_tables', 'entries'])
+
+
+def page_after(entries, after_id=None, limit=None):
+    """
+    The entries, ordered by id, with ids after `after_id`, at most `limit`
+    of them.
+    """
+    start = 0 if after_id is None else bisect_right(entries, after_id, key=attrgetter('id'))
+    return entries[start:] if limit is None else entries[start:start + limit]
+
+
+class OpeningHoursIndex:
+    """
+    In-process minute-of-week index of open restaurants.
+
+    The week is cut into segments at every opening/closing boundary; within a
+    segment the set of open restaurants does not change, so a lookup is a
+    single binary search returning a prebuilt tuple of entries. The
+    opening and closing minutes of each restaurant are kept as well, to find
+    its next change with another binary search. When restaurants are in
+    several time zones each zone gets segments of its own too, so they can
+    be looked up at different minutes.
+    """
+
+    def __init__(self):
+        self._table = IndexTable([0], [()], {}, {None: ([0], [()])}, ())
+        self._generation = 0
+        self._built_generation = None
+        self.built_at = None
+        self._rebuild_lock = threading.Lock()
+        self._snapshot_store = None
+        # `import_stamp` of the data the table was built from
+        self.stamp = None
+        # (table, NameIndex of its entries), built on the first name search
+        self._name_index = (None, None)
+
+    @property
+    def is_ready(self) -> bool:
+        return self._built_generation == self._generation
+
+    def mark_stale(self):
+        self._generation += 1
+
+    def use_snapshot(self, store):
+        """
+        Publish every build to a `SnapshotStore` and look up in the mapped
+        file, shared with the other processes using it.
+        """
+        self._snapshot_store = store
+
+    def map_snapshot(self):
+        """
+        Take the table from the store's current snapshot instead of building.
+        """
+        generation = self._generation
+        snapshot = self._snapshot_store.map()
+        self._table = snapshot.table()
+        self._built_generation = generation
+        self.built_at = time.time()
+        self.stamp = snapshot.stamp
+
+    def refresh_snapshot(self) -> bool:
+        """
+        Map the store's snapshot if another process has replaced it,
+        returning whether it did.
+        """
+        store = self._snapshot_store
+        if store is None or self.built_at is None or not store.changed():
+            return False
+        snapshot = store.map()
+        self._table = snapshot.table()
+        self.stamp = snapshot.stamp
+        return True
+
+    def rebuild_if_stale(self, session_factory):
+        """
+        Rebuild a previously built index that has gone stale, or map the
+        snapshot another process built of the same data.
+
+        An index that was never built is left alone, and concurrent callers
+        do not queue up behind a rebuild that is already running.
+        """
+        if self.built_at is None or self.is_ready:
+            return
+        if not self._rebuild_lock.acquire(blocking=False):
+            return
+        try:
+            db = session_factory()
+            try:
+                self._build_or_map(db)
+            finally:
+                db.close()
+        finally:
+            self._rebuild_lock.release()
+
+    def _build_or_map(self, db: Session):
+        """
+        Build, unless another process has already published a snapshot of
+        the data as it is now.
+        """
+        store = self._snapshot_store
+        if store is None:
+            self.build(db)
+            return
+        with store.lock():
+            if store.matches(import_stamp(db)):
+                self.map_snapshot()
+            else:
+                self.build(db)
+
+    def build(self, db: Session):
+        generation = self._generation
+        # Read first, so data loaded meanwhile is at worst built again
+        stamp = import_stamp(db)
+        rows = db.query(Restaurant.id, Restaurant.restaurant_name, Restaurant.timezone).all()
+        intervals = db.query(
+            ScheduleInterval.restaurant_id,
+            ScheduleInterval.start_minute,
+            ScheduleInterval.end_minute,
+        ).all()
+        self.load(
+            [(restaurant_id, name) for restaurant_id, name, _ in rows],
+            intervals,
+            generation=generation,
+            zones={restaurant_id: zone for restaurant_id, _, zone in rows},
+        )
+        self.stamp = stamp
+        if self._snapshot_store is not None:
+            self._table = self._snapshot_store.publish(self._table, stamp).table()
+
+    def load(self, restaurants, intervals, generation=None, zones=None):
+        """
+        Rebuild the index from (id, name) and
+        (restaurant_id, start_minute, end_minute) rows, and the time zone of
+        each restaurant id; restaurants missing from `zones` have None.
+
+        If the data is marked stale while the rows are being read, the index
+        stays stale and callers keep using SQL until the next rebuild.
+        """
+        if generation is None:
+            generation = self._generation
+        entries = {
+            restaurant_id: RestaurantEntry(restaurant_id, name)
+            for restaurant_id, name in restaurants
+        }
+        zones = zones or {}
+        restaurant_intervals = {restaurant_id: [] for restaurant_id in entries}
+        zone_names = {zones.get(restaurant_id) for restaurant_id in entries} or {None}
+        zone_intervals = {zone: [] for zone in sorted(zone_names, key=zone_sort_key)}
+        for restaurant_id, start, end in intervals:
+            if restaurant_id not in entries:
+                continue
+            restaurant_intervals[restaurant_id].append((start, end))
+            zone_intervals[zones.get(restaurant_id)].append((restaurant_id, start, end))
+
+        starts, segments = self._segments(intervals, entries)
+        if len(zone_intervals) == 1:
+            zone_tables = dict.fromkeys(zone_intervals, (starts, segments))
+        else:
+            zone_tables = {
+                zone: self._segments(rows, entries) for zone, rows in zone_intervals.items()
+            }
+        changes = {
+            restaurant_id: change_points(restaurant_intervals[restaurant_id])
+            for restaurant_id in entries
+        }
+        # Swap in one assignment so concurrent readers never see a mix of
+        # the old and the new table.
+        self._table = IndexTable(
+            starts,
+            segments,
+            changes,
+            zone_tables,
+            tuple(entries[restaurant_id] for restaurant_id in sorted(entries)),
+        )
+        self._built_generation = generation
+        self.built_at = time.time()
+
+    @classmethod
+    def _segments(cls, intervals, entries):
+        events = {}
+        for restaurant_id, start, end in intervals:
+            if restaurant_id not in entries:
+                continue
+            events.setdefault(start, []).append((restaurant_id, 1))
+            events.setdefault(end, []).append((restaurant_id, -1))
+
+        starts = [0]
+        segments = []
+        open_counts = {}
+        for boundary in sorted(events):
+            if boundary >= MINUTES_PER_WEEK:
+                break
+            if boundary != starts[-1]:
+                segments.append(cls._snapshot(open_counts, entries))
+                starts.append(boundary)
+            for restaurant_id, delta in events[boundary]:
+                count = open_counts.get(restaurant_id, 0) + delta
+                if count:
+                    open_counts[restaurant_id] = count
+                else:
+                    del open_counts[restaurant_id]
+        segments.append(cls._snapshot(open_counts, entries))
+        return starts, segments
+
+    @staticmethod
+    def _snapshot(open_counts, entries):
+        return tuple(entries[restaurant_id] for restaurant_id in sorted(open_counts))
+
+    def lookup(self, opening_hours):
+        """
+        Return the restaurants open at the given datetime.
+        """
+        return self.lookup_minute(minute_of_week(opening_hours))
+
+    def lookup_minute(self, minute):
+        table = self._table
+        return table.segments[bisect_right(table.starts, minute) - 1]
+
+    @property
+    def zones(self):
+        """
+        Time zones of the indexed restaurants, None among them for those
+        without one.
+        """
+        return tuple(self._table.zone_tables)
+
+    def lookup_zones(self, zone_minutes):
+        """
+        Restaurants open at the minutes of a `minutes_by_zone` mapping,
+        ordered by id; zones the index does not know have none.
+        """
+        starts, segments, _, zone_tables, _ = self._table
+        if len(zone_minutes) == 1 and None in zone_minutes.values():
+            return segments[bisect_right(starts, next(iter(zone_minutes))) - 1]
+        parts = []
+        for minute, zones in zone_minutes.items():
+            for zone in zones:
+                if zone in zone_tables:
+                    zone_starts, zone_segments = zone_tables[zone]
+                    parts.append(zone_segments[bisect_right(zone_starts, minute) - 1])
+        return tuple(heapq.merge(*parts, key=attrgetter('id')))
+
+    def name_index(self) -> NameIndex:
+        """
+        Trigram index of the names of the indexed restaurants, built on the
+        first name search after each build.
+        """
+        table = self._table
+        indexed_table, name_index = self._name_index
+        if indexed_table is not table:
+            name_index = NameIndex(table.entries)
+            self._name_index = (table, name_index)
+        return name_index
+
+    def lookup_page(self, minute, after_id=None, limit=None):
+        """
+        Restaurants open at the minute with ids after `after_id`, at most
+        `limit` of them.
+        """
+        return page_after(self.lookup_minute(minute), after_id, limit)
+
+    def open_ids_by_minutes(self, minutes) -> dict:
+        """
+        Ids of the restaurants open at each minute, in one sweep over the
+        segments; minutes falling into the same segment share one list.
+        """
+        starts, segments = self._table.starts, self._table.segments
+        open_ids = {}
+        position = 0
+        ids = None
+        for minute in sorted(set(minutes)):
+            segment_start = position
+            while position + 1 < len(starts) and starts[position + 1] <= minute:
+                position += 1
+            if ids is None or position != segment_start:
+                ids = [entry.id for entry in segments[position]]
+            open_ids[minute] = ids
+        return open_ids
+
+    def open_ids_by_zone_minutes(self, zone_minutes_list) -> list:
+        """
+        Ids of the restaurants open at each of many `minutes_by_zone`
+        mappings. Those of a single minute for every zone, as naive
+        datetimes give, are found in one sweep by `open_ids_by_minutes`.
+        """
+        every_zone = [
+            next(iter(zone_minutes)) if len(zone_minutes) == 1 and None in zone_minutes.values() else None
+            for zone_minutes in zone_minutes_list
+        ]
+        swept = self.open_ids_by_minutes(minute for minute in every_zone if minute is not None)
+        return [
+            swept[minute] if minute is not None else [entry.id for entry in self.lookup_zones(zone_minutes)]
+            for minute, zone_minutes in zip(every_zone, zone_minutes_list)
+        ]
+
+    def change_points(self, restaurant_ids=None) -> dict:
+        """
+        Change points of the given restaurants, or of all of them; unknown
+        ids are left out.
+        """
+        changes = self._table.changes
+        if restaurant_ids is None:
+            return dict(changes)
+        return {
+            restaurant_id: changes[restaurant_id]
+            for restaurant_id in restaurant_ids
+            if restaurant_id in changes
+        }
+
+
+opening_hours_index = OpeningHoursIndex()
+
+
+def invalidate_opening_hours():
+    """
+    Drop what was derived from restaurants and schedules, after a committed
+    write to them. The index is marked stale before the response cache is
+    cleared, so an answer looked up in the old index cannot be cached under
+    the new generation.
+    """
+    opening_hours_index.mark_stale()
+    response_cache.clear()
@@ -0,0 +1,45 @@
+"""
+Coalescing of identical concurrent requests.
+
+At the top of each minute many clients ask what is open now at once; while
+the response cache has no answer yet, each of them would run the same
+queries. A `SingleFlight` lets the first of them compute the answer in a
+task of its own and has the others await that task, so all of them get
+the same result from one computation.
+"""
+import asyncio
+
+
+class SingleFlight:
+    """
+    In-flight computations by key, with counters of the calls that ran one
+    and of those that joined one already running.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, compute):
+        """
+        Result of `compute()`, a coroutine function, shared with every
+        concurrent call with the same key. The computation is shielded, so a
+        caller going away does not cancel it for the others, and an error
+        is raised to all of them.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {'executed': self.executed, 'coalesced': self.coalesced}
+
+
+open_restaurants_flight = SingleFlight()
@@ -0,0 +1,339 @@
+"""
+Binary snapshot of the opening hours index, shared by worker processes.
+
+One process builds the index and writes it to a file; every worker maps
+that file read-only and looks restaurants up in place, so the page cache
+holds a single copy however many workers there are. The file is replaced
+atomically with a higher generation whenever the data changes, and workers
+watching it map the new one. The header carries the `import_stamp` of the
+data the table was built from, so a snapshot left over from other data is
+built again rather than trusted.
+
+Layout, in native byte order: a header with the magic, the generation, the
+number of sections and the import stamp, a directory of (name, typecode, offset, count)
+entries, then the sections, each aligned to 8 bytes.
+"""
+import array
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+
+from core.schedule_index import IndexTable, RestaurantEntry
+from core.week import ChangePoints
+
+MAGIC = b'OHSNAP02'
+HEADER = struct.Struct('=8sQQ16s')
+DIRECTORY_ENTRY = struct.Struct('=16s8sQQ')
+
+
+class MappedSegment(Sequence):
+    """
+    Restaurants open during one segment, decoded from the mapping as they
+    are read.
+    """
+
+    def __init__(self, snapshot, members):
+        self._snapshot = snapshot
+        self._members = members
+
+    def __len__(self):
+        return len(self._members)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return tuple(map(self._snapshot.entry, self._members[position]))
+        return self._snapshot.entry(self._members[position])
+
+    def __iter__(self):
+        return map(self._snapshot.entry, self._members)
+
+
+class MappedSegments(Sequence):
+    def __init__(self, snapshot, offsets, members):
+        self._snapshot = snapshot
+        self._offsets = offsets
+        self._members = members
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        return MappedSegment(
+            self._snapshot, self._members[self._offsets[position]:self._offsets[position + 1]]
+        )
+
+
+class MappedChanges(Mapping):
+    """
+    Change points by restaurant id, rebuilt from the mapping on access.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return len(self._snapshot.ids)
+
+    def __iter__(self):
+        return iter(self._snapshot.ids)
+
+    def __getitem__(self, restaurant_id):
+        snapshot = self._snapshot
+        position = snapshot.position(restaurant_id)
+        if position is None:
+            raise KeyError(restaurant_id)
+        first, last = snapshot.change_offsets[position], snapshot.change_offsets[position + 1]
+        return ChangePoints(
+            tuple(snapshot.change_minutes[first:last]),
+            tuple(bool(opens) for opens in snapshot.change_opens[first:last]),
+            bool(snapshot.always_open[position]),
+        )
+
+
+class Snapshot:
+    """
+    A snapshot file mapped read-only.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self._mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mapping)
+        magic, self.generation, count, self.stamp = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an opening hours snapshot')
+        sections = {}
+        for number in range(count):
+            name, typecode, offset, length = DIRECTORY_ENTRY.unpack_from(
+                view, HEADER.size + number * DIRECTORY_ENTRY.size
+            )
+            typecode = typecode.rstrip(b'\0').decode()
+            size = struct.calcsize(typecode)
+            sections[name.rstrip(b'\0').decode()] = view[offset:offset + length * size].cast(typecode)
+
+        self.ids = sections['ids']
+        self._name_offsets = sections['name_offsets']
+        self._names = sections['names']
+        self.change_offsets = sections['change_offsets']
+        self.change_minutes = sections['change_minutes']
+        self.change_opens = sections['change_opens']
+        self.always_open = sections['always_open']
+        # Entries are decoded once each on first use; the segments, which
+        # take most of the space, are only ever read from the mapping
+        self._entries = [None] * len(self.ids)
+        meta = json.loads(bytes(sections['meta']))
+        tables = [
+            (
+                sections[f'starts_{number}'],
+                MappedSegments(self, sections[f'offsets_{number}'], sections[f'members_{number}']),
+            )
+            for number in range(meta['tables'])
+        ]
+        self.all_table = tables[0]
+        self.zone_tables = {zone: tables[number] for zone, number in meta['zones']}
+
+    def entry(self, position) -> RestaurantEntry:
+        entry = self._entries[position]
+        if entry is None:
+            first, last = self._name_offsets[position], self._name_offsets[position + 1]
+            entry = self._entries[position] = RestaurantEntry(
+                self.ids[position], str(self._names[first:last], 'utf-8')
+            )
+        return entry
+
+    def position(self, restaurant_id):
+        position = bisect_left(self.ids, restaurant_id)
+        if position < len(self.ids) and self.ids[position] == restaurant_id:
+            return position
+        return None
+
+    def table(self) -> IndexTable:
+        starts, segments = self.all_table
+        return IndexTable(
+            starts,
+            segments,
+            MappedChanges(self),
+            self.zone_tables,
+            MappedSegment(self, range(len(self.ids))),
+        )
+
+
+def _sections(table: IndexTable):
+    """
+    (name, typecode, values) of every section of a table.
+    """
+    entries = table.entries
+    ids = array.array('q', [entry.id for entry in entries])
+    positions = {entry.id: position for position, entry in enumerate(entries)}
+
+    names = bytearray()
+    name_offsets = array.array('q', [0])
+    for entry in entries:
+        names += entry.restaurant_name.encode('utf-8') if entry.restaurant_name else b''
+        name_offsets.append(len(names))
+
+    change_offsets = array.array('q', [0])
+    change_minutes = array.array('H')
+    change_opens = array.array('B')
+    always_open = array.array('B')
+    for entry in entries:
+        points = table.changes.get(entry.id, ChangePoints((), (), False))
+        change_minutes.extend(points.minutes)
+        change_opens.extend(points.opens)
+        change_offsets.append(len(change_minutes))
+        always_open.append(points.always_open)
+
+    sections = [
+        ('ids', 'q', ids),
+        ('name_offsets', 'q', name_offsets),
+        ('names', 'B', names),
+        ('change_offsets', 'q', change_offsets),
+        ('change_minutes', 'H', change_minutes),
+        ('change_opens', 'B', change_opens),
+        ('always_open', 'B', always_open),
+    ]
+    # The table over every restaurant first, then one per time zone unless
+    # there is a single zone, which shares it
+    tables = [(table.starts, table.segments)]
+    if len(table.zone_tables) > 1:
+        zones = [(zone, number) for number, zone in enumerate(table.zone_tables, start=1)]
+        tables.extend(table.zone_tables.values())
+    else:
+        zones = [(zone, 0) for zone in table.zone_tables]
+    for number, (starts, segments) in enumerate(tables):
+        offsets = array.array('q', [0])
+        members = array.array('i')
+        for segment in segments:
+            members.extend(positions[entry.id] for entry in segment)
+            offsets.append(len(members))
+        sections.append((f'starts_{number}', 'i', array.array('i', starts)))
+        sections.append((f'offsets_{number}', 'q', offsets))
+        sections.append((f'members_{number}', 'i', members))
+    sections.append(('meta', 'B', json.dumps({'tables': len(tables), 'zones': zones}).encode()))
+    return sections
+
+
+def write_snapshot(path, table: IndexTable, generation: int, stamp: bytes = b''):
+    """
+    Write a table to a new file and move it over `path` in one rename, so
+    readers see either the old snapshot or the new one.
+    """
+    sections = _sections(table)
+    directory_size = HEADER.size + len(sections) * DIRECTORY_ENTRY.size
+    offset = -(-directory_size // 8) * 8
+    directory = []
+    for name, typecode, values in sections:
+        length = len(values)
+        directory.append(DIRECTORY_ENTRY.pack(name.encode(), typecode.encode(), offset, length))
+        offset += -(-(length * struct.calcsize(typecode)) // 8) * 8
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, generation, len(sections), stamp))
+        file.write(b''.join(directory))
+        for _, typecode, values in sections:
+            file.write(b'\0' * (-file.tell() % 8))
+            file.write(values)
+        file.write(b'\0' * (-file.tell() % 8))
+    os.replace(temporary, path)
+
+
+def _read_header(path):
+    """
+    (generation, stamp) of the snapshot at `path`, (0, None) if there is none.
+    """
+    try:
+        with open(path, 'rb') as file:
+            magic, generation, _, stamp = HEADER.unpack(file.read(HEADER.size))
+    except (FileNotFoundError, struct.error):
+        return 0, None
+    return (generation, stamp) if magic == MAGIC else (0, None)
+
+
+def snapshot_generation(path) -> int:
+    """
+    Generation of the snapshot at `path`, 0 if there is none.
+    """
+    return _read_header(path)[0]
+
+
+def snapshot_stamp(path):
+    """
+    Import stamp the snapshot at `path` was built from, None if there is none.
+    """
+    return _read_header(path)[1]
+
+
+class SnapshotStore:
+    """
+    The snapshot file at `path` and the snapshot this process has mapped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = None
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold the lock shared with other processes writing the snapshot;
+        nested uses within a process do not block.
+        """
+        with self._lock:
+            if not self._lock_depth:
+                self._lock_file = open(f'{self.path}.lock', 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if not self._lock_depth:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def matches(self, stamp: bytes) -> bool:
+        """
+        Whether the snapshot file was built from the data with this import stamp.
+        """
+        return snapshot_stamp(self.path) == stamp
+
+    def map(self) -> Snapshot:
+        self.snapshot = Snapshot(self.path)
+        return self.snapshot
+
+    def publish(self, table: IndexTable, stamp: bytes = b'') -> Snapshot:
+        """
+        Write the table, built from the data with import stamp `stamp`, as
+        the next generation and map it.
+        """
+        with self.lock():
+            write_snapshot(self.path, table, snapshot_generation(self.path) + 1, stamp)
+            return self.map()
+
+    def changed(self) -> bool:
+        """
+        Whether another process replaced the file since it was mapped.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        mapped = self.snapshot.stat if self.snapshot is not None else None
+        return mapped is None or (stat.st_ino, stat.st_mtime_ns) != (mapped.st_ino, mapped.st_mtime_ns)
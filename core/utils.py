@@ -1,10 +1,55 @@
 import csv
+import datetime
+import hashlib
 import re
+import time
+import uuid
+from functools import lru_cache
+
 from dateutil.parser import parse
 
+from sqlalchemy import delete, func, insert, select, text
 from sqlalchemy.orm import Session
 
-from database_app.models import Restaurant, Schedule
+from core.config import settings
+from core.response_cache import response_cache
+from core.week import WEEKDAY_INDEX, schedule_intervals
+from database_app.database import is_sqlite_memory
+from database_app.models import DataImport, Restaurant, Schedule, ScheduleInterval
+
+# DataImport source of the writes made through the API
+API_SOURCE = 'api'
+
+# Key of the Postgres advisory lock serialising startup loads across workers
+LOADER_LOCK_KEY = 0x52455354
+
+# Distinct hours strings kept parsed; chains repeat the same hours many times
+PARSE_CACHE_SIZE = 16384
+# Bump whenever parsing a CSV row gives a different result, so that parses
+# cached on disk by an older version are not loaded
+PARSER_VERSION = 1
+
+# One "days times" segment of an hours string, e.g. "Tues-Fri, Sun 11:30 am - 10 pm"
+SEGMENT_PATTERN = re.compile(
+    r'(.+?)\s+(\d{1,2}(:\d{2})?\s*(am|pm)?\s*-\s*\d{1,2}(:\d{2})?\s*(am|pm)?)',
+    re.IGNORECASE,
+)
+# Times that can be converted without dateutil: "11:30 am", "5 pm", "23:15".
+# A bare hour such as "5" is left to dateutil, which reads it as a day.
+TIME_PATTERN = re.compile(r'(\d{1,2})(?::(\d{2}))? ?([ap]m)?', re.IGNORECASE)
+# Datetimes that can be converted without dateutil: ISO 8601 dates and
+# times such as "2024-01-01", "2024-01-01T12:30" or
+# "2024-01-01 12:30:15.5+02:00", and Unix times in seconds of the lengths
+# dateutil rejects, from 1973 to 5138
+ISO_DATETIME_PATTERN = re.compile(
+    r'\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?(?:Z|[+-]\d{2}:\d{2})?)?'
+)
+EPOCH_PATTERN = re.compile(r'(\d{9,11})(?:\.(\d{1,6}))?')
+
+# Monday of the week weekday and time queries are placed in
+REFERENCE_MONDAY = datetime.date(2024, 1, 1)
+# UTC offsets and the dates either side of an instant's stay within this
+CALENDAR_MARGIN = datetime.timedelta(days=2)
 
 DAY_ABBREVIATIONS = {
     'Mon': 'Monday',
@@ -22,10 +67,11 @@ def read_csv_data(csv_file_path):
     with open(csv_file_path, 'r') as csvfile:
         reader = csv.reader(csvfile)
         for row in reader:
-            name, hours = row
+            name, hours, *timezone = row
             restaurants.append({
                 'name': name.strip('"'),
-                'hours': hours.strip()
+                'hours': hours.strip(),
+                'timezone': (timezone[0].strip() or None) if timezone else None,
             })
     return restaurants[1:]
 
@@ -70,57 +116,328 @@ def parse_times(times_str):
 
 def parse_time(time_str):
     time_str = time_str.strip()
-    dt = parse(time_str)
+    parsed = parse_time_fast(time_str)
+    if parsed is None:
+        parsed = parse_time_dateutil(time_str)
+    return parsed
+
+
+def parse_time_fast(time_str):
+    """
+    Convert the common time formats directly, or return None if unsure.
+    """
+    match = TIME_PATTERN.fullmatch(time_str)
+    if not match:
+        return None
+    hour_str, minute_str, meridiem = match.groups()
+    hour = int(hour_str)
+    minute = int(minute_str) if minute_str else 0
+    if minute > 59:
+        return None
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower() == 'pm' else 0)
+    elif minute_str is None or hour > 23:
+        return None
+    return datetime.time(hour, minute)
+
+
+def parse_time_dateutil(time_str):
+    dt = parse(time_str.strip())
     return dt.time()
 
 
+def parse_datetime(datetime_str):
+    parsed = parse_datetime_fast(datetime_str)
+    if parsed is None:
+        parsed = parse(datetime_str)
+    return check_datetime_range(parsed)
+
+
+def check_datetime_range(value: datetime.datetime) -> datetime.datetime:
+    """
+    Return the datetime, or raise ValueError for an aware one so close to
+    the ends of the calendar that the local time or date of some time zone
+    falls outside it.
+    """
+    if value.tzinfo is None:
+        return value
+    try:
+        instant = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    except OverflowError:
+        raise ValueError("Datetime out of range")
+    if not datetime.datetime.min + CALENDAR_MARGIN <= instant <= datetime.datetime.max - CALENDAR_MARGIN:
+        raise ValueError("Datetime out of range")
+    return value
+
+
+def parse_datetime_fast(datetime_str):
+    """
+    Convert ISO 8601 datetimes and Unix times directly, or return None if
+    unsure. A Unix time is an instant, in UTC.
+    """
+    if ISO_DATETIME_PATTERN.fullmatch(datetime_str):
+        try:
+            return datetime.datetime.fromisoformat(datetime_str)
+        except ValueError:
+            # Out of range fields, such as month 13, are left to dateutil
+            return None
+    match = EPOCH_PATTERN.fullmatch(datetime_str)
+    if match:
+        seconds, fraction = match.groups()
+        return datetime.datetime.fromtimestamp(int(seconds), datetime.timezone.utc).replace(
+            microsecond=int((fraction or '').ljust(6, '0'))
+        )
+    return None
+
+
+def parse_weekday_time(weekday_str, time_str):
+    """
+    Naive datetime in the week of REFERENCE_MONDAY at a weekday ("Mon" or
+    "Monday") and a time of the formats `parse_time_fast` converts; raises
+    ValueError for anything else.
+    """
+    weekday = weekday_str.strip().title()
+    index = WEEKDAY_INDEX.get(DAY_ABBREVIATIONS.get(weekday, weekday))
+    parsed_time = parse_time_fast(time_str.strip())
+    if index is None or parsed_time is None:
+        raise ValueError(f"Invalid weekday or time: {weekday_str!r} {time_str!r}")
+    return datetime.datetime.combine(REFERENCE_MONDAY + datetime.timedelta(days=index), parsed_time)
+
+
 def parse_opening_hours(hours_str):
+    return [
+        {
+            'days': list(days),
+            'opening_time': opening_time,
+            'closing_time': closing_time,
+        }
+        for days, opening_time, closing_time in _parse_opening_hours_cached(hours_str)
+    ]
+
+
+def unparsed_segments(hours_str):
+    """
+    Segments of an hours string that `parse_opening_hours` skips.
+    """
+    return [
+        part for part in (part.strip() for part in hours_str.split('/'))
+        if not SEGMENT_PATTERN.match(part)
+    ]
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_opening_hours_cached(hours_str):
     schedules = []
     parts = [part.strip() for part in hours_str.split('/')]
     for part in parts:
         # Extract days and times
-        match = re.match(
-            r'(.+?)\s+(\d{1,2}(:\d{2})?\s*(am|pm)?\s*-\s*\d{1,2}(:\d{2})?\s*(am|pm)?)',
-            part,
-            re.IGNORECASE
-        )
+        match = SEGMENT_PATTERN.match(part)
         if not match:
             continue
         days_part, times_part = match.groups()[0], match.groups()[1]
         days = parse_days(days_part)
         opening_time, closing_time = parse_times(times_part)
-        schedules.append({
-            'days': days,
-            'opening_time': opening_time,
-            'closing_time': closing_time,
-        })
-    return schedules
+        schedules.append((tuple(days), opening_time, closing_time))
+    return tuple(schedules)
+
 
+def file_content_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-def populate_database_with_restaurants(db: Session):
+
+def record_import(db: Session, source, content_hash):
     """
-    Load restaurant data at startup
+    Note the content hash of the file loaded from `source`, in the
+    transaction that loads it.
     """
-    restaurants_data = read_csv_data('restaurants.csv')
+    source = str(source)
+    last_import = db.query(DataImport).filter(DataImport.source == source).one_or_none()
+    if last_import is None:
+        db.add(DataImport(source=source, content_hash=content_hash))
+    else:
+        last_import.content_hash = content_hash
+        last_import.loaded_at = func.now()
 
-    for restaurant in restaurants_data:
-        restaurant['schedules'] = parse_opening_hours(restaurant['hours'])
 
-    for restaurant in restaurants_data:
-        schedules = restaurant.pop('schedules')
-        db_restaurant = Restaurant(
-            restaurant_name=restaurant['name'],
-            working_hours=restaurant['hours'],
-        )
-        db.add(db_restaurant)
-        db.commit()
-        for schedule in schedules:
-            db_schedule = Schedule(
-                days=Schedule.days_list_to_string(schedule['days']),
-                opening_time=schedule['opening_time'],
-                closing_time=schedule['closing_time'],
+def record_write(db: Session):
+    """
+    Note a write made through the API, in its transaction, so the index
+    built from the data before it is not taken for current.
+    """
+    record_import(db, API_SOURCE, uuid.uuid4().hex)
+
+
+def import_stamp(db: Session) -> bytes:
+    """
+    Digest of the source, content hash and load time of every data import,
+    which changes whenever any process loads data.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for source, content_hash, loaded_at in db.execute(
+        select(DataImport.source, DataImport.content_hash, DataImport.loaded_at).order_by(DataImport.source)
+    ):
+        digest.update(f'{source}\0{content_hash}\0{loaded_at}\n'.encode())
+    return digest.digest()
+
+
+def acquire_loader_lock(db: Session):
+    """
+    Block until no other worker is loading data; released on commit/rollback.
+
+    Postgres takes an advisory lock. A SQLite file takes its write lock up
+    front, waiting up to SQLITE_BUSY_TIMEOUT for it, since a transaction
+    that has only read fails at once when it comes to write while another
+    one holds the lock.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name == 'postgresql':
+        db.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': LOADER_LOCK_KEY})
+    elif bind.dialect.name == 'sqlite' and not is_sqlite_memory(bind.url):
+        if not db.connection().connection.driver_connection.in_transaction:
+            db.execute(text('BEGIN IMMEDIATE'))
+
+
+def bulk_insert_restaurants(db: Session, restaurants):
+    """
+    Insert restaurants with their parsed schedules in bulk.
+
+    Each restaurant is a dict with 'name', 'hours', optionally 'timezone',
+    and 'schedules' as returned by `parse_opening_hours`. Nothing is committed.
+    """
+    restaurant_ids = insert_rows(
+        db,
+        Restaurant,
+        ('restaurant_name', 'working_hours', 'timezone'),
+        [
+            (restaurant['name'], restaurant['hours'], restaurant.get('timezone'))
+            for restaurant in restaurants
+        ],
+        returning_ids=True,
+    )
+    insert_schedules(db, restaurant_ids, restaurants)
+
+
+def insert_schedules(db: Session, restaurant_ids, restaurants):
+    """
+    Insert the parsed schedules of existing restaurants, and their
+    intervals, in bulk. Nothing is committed.
+    """
+    schedule_rows = [
+        (restaurant_id, schedule)
+        for restaurant_id, restaurant in zip(restaurant_ids, restaurants)
+        for schedule in restaurant['schedules']
+    ]
+    schedule_ids = insert_rows(
+        db,
+        Schedule,
+        ('restaurant_id', 'days', 'opening_time', 'closing_time'),
+        [
+            (
+                restaurant_id,
+                Schedule.days_list_to_string(schedule['days']),
+                schedule['opening_time'],
+                schedule['closing_time'],
             )
-            db_schedule.restaurant = db_restaurant
-            db.add(db_schedule)
+            for restaurant_id, schedule in schedule_rows
+        ],
+        returning_ids=True,
+    )
+    # Intervals are normally derived on flush; Core inserts bypass that hook
+    insert_rows(
+        db,
+        ScheduleInterval,
+        ('schedule_id', 'restaurant_id', 'start_minute', 'end_minute'),
+        [
+            (schedule_id, restaurant_id, start, end)
+            for schedule_id, (restaurant_id, schedule) in zip(schedule_ids, schedule_rows)
+            for start, end in schedule_intervals(
+                schedule['days'], schedule['opening_time'], schedule['closing_time']
+            )
+        ],
+    )
+
+
+def insert_rows(db: Session, model, columns, rows, returning_ids=False):
+    """
+    Bulk insert tuples of column values and optionally return their new ids.
+
+    Postgres gets a single COPY, with ids reserved from the table's sequence
+    up front; other databases get multi-row INSERT statements.
+    """
+    if not rows:
+        return []
+    if db.get_bind().dialect.name != 'postgresql':
+        statement = insert(model)
+        if returning_ids:
+            statement = statement.returning(model.id, sort_by_parameter_order=True)
+        result = db.execute(statement, [dict(zip(columns, row)) for row in rows])
+        return result.scalars().all() if returning_ids else []
+
+    ids = []
+    if returning_ids:
+        ids = db.scalars(
+            text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                "FROM generate_series(1, :count)"
+            ),
+            {'table': model.__tablename__, 'count': len(rows)},
+        ).all()
+        columns = ('id',) + tuple(columns)
+        rows = [(row_id,) + tuple(row) for row_id, row in zip(ids, rows)]
+    cursor = db.connection().connection.cursor()
+    with cursor.copy(
+        f'COPY {model.__tablename__} ({", ".join(columns)}) FROM STDIN'
+    ) as copy:
+        for row in rows:
+            copy.write_row(row)
+    return ids
 
-    db.commit()
+
+def populate_database_with_restaurants(
+    db: Session, csv_file_path='restaurants.csv', *, workers=None, force=False
+):
+    """
+    Load restaurant data at startup.
+
+    The load is skipped when the file content matches the last one loaded.
+    Otherwise, into an empty database or with `force`, the CSV replaces all
+    stored restaurants, and their schedule exceptions with them; once
+    restaurants are stored, only the rows that differ are applied, so
+    restaurants whose name stays keep their id and exceptions. Either way
+    it happens in a single transaction. Returns the `IngestReport` or
+    `ReloadReport` of the load, or None if it was skipped.
+    """
+    from core.ingest import ReloadReport, diff_csv, ingest_csv
+
+    start = time.perf_counter()
+    content_hash = file_content_hash(csv_file_path)
+    acquire_loader_lock(db)
+    last_import = db.query(DataImport).filter(DataImport.source == csv_file_path).one_or_none()
+    if not force and last_import is not None and last_import.content_hash == content_hash:
+        db.rollback()
+        return None
+
+    try:
+        if force or db.query(Restaurant.id).first() is None:
+            db.execute(delete(Restaurant))
+            report = ingest_csv(
+                db, csv_file_path, workers=workers,
+                cache_path=settings.PARSE_CACHE_PATH, content_hash=content_hash,
+            )
+        else:
+            report = ReloadReport()
+            diff_csv(db, csv_file_path, report)
+            report.seconds = time.perf_counter() - start
+        record_import(db, csv_file_path, content_hash)
+        db.commit()
+        response_cache.clear()
+    except Exception:
+        db.rollback()
+        raise
+    return report
@@ -0,0 +1,216 @@
+import datetime
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+MINUTES_PER_DAY = 24 * 60
+DAYS_PER_WEEK = 7
+MINUTES_PER_WEEK = DAYS_PER_WEEK * MINUTES_PER_DAY
+
+WEEKDAYS = [
+    'Monday',
+    'Tuesday',
+    'Wednesday',
+    'Thursday',
+    'Friday',
+    'Saturday',
+    'Sunday',
+]
+WEEKDAY_INDEX = {day: index for index, day in enumerate(WEEKDAYS)}
+
+# Sorted minutes where a restaurant opens or closes, whether each of them is
+# an opening, and for restaurants without changes whether they never close
+ChangePoints = namedtuple('ChangePoints', ['minutes', 'opens', 'always_open'])
+
+
+def minute_of_day(value: datetime.time) -> int:
+    return value.hour * 60 + value.minute
+
+
+def minute_of_week(value: datetime.datetime) -> int:
+    """
+    Minute of the week, starting Monday 00:00, truncated to the minute.
+    """
+    return value.weekday() * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+
+@lru_cache(maxsize=None)
+def zone_info(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+def zone_sort_key(zone):
+    # None, the default zone, sorts first
+    return (zone is not None, zone or '')
+
+
+def minutes_by_zone(at: datetime.datetime, zones, default_zone: str) -> dict:
+    """
+    Group restaurant time zones by the minute of the week `at` falls on in
+    each of them; None stands for `default_zone`.
+
+    A naive `at` is local time wherever a restaurant is, and so is an aware
+    one falling on the same minute in every zone; both give a single minute
+    mapped to None, meaning every zone. Otherwise the instant is converted
+    once per zone, which accounts for daylight saving time, and zones at
+    the same UTC offset share a minute.
+    """
+    if at.tzinfo is None:
+        return {minute_of_week(at): None}
+    groups = {}
+    for zone in sorted(zones or [None], key=zone_sort_key):
+        local = at.astimezone(zone_info(zone or default_zone))
+        groups.setdefault(minute_of_week(local), []).append(zone)
+    if len(groups) == 1:
+        return dict.fromkeys(groups)
+    return {minute: tuple(group) for minute, group in groups.items()}
+
+
+def local_dates(at: datetime.datetime, zone_minutes: dict) -> dict:
+    """
+    Local date at each minute of `minutes_by_zone`. UTC offsets being less
+    than a day, the local date is the UTC date or the day either side of it,
+    whichever has the weekday of the minute, so zones at the same minute
+    share it, a single group standing for every zone included.
+    """
+    if at.tzinfo is None:
+        return dict.fromkeys(zone_minutes, at.date())
+    day = datetime.timedelta(days=1)
+    utc_date = at.astimezone(datetime.timezone.utc).date()
+    nearby = {date.weekday(): date for date in (utc_date - day, utc_date, utc_date + day)}
+    return {minute: nearby[minute // MINUTES_PER_DAY] for minute in zone_minutes}
+
+
+def windows_by_zone(start: datetime.datetime, end: datetime.datetime, zones, default_zone: str) -> dict:
+    """
+    Group restaurant time zones by the `window_pieces` of the window from
+    start to end on their local clocks, like `minutes_by_zone`: a naive
+    window, or one falling on the same minutes in every zone, gives a
+    single group mapped to None.
+    """
+    if start.tzinfo is None:
+        return {tuple(window_pieces(start, end)): None}
+    groups = {}
+    for zone in sorted(zones or [None], key=zone_sort_key):
+        info = zone_info(zone or default_zone)
+        local_start = start.astimezone(info).replace(tzinfo=None)
+        # The clocks going back can bring the end before the start
+        local_end = max(local_start, end.astimezone(info).replace(tzinfo=None))
+        groups.setdefault(tuple(window_pieces(local_start, local_end)), []).append(zone)
+    if len(groups) == 1:
+        return dict.fromkeys(groups)
+    return {pieces: tuple(group) for pieces, group in groups.items()}
+
+
+def schedule_intervals(days, opening_time, closing_time):
+    """
+    Expand one schedule into half-open [start, end) minute-of-week intervals.
+
+    The closing minute is inclusive. Hours where the closing time is not after
+    the opening time run past midnight, so they are split into the rest of the
+    opening day and the start of the following one (Sunday spills into
+    Monday). Every interval therefore lies within a single day.
+    """
+    opening = minute_of_day(opening_time)
+    closing = minute_of_day(closing_time)
+    intervals = []
+    for day in days:
+        index = WEEKDAY_INDEX.get(day)
+        if index is None:
+            continue
+        day_start = index * MINUTES_PER_DAY
+        if closing > opening:
+            intervals.append((day_start + opening, day_start + closing + 1))
+        else:
+            next_day_start = (index + 1) % DAYS_PER_WEEK * MINUTES_PER_DAY
+            intervals.append((day_start + opening, day_start + MINUTES_PER_DAY))
+            intervals.append((next_day_start, next_day_start + closing + 1))
+    return intervals
+
+
+def window_pieces(start: datetime.datetime, end: datetime.datetime):
+    """
+    Split the window from start to end, both inclusive and truncated to the
+    minute, into [first, last] minute-of-week ranges that do not wrap.
+
+    A window reaching past Sunday midnight becomes two pieces, and one that
+    lasts a week or longer covers the whole week.
+    """
+    span = (end.replace(second=0, microsecond=0) - start.replace(second=0, microsecond=0))
+    span_minutes = int(span.total_seconds()) // 60
+    if span_minutes < 0:
+        raise ValueError("Window end is before its start")
+    if span_minutes >= MINUTES_PER_WEEK - 1:
+        return [(0, MINUTES_PER_WEEK - 1)]
+    first = minute_of_week(start)
+    last = first + span_minutes
+    if last < MINUTES_PER_WEEK:
+        return [(first, last)]
+    return [(first, MINUTES_PER_WEEK - 1), (0, last - MINUTES_PER_WEEK)]
+
+
+def intervals_cover(intervals, first, last):
+    """
+    Whether half-open [start, end) intervals together cover minutes first..last.
+    """
+    covered_until = first
+    for start, end in sorted(intervals):
+        if start > covered_until:
+            break
+        covered_until = max(covered_until, end)
+    return covered_until > last
+
+
+def change_points(intervals) -> ChangePoints:
+    """
+    Minutes of the week at which half-open [start, end) intervals switch
+    between open and closed.
+
+    Overlapping and touching intervals are merged first, including across
+    Sunday midnight, so consecutive days of overnight hours do not produce a
+    close and a reopening at midnight.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    if not merged:
+        return ChangePoints((), (), False)
+    if merged[0] == [0, MINUTES_PER_WEEK]:
+        return ChangePoints((), (), True)
+
+    points = []
+    for start, end in merged:
+        points.append((start, True))
+        points.append((end % MINUTES_PER_WEEK, False))
+    if merged[0][0] == 0 and merged[-1][1] == MINUTES_PER_WEEK:
+        points.remove((0, True))
+        points.remove((0, False))
+    points.sort()
+    return ChangePoints(
+        tuple(minute for minute, _ in points),
+        tuple(opens for _, opens in points),
+        False,
+    )
+
+
+def next_change(points: ChangePoints, minute: int):
+    """
+    Whether the restaurant is open at the minute, the number of minutes until
+    it next opens or closes, and whether that change is an opening.
+
+    The last two are None for restaurants that never change.
+    """
+    if not points.minutes:
+        return points.always_open, None, None
+    position = bisect_right(points.minutes, minute)
+    if position == len(points.minutes):
+        position = 0
+        minutes_until = points.minutes[0] + MINUTES_PER_WEEK - minute
+    else:
+        minutes_until = points.minutes[position] - minute
+    opens = points.opens[position]
+    return not opens, minutes_until, opens
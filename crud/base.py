@@ -1,8 +1,13 @@
 from typing import TypeVar, Generic, Type
 
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from core.response_cache import response_cache
+from core.schedule_index import invalidate_opening_hours
+from core.utils import record_write
 from database_app.database import Base
 
 ModelType = TypeVar("ModelType", bound=Base)
@@ -17,12 +22,46 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def get_all(self, db: Session):
         return db.query(self.model).all()
 
+    async def aget_all(self, db: AsyncSession):
+        return (await db.scalars(select(self.model))).all()
+
+    def invalidate(self):
+        """
+        Drop what was derived from the stored data, after a committed write.
+        """
+        response_cache.clear()
+
     def create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType:
         try:
             db_obj = self.model(**obj_in.model_dump())
             db.add(db_obj)
+            record_write(db)
             db.commit()
+            self.invalidate()
             db.refresh(db_obj)
             return db_obj
         except Exception:
             db.rollback()
+
+    async def acreate(self, db: AsyncSession, *, obj_in: CreateSchemaType) -> ModelType:
+        try:
+            db_obj = self.model(**obj_in.model_dump())
+            db.add(db_obj)
+            await db.run_sync(record_write)
+            await db.commit()
+            self.invalidate()
+            await db.refresh(db_obj)
+            return db_obj
+        except Exception:
+            # Raised for the caller to answer, rather than returning None
+            await db.rollback()
+            raise
+
+
+class IndexedCRUDMixin:
+    """
+    For the models the opening hours index is built from.
+    """
+
+    def invalidate(self):
+        invalidate_opening_hours()
@@ -1,47 +1,527 @@
 import datetime
+from bisect import bisect_left
 
-from sqlalchemy import func, or_, and_
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from crud.base import CRUDBase
-from database_app.models import Restaurant, Schedule
+from core.config import settings
+from core.occupancy import WeeklyOccupancy
+from core.overrides import NEVER_OPEN, apply_changes
+from core.week import (
+    MINUTES_PER_DAY,
+    change_points,
+    intervals_cover,
+    local_dates,
+    minutes_by_zone,
+    windows_by_zone,
+)
+from crud.base import CRUDBase, IndexedCRUDMixin
+from crud.schedule_exception import crud_schedule_exception
+from database_app.models import Restaurant, ScheduleInterval
 
 from schemas.restaurant import RestaurantCreate, RestaurantUpdate
 
 
-class CRUDRestaurant(CRUDBase[Restaurant, RestaurantCreate, RestaurantUpdate]):
+class CRUDRestaurant(IndexedCRUDMixin, CRUDBase[Restaurant, RestaurantCreate, RestaurantUpdate]):
+
+    @staticmethod
+    def _open_at(minute: int):
+        # Intervals never cross midnight, so only those starting within the
+        # last day can contain the minute; this bounds the index scan
+        return and_(
+            ScheduleInterval.start_minute.between(minute - MINUTES_PER_DAY + 1, minute),
+            ScheduleInterval.end_minute > minute,
+        )
+
+    def _in_zones(self, zones):
+        names = [zone for zone in zones if zone is not None]
+        clauses = [self.model.timezone.in_(names)] if names else []
+        if None in zones:
+            clauses.append(self.model.timezone.is_(None))
+        return or_(*clauses)
+
+    def open_at_statement(self, minute: int, *columns):
+        """
+        Restaurants open at the given minute of the week, each once, or just
+        the given columns of them.
+        """
+        return select(*(columns or (self.model,))).join(
+            ScheduleInterval, ScheduleInterval.restaurant_id == self.model.id,
+        ).where(self._open_at(minute)).distinct()
+
+    def open_in_zones_statement(self, zone_minutes: dict, *columns, changes=None):
+        """
+        Like `open_at_statement`, matching the restaurants of each group of
+        time zones from `minutes_by_zone` at its own minute.
+
+        `changes` are the (closed ids, opened entries) schedule exceptions
+        make at that time, from `ScheduleOverrides.changes`; they are
+        matched by id, so the statement has no more joins with them.
+        """
+        closed, opened = changes or ((), {})
+        if closed or opened:
+            weekly = self.open_in_zones_statement(zone_minutes, self.model.id)
+            open_weekly = self.model.id.in_(weekly)
+            if closed:
+                open_weekly = and_(open_weekly, self.model.id.not_in(list(closed)))
+            return select(*(columns or (self.model,))).where(
+                or_(open_weekly, self.model.id.in_(list(opened))) if opened else open_weekly
+            )
+        if len(zone_minutes) == 1 and None in zone_minutes.values():
+            return self.open_at_statement(next(iter(zone_minutes)), *columns)
+        return select(*(columns or (self.model,))).join(
+            ScheduleInterval, ScheduleInterval.restaurant_id == self.model.id,
+        ).where(or_(*(
+            and_(self._in_zones(zones), self._open_at(minute))
+            for minute, zones in zone_minutes.items()
+        ))).distinct()
+
+    def _timezones_statement(self):
+        return select(self.model.timezone).distinct()
+
+    def get_timezones(self, db: Session):
+        """
+        Time zones in use, None among them for restaurants without one.
+        """
+        return db.scalars(self._timezones_statement()).all()
+
+    async def aget_timezones(self, db: AsyncSession):
+        return (await db.scalars(self._timezones_statement())).all()
+
+    def _timezones_by_id_statement(self, restaurant_ids):
+        statement = select(self.model.id, self.model.timezone)
+        if restaurant_ids is not None:
+            statement = statement.where(self.model.id.in_(restaurant_ids))
+        return statement
+
+    def get_timezones_by_id(self, db: Session, restaurant_ids=None) -> dict:
+        """
+        Time zone of the given restaurants, or of all of them, by id.
+        """
+        return dict(db.execute(self._timezones_by_id_statement(restaurant_ids)).all())
+
+    async def aget_timezones_by_id(self, db: AsyncSession, restaurant_ids=None) -> dict:
+        return dict((await db.execute(self._timezones_by_id_statement(restaurant_ids))).all())
+
+    def minutes_by_zone(self, db: Session, opening_hours: datetime) -> dict:
+        """
+        The minute of the week to match the restaurants of each time zone
+        at; an aware datetime is converted once per zone in use.
+        """
+        if opening_hours.tzinfo is None:
+            return minutes_by_zone(opening_hours, (), settings.DEFAULT_TIMEZONE)
+        return minutes_by_zone(opening_hours, self.get_timezones(db), settings.DEFAULT_TIMEZONE)
+
+    async def aminutes_by_zone(self, db: AsyncSession, opening_hours: datetime) -> dict:
+        if opening_hours.tzinfo is None:
+            return minutes_by_zone(opening_hours, (), settings.DEFAULT_TIMEZONE)
+        return minutes_by_zone(opening_hours, await self.aget_timezones(db), settings.DEFAULT_TIMEZONE)
+
+    def windows_by_zone(self, db: Session, start: datetime, end: datetime) -> dict:
+        """
+        The minutes of the week to match the restaurants of each time zone
+        over a window; an aware one is converted once per zone in use.
+        """
+        zones = self.get_timezones(db) if start.tzinfo is not None else ()
+        return windows_by_zone(start, end, zones, settings.DEFAULT_TIMEZONE)
+
+    async def awindows_by_zone(self, db: AsyncSession, start: datetime, end: datetime) -> dict:
+        zones = await self.aget_timezones(db) if start.tzinfo is not None else ()
+        return windows_by_zone(start, end, zones, settings.DEFAULT_TIMEZONE)
+
+    def override_changes(self, db: Session, opening_hours: datetime, zone_minutes: dict):
+        """
+        (closed ids, opened entries) of the schedule exceptions on the local
+        dates of the time; nothing to change on dates without any.
+        """
+        dates = local_dates(opening_hours, zone_minutes)
+        return crud_schedule_exception.get_overrides(db).changes(zone_minutes, dates)
+
+    async def aoverride_changes(self, db: AsyncSession, opening_hours: datetime, zone_minutes: dict):
+        dates = local_dates(opening_hours, zone_minutes)
+        return (await crud_schedule_exception.aget_overrides(db)).changes(zone_minutes, dates)
 
     def get_by_opening_hours(self, db: Session, opening_hours: datetime):
-        check_day = opening_hours.strftime('%A')  # Get the day of the week
-        check_time = opening_hours.time()
-
-        query = db.query(self.model).join(self.model.schedules).filter(
-            # Check if the day is in the Schedule.days string
-            or_(
-                Schedule.days == check_day,
-                Schedule.days.like(f'{check_day},%'),
-                Schedule.days.like(f'%,{check_day},%'),
-                Schedule.days.like(f'%,{check_day}')
-            ),
-            or_(
-                # Case where closing_time > opening_time (normal hours)
-                and_(
-                    Schedule.closing_time > Schedule.opening_time,
-                    Schedule.opening_time <= check_time,
-                    check_time <= Schedule.closing_time
-                ),
-                # Case where closing_time <= opening_time (overnight hours)
-                and_(
-                    Schedule.closing_time <= Schedule.opening_time,
-                    or_(
-                        check_time >= Schedule.opening_time,
-                        check_time <= Schedule.closing_time
-                    )
-                )
+        """
+        Restaurants open at the given time; a naive datetime is local time
+        wherever the restaurant is, an aware one an instant. Schedule
+        exceptions on the date take the place of the weekly hours.
+        """
+        zone_minutes = self.minutes_by_zone(db, opening_hours)
+        changes = self.override_changes(db, opening_hours, zone_minutes)
+        return db.scalars(self.open_in_zones_statement(zone_minutes, changes=changes)).all()
+
+    async def aget_by_opening_hours(self, db: AsyncSession, opening_hours: datetime):
+        zone_minutes = await self.aminutes_by_zone(db, opening_hours)
+        changes = await self.aoverride_changes(db, opening_hours, zone_minutes)
+        return (await db.scalars(self.open_in_zones_statement(zone_minutes, changes=changes))).all()
+
+    def _name_contains(self, query: str):
+        # ILIKE is served by the pg_trgm index on names where there is one,
+        # and the planner picks whichever of it and the interval index is
+        # more selective; without it the open restaurants are filtered
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return self.model.restaurant_name.ilike(f'%{escaped}%', escape='\\')
+
+    def _open_names_statement(self, zone_minutes: dict, changes, after_id=None, limit=None, q=None):
+        statement = self.open_in_zones_statement(
+            zone_minutes, self.model.id, self.model.restaurant_name, changes=changes
+        ).order_by(self.model.id)
+        if q is not None:
+            statement = statement.where(self._name_contains(q))
+        if after_id is not None:
+            statement = statement.where(self.model.id > after_id)
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    def get_names_by_opening_hours(
+        self,
+        db: Session,
+        opening_hours: datetime,
+        *,
+        after_id=None,
+        limit=None,
+        zone_minutes=None,
+        changes=None,
+        q=None,
+    ):
+        """
+        (id, restaurant_name) rows of the restaurants open at the given time,
+        without loading the entities, in pages of ids after `after_id`, and
+        only those whose name contains `q`, ignoring case, if given.
+
+        `zone_minutes` and `changes` skip looking up the time zones in use
+        and the schedule exceptions when the caller already did, with
+        `minutes_by_zone` and `override_changes`.
+        """
+        if zone_minutes is None:
+            zone_minutes = self.minutes_by_zone(db, opening_hours)
+        if changes is None:
+            changes = self.override_changes(db, opening_hours, zone_minutes)
+        return db.execute(self._open_names_statement(zone_minutes, changes, after_id, limit, q)).all()
+
+    async def aget_names_by_opening_hours(
+        self,
+        db: AsyncSession,
+        opening_hours: datetime,
+        *,
+        after_id=None,
+        limit=None,
+        zone_minutes=None,
+        changes=None,
+        q=None,
+    ):
+        if zone_minutes is None:
+            zone_minutes = await self.aminutes_by_zone(db, opening_hours)
+        if changes is None:
+            changes = await self.aoverride_changes(db, opening_hours, zone_minutes)
+        return (await db.execute(
+            self._open_names_statement(zone_minutes, changes, after_id, limit, q)
+        )).all()
+
+    async def astream_names_by_opening_hours(
+        self,
+        db: AsyncSession,
+        opening_hours: datetime,
+        *,
+        after_id=None,
+        limit=None,
+        batch_size=1000,
+        zone_minutes=None,
+        changes=None,
+        q=None,
+    ):
+        """
+        Yield the (id, restaurant_name) rows in batches from a server-side
+        cursor, so only one batch is held in memory at a time.
+        """
+        if zone_minutes is None:
+            zone_minutes = await self.aminutes_by_zone(db, opening_hours)
+        if changes is None:
+            changes = await self.aoverride_changes(db, opening_hours, zone_minutes)
+        statement = self._open_names_statement(zone_minutes, changes, after_id, limit, q)
+        result = await db.stream(statement.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield rows
+
+    @staticmethod
+    def _overlapping_intervals(pieces):
+        return or_(*(
+            and_(
+                ScheduleInterval.start_minute.between(first - MINUTES_PER_DAY + 1, last),
+                ScheduleInterval.end_minute > first,
+            )
+            for first, last in pieces
+        ))
+
+    def _in_windows(self, windows):
+        """
+        Intervals overlapping the window of their restaurant's time zone,
+        from `windows_by_zone`; the restaurants have to be joined.
+        """
+        return or_(*(
+            self._overlapping_intervals(pieces) if zones is None
+            else and_(self._in_zones(zones), self._overlapping_intervals(pieces))
+            for pieces, zones in windows.items()
+        ))
+
+    def _open_any_statement(self, windows):
+        restaurant_ids = select(ScheduleInterval.restaurant_id).join(
+            self.model, self.model.id == ScheduleInterval.restaurant_id,
+        ).where(self._in_windows(windows))
+        return select(self.model).where(self.model.id.in_(restaurant_ids))
+
+    @staticmethod
+    def _window_changes(overrides, change_points, restaurant_ids, start, end, throughout):
+        return overrides.window_changes(
+            {restaurant_id: change_points.get(restaurant_id, NEVER_OPEN) for restaurant_id in restaurant_ids},
+            start,
+            end,
+            settings.DEFAULT_TIMEZONE,
+            throughout,
+        )
+
+    def _with_window_exceptions(self, db: Session, restaurants, start, end, throughout=False):
+        """
+        Restaurants open over a window by their weekly hours, corrected for
+        the schedule exceptions on its dates and then ordered by id.
+        """
+        overrides = crud_schedule_exception.get_overrides(db)
+        restaurant_ids = overrides.window_restaurants(start, end)
+        if not restaurant_ids:
+            return restaurants
+        change_points = self.get_change_points(db, restaurant_ids)
+        return apply_changes(
+            restaurants, *self._window_changes(overrides, change_points, restaurant_ids, start, end, throughout)
+        )
+
+    async def _awith_window_exceptions(self, db: AsyncSession, restaurants, start, end, throughout=False):
+        overrides = await crud_schedule_exception.aget_overrides(db)
+        restaurant_ids = overrides.window_restaurants(start, end)
+        if not restaurant_ids:
+            return restaurants
+        change_points = await self.aget_change_points(db, restaurant_ids)
+        return apply_changes(
+            restaurants, *self._window_changes(overrides, change_points, restaurant_ids, start, end, throughout)
+        )
+
+    def open_any(self, db: Session, start: datetime, end: datetime):
+        """
+        Restaurants open at any point between start and end; an aware
+        window is read on each restaurant's local clock. Schedule
+        exceptions on the dates of the window take the place of the weekly
+        hours.
+        """
+        restaurants = db.scalars(self._open_any_statement(self.windows_by_zone(db, start, end))).all()
+        return self._with_window_exceptions(db, restaurants, start, end)
+
+    async def aopen_any(self, db: AsyncSession, start: datetime, end: datetime):
+        windows = await self.awindows_by_zone(db, start, end)
+        restaurants = (await db.scalars(self._open_any_statement(windows))).all()
+        return await self._awith_window_exceptions(db, restaurants, start, end)
+
+    def _window_intervals_statement(self, windows):
+        return select(
+            ScheduleInterval.restaurant_id,
+            ScheduleInterval.start_minute,
+            ScheduleInterval.end_minute,
+            self.model.timezone,
+        ).join(self.model, self.model.id == ScheduleInterval.restaurant_id).where(self._in_windows(windows))
+
+    @staticmethod
+    def _covering_restaurant_ids(windows, rows):
+        intervals = {}
+        zones = {}
+        for restaurant_id, start_minute, end_minute, zone in rows:
+            intervals.setdefault(restaurant_id, []).append((start_minute, end_minute))
+            zones[restaurant_id] = zone
+        pieces_by_zone = {
+            zone: pieces for pieces, group in windows.items() if group is not None for zone in group
+        }
+        return [
+            restaurant_id
+            for restaurant_id, restaurant_intervals in intervals.items()
+            if all(
+                intervals_cover(restaurant_intervals, first, last)
+                for first, last in pieces_by_zone.get(zones[restaurant_id], next(iter(windows)))
             )
+        ]
+
+    def open_during(self, db: Session, start: datetime, end: datetime):
+        """
+        Restaurants open for the whole time from start to end; an aware
+        window is read on each restaurant's local clock. Schedule
+        exceptions on the dates of the window take the place of the weekly
+        hours.
+
+        Only the intervals overlapping the window are read, and they are
+        merged per restaurant, so a window crossing midnight or the end of
+        the week is covered by consecutive intervals.
+        """
+        windows = self.windows_by_zone(db, start, end)
+        restaurant_ids = self._covering_restaurant_ids(
+            windows, db.execute(self._window_intervals_statement(windows))
+        )
+        restaurants = []
+        if restaurant_ids:
+            restaurants = db.scalars(select(self.model).where(self.model.id.in_(restaurant_ids))).all()
+        return self._with_window_exceptions(db, restaurants, start, end, throughout=True)
+
+    async def aopen_during(self, db: AsyncSession, start: datetime, end: datetime):
+        windows = await self.awindows_by_zone(db, start, end)
+        restaurant_ids = self._covering_restaurant_ids(
+            windows, await db.execute(self._window_intervals_statement(windows))
+        )
+        restaurants = []
+        if restaurant_ids:
+            restaurants = (await db.scalars(select(self.model).where(self.model.id.in_(restaurant_ids)))).all()
+        return await self._awith_window_exceptions(db, restaurants, start, end, throughout=True)
+
+    @staticmethod
+    def _intervals_around_statement(minutes):
+        # Every interval containing one of the sorted minutes starts within
+        # the day before the first one and ends after it
+        return select(
+            ScheduleInterval.restaurant_id,
+            ScheduleInterval.start_minute,
+            ScheduleInterval.end_minute,
+        ).where(
+            ScheduleInterval.start_minute.between(minutes[0] - MINUTES_PER_DAY + 1, minutes[-1]),
+            ScheduleInterval.end_minute > minutes[0],
+        )
+
+    @staticmethod
+    def _open_ids_by_minutes(minutes, rows) -> dict:
+        open_ids = {minute: set() for minute in minutes}
+        for restaurant_id, start_minute, end_minute in rows:
+            first = bisect_left(minutes, start_minute)
+            last = bisect_left(minutes, end_minute)
+            for minute in minutes[first:last]:
+                open_ids[minute].add(restaurant_id)
+        return {minute: sorted(restaurant_ids) for minute, restaurant_ids in open_ids.items()}
+
+    def get_open_ids_by_minutes(self, db: Session, minutes) -> dict:
+        """
+        Ids of the restaurants open at each minute of the week, in one query.
+
+        The intervals around the minutes are read once and matched to the
+        minutes with binary searches.
+        """
+        minutes = sorted(set(minutes))
+        if not minutes:
+            return {}
+        return self._open_ids_by_minutes(minutes, db.execute(self._intervals_around_statement(minutes)))
+
+    async def aget_open_ids_by_minutes(self, db: AsyncSession, minutes) -> dict:
+        minutes = sorted(set(minutes))
+        if not minutes:
+            return {}
+        return self._open_ids_by_minutes(
+            minutes, await db.execute(self._intervals_around_statement(minutes))
+        )
+
+    def _zoned_intervals_around_statement(self, minutes):
+        return self._intervals_around_statement(minutes).add_columns(self.model.timezone).join(
+            self.model, self.model.id == ScheduleInterval.restaurant_id,
         )
 
-        return query.all()
+    @staticmethod
+    def _open_ids_by_zone_minutes(minutes, rows, zone_minutes_list) -> list:
+        open_at = {minute: [] for minute in minutes}
+        for restaurant_id, start_minute, end_minute, zone in rows:
+            first = bisect_left(minutes, start_minute)
+            last = bisect_left(minutes, end_minute)
+            for minute in minutes[first:last]:
+                open_at[minute].append((restaurant_id, zone))
+        return [
+            sorted({
+                restaurant_id
+                for minute, zones in zone_minutes.items()
+                for restaurant_id, zone in open_at[minute]
+                if zones is None or zone in zones
+            })
+            for zone_minutes in zone_minutes_list
+        ]
+
+    def get_open_ids_by_zone_minutes(self, db: Session, zone_minutes_list) -> list:
+        """
+        Ids of the restaurants open at each of many `minutes_by_zone`
+        mappings, in one query, like `get_open_ids_by_minutes`.
+        """
+        minutes = sorted({minute for zone_minutes in zone_minutes_list for minute in zone_minutes})
+        if not minutes:
+            return [[] for _ in zone_minutes_list]
+        rows = db.execute(self._zoned_intervals_around_statement(minutes))
+        return self._open_ids_by_zone_minutes(minutes, rows, zone_minutes_list)
+
+    async def aget_open_ids_by_zone_minutes(self, db: AsyncSession, zone_minutes_list) -> list:
+        minutes = sorted({minute for zone_minutes in zone_minutes_list for minute in zone_minutes})
+        if not minutes:
+            return [[] for _ in zone_minutes_list]
+        rows = await db.execute(self._zoned_intervals_around_statement(minutes))
+        return self._open_ids_by_zone_minutes(minutes, rows, zone_minutes_list)
+
+    @staticmethod
+    def _ordered_intervals_statement():
+        return select(
+            ScheduleInterval.restaurant_id,
+            ScheduleInterval.start_minute,
+            ScheduleInterval.end_minute,
+        ).order_by(ScheduleInterval.restaurant_id, ScheduleInterval.start_minute)
+
+    def get_weekly_occupancy(self, db: Session) -> WeeklyOccupancy:
+        """
+        Number of restaurants open at each minute of the week, in their
+        local time.
+        """
+        return WeeklyOccupancy.from_intervals(*self._interval_columns(
+            db.execute(self._ordered_intervals_statement()).all()
+        ))
+
+    async def aget_weekly_occupancy(self, db: AsyncSession) -> WeeklyOccupancy:
+        return WeeklyOccupancy.from_intervals(*self._interval_columns(
+            (await db.execute(self._ordered_intervals_statement())).all()
+        ))
+
+    @staticmethod
+    def _interval_columns(rows):
+        if not rows:
+            return (), (), ()
+        return zip(*rows)
+
+    def _intervals_statement(self, restaurant_ids):
+        statement = select(
+            self.model.id, ScheduleInterval.start_minute, ScheduleInterval.end_minute,
+        ).outerjoin(ScheduleInterval, ScheduleInterval.restaurant_id == self.model.id)
+        if restaurant_ids is not None:
+            statement = statement.where(self.model.id.in_(restaurant_ids))
+        return statement
+
+    @staticmethod
+    def _change_points_by_restaurant(rows) -> dict:
+        intervals = {}
+        for restaurant_id, start_minute, end_minute in rows:
+            restaurant_intervals = intervals.setdefault(restaurant_id, [])
+            if start_minute is not None:
+                restaurant_intervals.append((start_minute, end_minute))
+        return {
+            restaurant_id: change_points(restaurant_intervals)
+            for restaurant_id, restaurant_intervals in intervals.items()
+        }
+
+    def get_change_points(self, db: Session, restaurant_ids=None) -> dict:
+        """
+        Opening and closing minutes of the given restaurants, or of all of
+        them; unknown ids are left out.
+        """
+        return self._change_points_by_restaurant(db.execute(self._intervals_statement(restaurant_ids)))
+
+    async def aget_change_points(self, db: AsyncSession, restaurant_ids=None) -> dict:
+        return self._change_points_by_restaurant(
+            await db.execute(self._intervals_statement(restaurant_ids))
+        )
 
 
 crud_restaurant = CRUDRestaurant(Restaurant)
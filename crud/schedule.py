@@ -1,12 +1,12 @@
 import datetime
 
-from crud.base import CRUDBase
+from crud.base import CRUDBase, IndexedCRUDMixin
 from database_app.models import Schedule
 
 from schemas.schedule import ScheduleCreate, ScheduleUpdate
 
 
-class CRUDSchedule(CRUDBase[Schedule, ScheduleCreate, ScheduleUpdate]):
+class CRUDSchedule(IndexedCRUDMixin, CRUDBase[Schedule, ScheduleCreate, ScheduleUpdate]):
     pass
 
 
@@ -0,0 +1,57 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from core.overrides import ScheduleOverrides, overrides_cache
+from core.response_cache import response_cache
+from crud.base import CRUDBase
+from database_app.models import Restaurant, ScheduleException
+
+from schemas.schedule_exception import ScheduleExceptionCreate, ScheduleExceptionUpdate
+
+
+class CRUDScheduleException(CRUDBase[ScheduleException, ScheduleExceptionCreate, ScheduleExceptionUpdate]):
+
+    def _by_restaurant_statement(self, restaurant_id: int):
+        return select(self.model).where(
+            self.model.restaurant_id == restaurant_id
+        ).order_by(self.model.date, self.model.opening_time)
+
+    def get_by_restaurant(self, db: Session, restaurant_id: int):
+        return db.scalars(self._by_restaurant_statement(restaurant_id)).all()
+
+    async def aget_by_restaurant(self, db: AsyncSession, restaurant_id: int):
+        return (await db.scalars(self._by_restaurant_statement(restaurant_id))).all()
+
+    def _overrides_statement(self):
+        return select(
+            Restaurant.id,
+            Restaurant.restaurant_name,
+            Restaurant.timezone,
+            self.model.date,
+            self.model.opening_time,
+            self.model.closing_time,
+        ).join(Restaurant, Restaurant.id == self.model.restaurant_id)
+
+    def get_overrides(self, db: Session) -> ScheduleOverrides:
+        """
+        Every schedule exception by date, read once after each write and
+        then served from memory.
+        """
+        overrides = overrides_cache.get()
+        if overrides is None:
+            generation = response_cache.generation
+            overrides = ScheduleOverrides.from_rows(db.execute(self._overrides_statement()))
+            overrides_cache.put(overrides, generation)
+        return overrides
+
+    async def aget_overrides(self, db: AsyncSession) -> ScheduleOverrides:
+        overrides = overrides_cache.get()
+        if overrides is None:
+            generation = response_cache.generation
+            overrides = ScheduleOverrides.from_rows(await db.execute(self._overrides_statement()))
+            overrides_cache.put(overrides, generation)
+        return overrides
+
+
+crud_schedule_exception = CRUDScheduleException(ScheduleException)
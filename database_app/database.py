@@ -1,12 +1,84 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from sqlalchemy.ext.declarative import declarative_base
 
 from core.config import settings
+from core.metrics import TimedAsyncAdaptedQueuePool, TimedQueuePool, instrument_engine
 
 Base = declarative_base()
 
-engine = create_engine(settings.DATABASE_URI.unicode_string())
+database_url = make_url(settings.DATABASE_URI)
+
+
+def async_database_url(url):
+    """
+    The same database through the async driver of its dialect.
+    """
+    if url.get_backend_name() == 'sqlite':
+        return url.set(drivername='sqlite+aiosqlite')
+    return url
+
+
+def is_sqlite_memory(url) -> bool:
+    return url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+    )
+
+
+def engine_options(url, poolclass) -> dict:
+    if is_sqlite_memory(url):
+        # One connection per engine keeps the in-memory database alive
+        return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+
+    options = {
+        'poolclass': poolclass,
+        'pool_size': settings.DB_POOL_SIZE,
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'pool_timeout': settings.DB_POOL_TIMEOUT,
+        'pool_pre_ping': settings.DB_POOL_PRE_PING,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+    }
+    if url.get_backend_name() == 'sqlite':
+        options['connect_args'] = {'check_same_thread': False, 'timeout': settings.SQLITE_BUSY_TIMEOUT}
+    elif settings.DB_STATEMENT_TIMEOUT is not None:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={settings.DB_STATEMENT_TIMEOUT}',
+        }
+    return options
+
+
+def configure_sqlite(engine):
+    """
+    Enforce foreign keys, which ON DELETE CASCADE relies on, and read
+    database files through memory mapping.
+    """
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        cursor.execute(f'PRAGMA mmap_size = {int(settings.SQLITE_MMAP_SIZE)}')
+        cursor.close()
+
+
+engine = create_engine(database_url, **engine_options(database_url, TimedQueuePool))
+instrument_engine(engine, 'sync')
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(
+    async_database_url(database_url), **engine_options(database_url, TimedAsyncAdaptedQueuePool)
+)
+instrument_engine(async_engine.sync_engine, 'async')
+
+if database_url.get_backend_name() == 'sqlite':
+    configure_sqlite(engine)
+    configure_sqlite(async_engine.sync_engine)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autocommit=False, autoflush=False, expire_on_commit=False
+)
@@ -1,12 +1,19 @@
 from sqlalchemy import (
     Column,
+    Date,
+    DateTime,
     String,
     Integer,
     ForeignKey,
+    Index,
     Time,
+    event,
+    func,
+    inspect,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, relationship
 
+from core.week import schedule_intervals
 from database_app.database import Base
 
 
@@ -15,8 +22,16 @@ class Restaurant(Base):
     id = Column(Integer, primary_key=True, index=True)
     restaurant_name = Column(String)
     working_hours = Column(String)
+    # IANA time zone name; None is settings.DEFAULT_TIMEZONE
+    timezone = Column(String, nullable=True)
 
-    schedules = relationship("Schedule", cascade="all, delete-orphan")
+    schedules = relationship("Schedule", back_populates="restaurant", cascade="all, delete-orphan")
+    exceptions = relationship(
+        "ScheduleException",
+        back_populates="restaurant",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
 
 class Schedule(Base):
@@ -26,9 +41,16 @@ class Schedule(Base):
     opening_time = Column(Time)
     closing_time = Column(Time)
 
-    restaurant_id = Column(Integer, ForeignKey('restaurants.id', ondelete='CASCADE'))
+    restaurant_id = Column(Integer, ForeignKey('restaurants.id', ondelete='CASCADE'), index=True)
     restaurant = relationship('Restaurant', back_populates='schedules')
 
+    intervals = relationship(
+        "ScheduleInterval",
+        back_populates='schedule',
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
     @staticmethod
     def days_list_to_string(days_list):
         return ','.join(days_list)
@@ -37,4 +59,93 @@ class Schedule(Base):
     def days_string_to_list(days_str):
         return days_str.split(',')
 
+    def refresh_intervals(self):
+        """
+        Rebuild the minute-of-week intervals from days and opening hours.
+        """
+        if not self.days or self.opening_time is None or self.closing_time is None:
+            self.intervals = []
+            return
+        link = {'restaurant': self.restaurant} if self.restaurant is not None else {}
+        self.intervals = [
+            ScheduleInterval(
+                restaurant_id=self.restaurant_id,
+                start_minute=start,
+                end_minute=end,
+                **link,
+            )
+            for start, end in schedule_intervals(
+                self.days_string_to_list(self.days),
+                self.opening_time,
+                self.closing_time,
+            )
+        ]
+
+
+class ScheduleInterval(Base):
+    """
+    One day's slice of a schedule as a half-open [start_minute, end_minute)
+    range of minutes since Monday 00:00.
+    """
+    __tablename__ = "schedule_intervals"
+    __table_args__ = (
+        Index(
+            'ix_schedule_intervals_start_minute_end_minute',
+            'start_minute',
+            'end_minute',
+        ),
+    )
+    id = Column(Integer, primary_key=True)
+    start_minute = Column(Integer, nullable=False)
+    end_minute = Column(Integer, nullable=False)
+
+    schedule_id = Column(Integer, ForeignKey('schedules.id', ondelete='CASCADE'), nullable=False, index=True)
+    schedule = relationship('Schedule', back_populates='intervals')
+    restaurant_id = Column(Integer, ForeignKey('restaurants.id', ondelete='CASCADE'), index=True)
+    restaurant = relationship('Restaurant')
+
+
+class ScheduleException(Base):
+    """
+    Hours of a restaurant on one date of its local calendar, replacing its
+    weekly schedule for that date: a holiday closure when the times are
+    None, special hours otherwise. Several rows on a date are several
+    opening periods.
+    """
+    __tablename__ = "schedule_exceptions"
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False, index=True)
+    opening_time = Column(Time, nullable=True)
+    closing_time = Column(Time, nullable=True)
+
+    restaurant_id = Column(
+        Integer, ForeignKey('restaurants.id', ondelete='CASCADE'), nullable=False, index=True,
+    )
+    restaurant = relationship('Restaurant', back_populates='exceptions')
+
+
+class DataImport(Base):
+    """
+    Content hash of the last file loaded from each data source.
+    """
+    __tablename__ = "data_imports"
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False, unique=True)
+    content_hash = Column(String, nullable=False)
+    loaded_at = Column(DateTime, nullable=False, server_default=func.now())
+
 
+@event.listens_for(Session, 'before_flush')
+def split_schedules_into_intervals(session, flush_context, instances):
+    """
+    Keep schedule intervals in step with the schedule they are derived from.
+    """
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Schedule):
+            continue
+        state = inspect(obj)
+        if state.pending or any(
+            state.attrs[name].history.has_changes()
+            for name in ('days', 'opening_time', 'closing_time', 'restaurant_id')
+        ):
+            obj.refresh_intervals()
@@ -1,21 +1,131 @@
-from contextlib import asynccontextmanager
+import asyncio
+import time
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timezone
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.exc import SQLAlchemyError
 
 from api.api_v1.api import api_router
+from api.metrics import router as metrics_router
 from core.config import settings
-from core.utils import populate_database_with_restaurants
-from database_app.database import SessionLocal
+from core.events import transition_feed
+from core.metrics import TimingMiddleware
+from core.response_cache import response_cache
+from core.schedule_index import invalidate_opening_hours, opening_hours_index
+from core.snapshot import SnapshotStore
+from core.utils import import_stamp, populate_database_with_restaurants
+from crud.schedule_exception import crud_schedule_exception
+from database_app.base import Base
+from database_app.database import SessionLocal, engine, is_sqlite_memory
+
+
+async def watch_snapshot(interval):
+    while True:
+        await asyncio.sleep(interval)
+        if opening_hours_index.refresh_snapshot():
+            response_cache.clear()
+
+
+def read_import_stamp():
+    db = SessionLocal()
+    try:
+        return import_stamp(db)
+    finally:
+        db.close()
+
+
+def refresh_imported_data():
+    invalidate_opening_hours()
+    opening_hours_index.rebuild_if_stale(SessionLocal)
+
+
+async def watch_imports(interval):
+    """
+    Rebuild the index and drop cached responses once data the index was
+    not built from is loaded, by this process or another one.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stamp = await asyncio.to_thread(read_import_stamp)
+        except SQLAlchemyError:
+            continue
+        if stamp != opening_hours_index.stamp:
+            await asyncio.to_thread(refresh_imported_data)
+
+
+def current_minute() -> datetime:
+    return datetime.now(timezone.utc).replace(second=0, microsecond=0)
+
+
+def sweep_transitions(previous: datetime, at: datetime):
+    db = SessionLocal()
+    try:
+        overrides = crud_schedule_exception.get_overrides(db)
+        return transition_feed.sweep(db, previous, at, overrides, settings.DEFAULT_TIMEZONE)
+    finally:
+        db.close()
+
+
+async def publish_transitions():
+    """
+    Sweep the transition wheel at the start of every minute while anyone
+    is subscribed to the events.
+    """
+    previous = current_minute()
+    while True:
+        await asyncio.sleep(60 - time.time() % 60)
+        at = current_minute()
+        if at <= previous:
+            continue
+        if transition_feed.subscribers:
+            try:
+                events = await asyncio.to_thread(sweep_transitions, previous, at)
+            except SQLAlchemyError:
+                # The next sweep catches up from the same minute
+                continue
+            for event, data in events:
+                transition_feed.publish(event, data)
+            if not events:
+                transition_feed.heartbeat()
+        previous = at
 
 
 @asynccontextmanager
 async def lifespan(application: FastAPI):
+    if is_sqlite_memory(engine.url):
+        # Nothing to migrate, the database lives as long as the process
+        Base.metadata.create_all(bind=engine)
+    store = None
+    if settings.SNAPSHOT_PATH:
+        store = SnapshotStore(settings.SNAPSHOT_PATH)
+        opening_hours_index.use_snapshot(store)
     db = SessionLocal()
+    watcher = None
+    importer = None
+    publisher = None
     try:
-        populate_database_with_restaurants(db=db)
+        # Workers starting together wait for the first one to load and
+        # publish, then map its snapshot
+        with store.lock() if store else nullcontext():
+            report = populate_database_with_restaurants(db=db)
+            # A snapshot built from other data, loaded by `--diff` or into
+            # another database meanwhile, is built again
+            if store and report is None and store.matches(import_stamp(db)):
+                opening_hours_index.map_snapshot()
+            else:
+                opening_hours_index.build(db=db)
+        if store:
+            watcher = asyncio.create_task(watch_snapshot(settings.SNAPSHOT_POLL_INTERVAL))
+        importer = asyncio.create_task(watch_imports(settings.DATA_POLL_INTERVAL))
+        publisher = asyncio.create_task(publish_transitions())
         yield
     finally:
+        for task in (watcher, importer, publisher):
+            if task is not None:
+                task.cancel()
         db.close()
 
 app = FastAPI(lifespan=lifespan)
@@ -30,4 +140,8 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+# Added last so it wraps the whole stack and times every request
+app.add_middleware(TimingMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+app.include_router(metrics_router)
@@ -1,9 +1,35 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+from core.week import zone_info
+
+# Upper bound on timestamps per batch request
+MAX_BATCH_TIMESTAMPS = 50_000
+# Upper bound on restaurants per next-change batch request
+MAX_BATCH_RESTAURANTS = 50_000
+# Upper bound on restaurants per page of open restaurants
+MAX_PAGE_LIMIT = 10_000
+# Upper bound on the length of a restaurant name search
+MAX_NAME_QUERY_LENGTH = 100
 
 
 class RestaurantBase(BaseModel):
     restaurant_name: str
     working_hours: str
+    # IANA time zone name, e.g. "America/New_York"
+    timezone: Optional[str] = None
+
+    @field_validator("timezone")
+    @classmethod
+    def known_timezone(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None:
+            try:
+                zone_info(v)
+            except (KeyError, ValueError):
+                raise ValueError(f"unknown time zone {v!r}")
+        return v
 
 
 class RestaurantCreate(RestaurantBase):
@@ -24,3 +50,12 @@ class RestaurantNameRead(BaseModel):
     class Config:
         from_attributes = True
 
+
+class OpenBatchRequest(BaseModel):
+    timestamps: List[datetime] = Field(max_length=MAX_BATCH_TIMESTAMPS)
+
+
+class NextChangeBatchRequest(BaseModel):
+    # None asks for every restaurant
+    restaurant_ids: Optional[List[int]] = Field(None, max_length=MAX_BATCH_RESTAURANTS)
+    at: Optional[datetime] = None
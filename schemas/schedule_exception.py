@@ -0,0 +1,33 @@
+from datetime import date, time
+from typing import Optional
+
+from pydantic import BaseModel, model_validator
+
+
+class ScheduleExceptionBase(BaseModel):
+    date: date
+    # Both None closes the restaurant for the day
+    opening_time: Optional[time] = None
+    closing_time: Optional[time] = None
+
+    @model_validator(mode="after")
+    def both_times_or_neither(self):
+        if (self.opening_time is None) != (self.closing_time is None):
+            raise ValueError("opening_time and closing_time must be given together")
+        return self
+
+
+class ScheduleExceptionCreate(ScheduleExceptionBase):
+    restaurant_id: int
+
+
+class ScheduleExceptionUpdate(ScheduleExceptionBase):
+    pass
+
+
+class ScheduleExceptionRead(ScheduleExceptionBase):
+    id: int
+    restaurant_id: int
+
+    class Config:
+        from_attributes = True
@@ -1,10 +1,74 @@
+import asyncio
+import csv
+import json
+import re
+import tempfile
 import unittest
-from datetime import time
+
+import pytest
+from dateutil.parser import parse as dateutil_parse
+from pydantic import ValidationError
+from datetime import date, datetime, time, timedelta, timezone
 
 from fastapi.testclient import TestClient
 
-from core.utils import parse_days, parse_time, parse_times, parse_opening_hours
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from core.ingest import ingest_csv, iter_csv_chunks, load_exceptions_csv, parse_chunk, reload_csv
+from api.api_v1.endpoints.restaurant import _render, _render_restaurant_names
+from core.config import Settings, settings
+from core.events import TransitionFeed, TransitionWheel
+from core.metrics import Histogram, server_timing
+from core.name_index import NameIndex, trigrams
+from core.parse_cache import HEADER, MAGIC, ParseCache
+from core.overrides import ScheduleOverrides, apply_changes
+from core.occupancy import WeeklyOccupancy, bucket_counts, merge_runs
+from core.response_cache import MinuteResponseCache, etag_matches, response_cache
+from core.schedule_index import OpeningHoursIndex, RestaurantEntry, page_after
+from core.single_flight import SingleFlight
+from core.snapshot import SnapshotStore, snapshot_generation
+from core.utils import (
+    acquire_loader_lock,
+    bulk_insert_restaurants,
+    file_content_hash,
+    import_stamp,
+    parse_datetime,
+    parse_days,
+    parse_opening_hours,
+    parse_time,
+    parse_time_dateutil,
+    parse_times,
+    parse_weekday_time,
+    populate_database_with_restaurants,
+    read_csv_data,
+)
+from core.week import (
+    MINUTES_PER_DAY,
+    MINUTES_PER_WEEK,
+    WEEKDAYS,
+    change_points,
+    intervals_cover,
+    local_dates,
+    minute_of_week,
+    minutes_by_zone,
+    next_change,
+    schedule_intervals,
+    window_pieces,
+    windows_by_zone,
+    zone_info,
+)
+from crud.restaurant import crud_restaurant
+from crud.schedule import crud_schedule
+from crud.schedule_exception import crud_schedule_exception
+from database_app.base import Base
+from database_app.database import AsyncSessionLocal, configure_sqlite
+from database_app.models import DataImport, Restaurant, Schedule, ScheduleException, ScheduleInterval
 from main import app
+from schemas.restaurant import RestaurantCreate, RestaurantNameRead
+from schemas.schedule import ScheduleCreate
+from schemas.schedule_exception import ScheduleExceptionCreate
 
 from .fixtures import test_db
 
@@ -215,3 +279,1684 @@ class TestUtils(unittest.TestCase):
             'closing_time': time(2, 0),
         }]
         self.assertEqual(parse_opening_hours(input_str), expected_output)
+
+
+def test_get_open_restaurants_batch(test_db):
+    timestamps = ["2023-10-30T12:00:00", "2023-10-30T05:00:00", "2023-11-06T12:00:00"]
+    response = client.post("api/v1/restaurants/open:batch", json={'timestamps': timestamps})
+    assert response.status_code == 200
+    data = response.json()['data']
+
+    assert [item['timestamp'] for item in data] == timestamps
+    for item, timestamp in zip(data, timestamps):
+        expected = crud_restaurant.get_by_opening_hours(test_db, datetime.fromisoformat(timestamp))
+        assert item['restaurant_ids'] == sorted({restaurant.id for restaurant in expected})
+    assert data[0]['restaurant_ids'] == data[2]['restaurant_ids']
+
+
+def test_get_open_restaurants_batch_many_timestamps(test_db):
+    start = datetime(2023, 10, 30)
+    timestamps = [(start + timedelta(minutes=7 * i)).isoformat() for i in range(10_000)]
+    response = client.post("api/v1/restaurants/open:batch", json={'timestamps': timestamps})
+    assert response.status_code == 200
+    assert len(response.json()['data']) == 10_000
+
+
+def test_get_open_restaurants_batch_invalid_timestamp():
+    response = client.post("api/v1/restaurants/open:batch", json={'timestamps': ["not a date"]})
+    assert response.status_code == 422
+
+
+@pytest.fixture
+def night_owl(test_db):
+    restaurant = Restaurant(restaurant_name="Night Owl", working_hours="Tue, Sun 10 pm - 3 am")
+    restaurant.schedules.append(Schedule(
+        days="Tuesday,Sunday", opening_time=time(22, 0), closing_time=time(3, 0)
+    ))
+    test_db.add(restaurant)
+    test_db.commit()
+    yield restaurant
+    test_db.delete(restaurant)
+    test_db.commit()
+
+
+def window_names(restaurants):
+    return [restaurant.restaurant_name for restaurant in restaurants]
+
+
+def test_open_during_across_midnight(test_db, night_owl):
+    tuesday_night = datetime(2023, 10, 31, 23, 0)
+    assert "Night Owl" in window_names(
+        crud_restaurant.open_during(test_db, tuesday_night, tuesday_night + timedelta(hours=4))
+    )
+    assert "Night Owl" not in window_names(
+        crud_restaurant.open_during(test_db, tuesday_night, tuesday_night + timedelta(hours=4, minutes=1))
+    )
+
+
+def test_open_during_across_sunday_to_monday(test_db, night_owl):
+    sunday_night = datetime(2023, 11, 5, 22, 0)
+    assert "Night Owl" in window_names(
+        crud_restaurant.open_during(test_db, sunday_night, datetime(2023, 11, 6, 3, 0))
+    )
+    assert "Night Owl" not in window_names(
+        crud_restaurant.open_during(test_db, sunday_night - timedelta(minutes=1), datetime(2023, 11, 6, 1, 0))
+    )
+
+
+def test_open_any_across_sunday_to_monday(test_db, night_owl):
+    assert "Night Owl" in window_names(
+        crud_restaurant.open_any(test_db, datetime(2023, 11, 5, 20, 0), datetime(2023, 11, 6, 0, 0))
+    )
+    assert "Night Owl" in window_names(
+        crud_restaurant.open_any(test_db, datetime(2023, 11, 6, 2, 59), datetime(2023, 11, 6, 6, 0))
+    )
+    assert "Night Owl" not in window_names(
+        crud_restaurant.open_any(test_db, datetime(2023, 11, 6, 3, 1), datetime(2023, 11, 6, 21, 59))
+    )
+
+
+def test_get_open_during_endpoint(test_db, night_owl):
+    response = client.get(
+        "api/v1/restaurants/open-during",
+        params={'start': "2023-11-05T22:30:00", 'end': "2023-11-06T01:00:00"},
+    )
+    assert response.status_code == 200
+    assert "Night Owl" in [restaurant['restaurant_name'] for restaurant in response.json()['data']]
+
+
+def test_get_open_any_endpoint_reversed_window():
+    response = client.get(
+        "api/v1/restaurants/open-any",
+        params={'start': "2023-11-06T01:00:00", 'end': "2023-11-05T22:30:00"},
+    )
+    assert response.status_code == 400
+
+
+def test_opening_hours_index_batch_matches_sql(test_db):
+    index = OpeningHoursIndex()
+    index.build(test_db)
+    minutes = list(range(0, 7 * 24 * 60, 45)) + [0, 700, 700]
+    assert index.open_ids_by_minutes(minutes) == crud_restaurant.get_open_ids_by_minutes(test_db, minutes)
+
+
+def test_opening_hours_index_matches_sql(test_db):
+    index = OpeningHoursIndex()
+    index.build(test_db)
+    assert index.is_ready
+
+    moment = datetime(2023, 10, 30)
+    while moment < datetime(2023, 11, 6):
+        from_sql = {restaurant.id for restaurant in crud_restaurant.get_by_opening_hours(test_db, moment)}
+        from_index = {entry.id for entry in index.lookup(moment)}
+        assert from_index == from_sql, moment
+        moment += timedelta(minutes=30)
+
+
+def test_get_restaurants_open_after_midnight_on_the_next_day(test_db):
+    schedule = Schedule(
+        restaurant_id=test_db.query(Restaurant.id).filter(
+            Restaurant.restaurant_name == "Test Restaurant"
+        ).scalar(),
+        days="Sunday",
+        opening_time=time(22, 0),
+        closing_time=time(3, 0),
+    )
+    test_db.add(schedule)
+    test_db.commit()
+    try:
+        # Sunday night runs into Monday morning, not into Sunday morning
+        monday = crud_restaurant.get_by_opening_hours(test_db, datetime(2023, 10, 30, 2, 30))
+        sunday = crud_restaurant.get_by_opening_hours(test_db, datetime(2023, 10, 29, 2, 30))
+        assert "Test Restaurant" in [restaurant.restaurant_name for restaurant in monday]
+        assert "Test Restaurant" not in [restaurant.restaurant_name for restaurant in sunday]
+    finally:
+        test_db.delete(schedule)
+        test_db.commit()
+
+
+def test_get_by_opening_hours_uses_interval_index(test_db):
+    statement = crud_restaurant.open_at_statement(2 * 24 * 60 + 12 * 60).compile(
+        dialect=test_db.bind.dialect, compile_kwargs={'literal_binds': True}
+    )
+    if test_db.bind.dialect.name == 'sqlite':
+        plan = '\n'.join(row[-1] for row in test_db.execute(text(f'EXPLAIN QUERY PLAN {statement}')))
+        print(plan)
+        assert 'ix_schedule_intervals_start_minute_end_minute' in plan
+        return
+
+    # Planner would rather seq scan the handful of fixture rows
+    test_db.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = '\n'.join(row[0] for row in test_db.execute(text(f'EXPLAIN {statement}')))
+    test_db.rollback()
+
+    print(plan)
+    assert 'ix_schedule_intervals_start_minute_end_minute' in plan
+    assert 'Seq Scan on schedule_intervals' not in plan
+
+
+def test_populate_database_skips_unchanged_csv(test_db, tmp_path):
+    csv_file = tmp_path / 'restaurants.csv'
+    csv_file.write_text('"Restaurant Name","Hours"\n"Skipped","Mon-Sun 9 am - 5 pm"\n')
+    data_import = DataImport(source=str(csv_file), content_hash=file_content_hash(csv_file))
+    test_db.add(data_import)
+    test_db.commit()
+    count = test_db.query(Restaurant).count()
+    try:
+        assert populate_database_with_restaurants(test_db, str(csv_file)) is None
+        assert test_db.query(Restaurant).count() == count
+    finally:
+        test_db.delete(data_import)
+        test_db.commit()
+
+
+def test_changed_csv_keeps_schedule_exceptions_across_restarts(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'restart.db'}")
+    configure_sqlite(engine)
+    Base.metadata.create_all(engine)
+    csv_file = tmp_path / 'restaurants.csv'
+    csv_file.write_text(
+        '"Restaurant Name","Hours"\n"Holiday Closer","Mon-Sun 9 am - 5 pm"\n"Other","Mon-Fri 9 am - 5 pm"\n'
+    )
+    db = Session(engine)
+    try:
+        populate_database_with_restaurants(db, str(csv_file))
+        restaurant_id = db.query(Restaurant.id).filter(Restaurant.restaurant_name == "Holiday Closer").scalar()
+        db.add(ScheduleException(restaurant_id=restaurant_id, date=date(2024, 12, 25)))
+        db.commit()
+
+        # Edited while the server was down, and loaded at the next start
+        csv_file.write_text(
+            '"Restaurant Name","Hours"\n"Holiday Closer","Mon-Sun 9 am - 5 pm"\n"Other","Mon-Sat 9 am - 5 pm"\n'
+        )
+        report = populate_database_with_restaurants(db, str(csv_file))
+        assert (report.updated, report.unchanged) == (1, 1)
+        assert db.query(ScheduleException.restaurant_id).all() == [(restaurant_id,)]
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def test_bulk_insert_restaurants(test_db):
+    hours = "Mon-Fri 9 am - 5 pm / Sat 10 pm - 2 am"
+    try:
+        bulk_insert_restaurants(test_db, [
+            {'name': "Bulk One", 'hours': hours, 'schedules': parse_opening_hours(hours)},
+            {'name': "Bulk Two", 'hours': "", 'schedules': []},
+        ])
+        restaurant = test_db.query(Restaurant).filter(Restaurant.restaurant_name == "Bulk One").one()
+        assert restaurant.working_hours == hours
+        assert len(restaurant.schedules) == 2
+        assert test_db.query(ScheduleInterval).filter(
+            ScheduleInterval.restaurant_id == restaurant.id
+        ).count() == 7
+        assert test_db.query(Restaurant).filter(Restaurant.restaurant_name == "Bulk Two").count() == 1
+    finally:
+        test_db.rollback()
+
+
+def test_reload_csv_applies_only_the_changes(test_db, tmp_path):
+    gone = Restaurant(restaurant_name="Reload Gone", working_hours="Mon 9 am - 5 pm")
+    changed = Restaurant(restaurant_name="Reload Changed", working_hours="Mon 9 am - 5 pm")
+    changed.schedules.append(Schedule(days="Monday", opening_time=time(9, 0), closing_time=time(17, 0)))
+    test_db.add_all([gone, changed])
+    test_db.commit()
+    changed_id = changed.id
+    csv_file = tmp_path / 'restaurants.csv'
+    rows = [
+        [name, hours or '', timezone or '']
+        for name, hours, timezone in test_db.query(
+            Restaurant.restaurant_name, Restaurant.working_hours, Restaurant.timezone
+        ).order_by(Restaurant.id)
+        if name not in ("Reload Gone", "Reload Changed")
+    ]
+    with open(csv_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Restaurant Name', 'Hours', 'Timezone'])
+        writer.writerows(rows)
+        writer.writerow(['Reload Changed', 'Tue 10 am - 2 pm', 'Europe/Berlin'])
+        writer.writerow(['Reload New', 'Wed 10 am - 2 pm', ''])
+    try:
+        report = reload_csv(test_db, str(csv_file))
+        assert (report.inserted, report.updated, report.deleted) == (1, 1, 1)
+        assert report.unchanged == len(rows)
+        test_db.expire_all()
+        changed = test_db.get(Restaurant, changed_id)
+        assert (changed.working_hours, changed.timezone) == ('Tue 10 am - 2 pm', 'Europe/Berlin')
+        assert [schedule.days for schedule in changed.schedules] == ['Tuesday']
+        assert test_db.query(ScheduleInterval).filter(
+            ScheduleInterval.restaurant_id == changed_id
+        ).one().start_minute == MINUTES_PER_DAY + 600
+        assert test_db.query(Restaurant).filter(Restaurant.restaurant_name == "Reload Gone").count() == 0
+
+        report = reload_csv(test_db, str(csv_file))
+        assert (report.inserted, report.updated, report.deleted) == (0, 0, 0)
+    finally:
+        test_db.query(Restaurant).filter(
+            Restaurant.restaurant_name.in_(["Reload Gone", "Reload Changed", "Reload New"])
+        ).delete(synchronize_session=False)
+        test_db.query(DataImport).filter(DataImport.source == str(csv_file)).delete()
+        test_db.commit()
+        response_cache.clear()
+
+
+def test_reload_requires_the_admin_token():
+    assert client.post("api/v1/restaurants/reload").status_code == 403
+    response = client.post("api/v1/restaurants/reload", headers={'X-Admin-Token': 'wrong'})
+    assert response.status_code == 403
+
+
+class TestFastParser(unittest.TestCase):
+    def reference_parse_opening_hours(self, hours_str):
+        # Parser as it was before the fast path: dateutil for every time
+        schedules = []
+        for part in [part.strip() for part in hours_str.split('/')]:
+            match = re.match(
+                r'(.+?)\s+(\d{1,2}(:\d{2})?\s*(am|pm)?\s*-\s*\d{1,2}(:\d{2})?\s*(am|pm)?)',
+                part,
+                re.IGNORECASE
+            )
+            if not match:
+                continue
+            opening_str, closing_str = [t.strip() for t in match.group(2).split('-')]
+            schedules.append({
+                'days': parse_days(match.group(1)),
+                'opening_time': parse_time_dateutil(opening_str),
+                'closing_time': parse_time_dateutil(closing_str),
+            })
+        return schedules
+
+    def test_parse_time_matches_dateutil(self):
+        for hour in ['0', '00', '1', '09', '11', '12', '13', '23', '24', '99']:
+            for minutes in ['', ':00', ':05', ':59', ':60']:
+                for meridiem in ['', 'am', ' am', '  am', 'pm', ' PM', '\tpm']:
+                    time_str = hour + minutes + meridiem
+                    try:
+                        expected = parse_time_dateutil(time_str)
+                    except ValueError:
+                        with self.assertRaises(ValueError, msg=time_str):
+                            parse_time(time_str)
+                    else:
+                        self.assertEqual(parse_time(time_str), expected, time_str)
+
+    def test_parse_opening_hours_matches_dateutil_for_csv(self):
+        for restaurant in read_csv_data('restaurants.csv'):
+            self.assertEqual(
+                parse_opening_hours(restaurant['hours']),
+                self.reference_parse_opening_hours(restaurant['hours']),
+                restaurant['hours'],
+            )
+
+    def test_parse_opening_hours_matches_dateutil_for_other_formats(self):
+        for hours in [
+            "Tues-Fri, Sun 11:30 am - 10 pm  / Sat 5:30 pm - 11 pm",
+            "Sat-Tue 9 - 17:30",
+            "Mon 12 am - 12 pm / Thurs 23:00 - 2 AM",
+            "Sun 5 pm - 1:30 am",
+            "closed",
+        ]:
+            self.assertEqual(
+                parse_opening_hours(hours), self.reference_parse_opening_hours(hours), hours
+            )
+
+    def test_parse_opening_hours_cached_results_are_not_shared(self):
+        first = parse_opening_hours("Mon-Tue 9 am - 5 pm")
+        first[0]['days'].append('Sunday')
+        self.assertEqual(parse_opening_hours("Mon-Tue 9 am - 5 pm")[0]['days'], ['Monday', 'Tuesday'])
+
+
+class TestParseDatetime(unittest.TestCase):
+    def assertParsesLikeDateutil(self, datetime_str):
+        try:
+            expected = dateutil_parse(datetime_str)
+        except (ValueError, OverflowError):
+            with self.assertRaises((ValueError, OverflowError), msg=datetime_str):
+                parse_datetime(datetime_str)
+        else:
+            parsed = parse_datetime(datetime_str)
+            self.assertEqual(parsed, expected, datetime_str)
+            self.assertEqual(parsed.utcoffset(), expected.utcoffset(), datetime_str)
+
+    def test_parse_datetime_matches_dateutil_for_iso_8601(self):
+        for date_str in ['2024-01-01', '2023-11-01', '2024-02-29', '2023-02-29', '2024-13-01', '0000-01-01']:
+            self.assertParsesLikeDateutil(date_str)
+            for separator in ['T', ' ']:
+                for time_str in ['12:00', '00:00', '23:59', '24:00', '12:60', '12:30:15', '12:30:60',
+                                 '12:30:15.5', '12:30:15.123456', '12:30:15.1234567', '12']:
+                    for offset in ['', 'Z', '+00:00', '+05:30', '-08:00', '+0530', '-05', '+23:59']:
+                        self.assertParsesLikeDateutil(date_str + separator + time_str + offset)
+
+    def test_parse_datetime_matches_dateutil_for_other_formats(self):
+        for datetime_str in ['20240101', '20240101T1230', '202401011230', '2024/01/01 12:00', 'Jan 1 2024 12:00',
+                             '1 January 2024, 2 pm', '2024-01-01t12:00', 'Monday', 'not a date', '']:
+            self.assertParsesLikeDateutil(datetime_str)
+
+    def test_parse_datetime_reads_unix_times_dateutil_rejects(self):
+        for datetime_str in ['1704110400', '1704110400.25', '999999999', '99999999999']:
+            with self.assertRaises((ValueError, OverflowError)):
+                dateutil_parse(datetime_str)
+        self.assertEqual(parse_datetime('1704110400'), datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc))
+        self.assertEqual(
+            parse_datetime('1704110400.25'), datetime(2024, 1, 1, 12, 0, 0, 250000, tzinfo=timezone.utc)
+        )
+
+    def test_parse_weekday_time(self):
+        self.assertEqual(parse_weekday_time('Mon', '14:30'), datetime(2024, 1, 1, 14, 30))
+        self.assertEqual(parse_weekday_time('sunday', '2:30 pm'), datetime(2024, 1, 7, 14, 30))
+        for weekday, time_str in [('Mo', '14:30'), ('Mon', '25:00'), ('Mon', '14'), ('Mon', 'noon')]:
+            with self.assertRaises(ValueError, msg=(weekday, time_str)):
+                parse_weekday_time(weekday, time_str)
+
+
+def test_get_restaurants_at_weekday_and_time(test_db):
+    # 2023-11-01 is a Wednesday
+    expected = client.get("api/v1/restaurants/2023-11-01T12:00:00")
+    response = client.get("api/v1/restaurants/open", params={'weekday': "Wed", 'time': "12:00"})
+    assert response.status_code == 200
+    assert response.content == expected.content
+    assert response.headers['ETag'] == expected.headers['ETag']
+
+    page = client.get("api/v1/restaurants/open", params={'weekday': "Wednesday", 'time': "12 pm", 'limit': 1})
+    assert page.json()['data'][0]['restaurant_name'] == expected.json()['data'][0]['restaurant_name']
+    assert client.get("api/v1/restaurants/open", params={'weekday': "Wed", 'time': "25:00"}).status_code == 400
+    assert client.get("api/v1/restaurants/open", params={'weekday': "Wed"}).status_code == 422
+
+
+def test_get_restaurants_at_unix_time(test_db):
+    expected = client.get("api/v1/restaurants/2023-11-01T12:00:00Z")
+    response = client.get(f"api/v1/restaurants/{int(datetime(2023, 11, 1, 12, tzinfo=timezone.utc).timestamp())}")
+    assert response.status_code == 200
+    assert response.content == expected.content
+
+
+def test_iter_csv_chunks(tmp_path):
+    csv_file = tmp_path / 'restaurants.csv'
+    csv_file.write_text(
+        '"Restaurant Name","Hours"\n'
+        + ''.join(f'"Restaurant {i}","Mon-Sun 9 am - 5 pm"\n' for i in range(5))
+    )
+    chunks = list(iter_csv_chunks(csv_file, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0][0] == (2, ['Restaurant 0', 'Mon-Sun 9 am - 5 pm'])
+
+
+class TestParseChunk(unittest.TestCase):
+    def test_valid_rows(self):
+        restaurants, errors = parse_chunk([(2, ['Diner', 'Mon-Fri 9 am - 5 pm'])])
+        self.assertEqual(errors, [])
+        self.assertEqual(restaurants, [{
+            'name': 'Diner',
+            'hours': 'Mon-Fri 9 am - 5 pm',
+            'timezone': None,
+            'schedules': parse_opening_hours('Mon-Fri 9 am - 5 pm'),
+        }])
+
+    def test_timezone_column(self):
+        restaurants, errors = parse_chunk([
+            (2, ['Diner', 'Mon-Fri 9 am - 5 pm', 'America/New_York']),
+            (3, ['Cafe', 'Mon-Fri 9 am - 5 pm', 'Mars/Olympus_Mons']),
+        ])
+        self.assertEqual([restaurant['timezone'] for restaurant in restaurants], ['America/New_York'])
+        self.assertEqual([(error.line, error.name) for error in errors], [(3, 'Cafe')])
+
+    def test_unrecognised_segment_is_reported(self):
+        restaurants, errors = parse_chunk([(3, ['Diner', 'Mon-Fri 9 am - 5 pm / by appointment'])])
+        self.assertEqual(len(restaurants[0]['schedules']), 1)
+        self.assertEqual([(error.line, error.name) for error in errors], [(3, 'Diner')])
+        self.assertIn("'by appointment'", errors[0].message)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        restaurants, errors = parse_chunk([
+            (4, ['Diner', 'Mon 9 am - 25:00 pm']),
+            (5, ['Only a name']),
+        ])
+        self.assertEqual(restaurants, [])
+        self.assertEqual([error.line for error in errors], [4, 5])
+
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = ParseCache(f'{directory.name}/restaurants.parsed')
+        self.chunks = [
+            (2, parse_chunk([
+                (2, ['Diner', 'Mon-Fri 9 am - 5 pm', 'America/New_York']),
+                (3, ['Cafe', 'Mon-Fri 9 am - 5 pm']),
+            ])),
+            (1, parse_chunk([(4, ['Bar', 'Mon 9 am - 25:00 pm'])])),
+        ]
+
+    def test_round_trip(self):
+        self.assertIsNone(self.cache.read('a' * 64))
+        with self.cache.writer('a' * 64) as save:
+            for row_count, parsed in self.chunks:
+                save(row_count, parsed)
+        self.assertEqual(list(self.cache.read('a' * 64)), self.chunks)
+        self.assertIsNone(self.cache.read('b' * 64))
+
+    def test_other_parser_version_is_not_read(self):
+        with open(self.cache.path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, 0, b'a' * 64))
+        self.assertIsNone(self.cache.read('a' * 64))
+
+    def test_failed_write_keeps_the_cache(self):
+        with self.cache.writer('a' * 64) as save:
+            save(*self.chunks[0])
+        with self.assertRaises(RuntimeError):
+            with self.cache.writer('b' * 64) as save:
+                save(*self.chunks[1])
+                raise RuntimeError
+        self.assertEqual(list(self.cache.read('a' * 64)), self.chunks[:1])
+
+
+def test_ingest_csv_loads_parsed_rows_from_the_cache(test_db, tmp_path):
+    csv_file = tmp_path / 'restaurants.csv'
+    csv_file.write_text(
+        '"Restaurant Name","Hours"\n"Cached Diner","Mon-Fri 9 am - 5 pm"\n"Cached Bar","Mon 9 am - 25:00 pm"\n'
+    )
+    cache_path = tmp_path / 'restaurants.parsed'
+    try:
+        cold = ingest_csv(test_db, csv_file, workers=0, cache_path=cache_path)
+        warm = ingest_csv(test_db, csv_file, workers=0, cache_path=cache_path)
+        assert (cold.from_cache, warm.from_cache) == (False, True)
+        assert (warm.rows, warm.errors) == (cold.rows, cold.errors)
+        diners = test_db.query(Restaurant).filter(Restaurant.restaurant_name == "Cached Diner").all()
+        assert [
+            [(schedule.days, schedule.opening_time) for schedule in diner.schedules] for diner in diners
+        ] == [[('Monday,Tuesday,Wednesday,Thursday,Friday', time(9, 0))]] * 2
+
+        csv_file.write_text('"Restaurant Name","Hours"\n"Cached Cafe","Sun 9 am - 5 pm"\n')
+        assert not ingest_csv(test_db, csv_file, workers=0, cache_path=cache_path).from_cache
+    finally:
+        test_db.rollback()
+
+
+class TestScheduleIntervals(unittest.TestCase):
+    def test_regular_hours(self):
+        self.assertEqual(
+            schedule_intervals(['Tuesday'], time(9, 0), time(17, 0)),
+            [(1440 + 540, 1440 + 1021)],
+        )
+
+    def test_overnight_hours_are_split_at_midnight(self):
+        self.assertEqual(
+            schedule_intervals(['Friday'], time(22, 0), time(2, 0)),
+            [(4 * 1440 + 1320, 5 * 1440), (5 * 1440, 5 * 1440 + 121)],
+        )
+
+    def test_sunday_overnight_hours_spill_into_monday(self):
+        self.assertEqual(
+            schedule_intervals(['Sunday'], time(23, 0), time(0, 0)),
+            [(6 * 1440 + 1380, 7 * 1440), (0, 1)],
+        )
+
+
+class TestWindows(unittest.TestCase):
+    def test_window_pieces_within_the_week(self):
+        self.assertEqual(
+            window_pieces(datetime(2023, 10, 30, 23, 0), datetime(2023, 10, 31, 1, 0)),
+            [(1380, 1500)],
+        )
+
+    def test_window_pieces_across_the_end_of_the_week(self):
+        self.assertEqual(
+            window_pieces(datetime(2023, 11, 5, 23, 0), datetime(2023, 11, 6, 1, 0)),
+            [(10020, 10079), (0, 60)],
+        )
+
+    def test_window_pieces_longer_than_a_week(self):
+        self.assertEqual(
+            window_pieces(datetime(2023, 11, 1), datetime(2023, 11, 9)),
+            [(0, 10079)],
+        )
+
+    def test_intervals_cover(self):
+        intervals = [(1440, 2880), (1320, 1440)]
+        self.assertTrue(intervals_cover(intervals, 1320, 2879))
+        self.assertFalse(intervals_cover(intervals, 1319, 1400))
+        self.assertFalse(intervals_cover(intervals, 2000, 2880))
+
+
+class TestMinutesByZone(unittest.TestCase):
+    def test_naive_datetime_is_local_everywhere(self):
+        self.assertEqual(
+            minutes_by_zone(datetime(2024, 1, 1, 10, 30), ["Asia/Tokyo", None], "UTC"), {630: None}
+        )
+
+    def test_zones_at_one_offset_share_a_minute(self):
+        at = datetime(2024, 1, 1, 10, 30, tzinfo=timezone.utc)
+        self.assertEqual(minutes_by_zone(at, [None, "Europe/London"], "UTC"), {630: None})
+        self.assertEqual(
+            minutes_by_zone(at, ["Europe/Paris", None, "Europe/Berlin"], "UTC"),
+            {630: (None,), 690: ("Europe/Berlin", "Europe/Paris")},
+        )
+
+    def test_daylight_saving_time(self):
+        # New York is UTC-5 before 2024-03-10 07:00 UTC and UTC-4 after
+        before = datetime(2024, 3, 10, 6, 59, tzinfo=timezone.utc)
+        after = datetime(2024, 3, 10, 7, 0, tzinfo=timezone.utc)
+        sunday = 6 * MINUTES_PER_DAY
+        self.assertEqual(
+            minutes_by_zone(before, ["America/New_York", None], "UTC"),
+            {sunday + 419: (None,), sunday + 119: ("America/New_York",)},
+        )
+        self.assertEqual(
+            minutes_by_zone(after, ["America/New_York", None], "UTC"),
+            {sunday + 420: (None,), sunday + 180: ("America/New_York",)},
+        )
+
+    def test_local_dates_in_a_single_zone(self):
+        # Every restaurant in New York: one group, standing for every zone
+        new_york = zone_info("America/New_York")
+        for day in (24, 25):
+            at = datetime(2024, 12, day, 22, 0, tzinfo=new_york)
+            zone_minutes = minutes_by_zone(at, ["America/New_York"], "UTC")
+            self.assertEqual(list(zone_minutes.values()), [None])
+            self.assertEqual(list(local_dates(at, zone_minutes).values()), [date(2024, 12, day)])
+
+    def test_local_dates_by_zone(self):
+        at = datetime(2024, 1, 1, 23, 30, tzinfo=timezone.utc)
+        zone_minutes = minutes_by_zone(at, [None, "Asia/Tokyo", "America/Los_Angeles"], "UTC")
+        dates = local_dates(at, zone_minutes)
+        self.assertEqual(
+            {zones: dates[minute].isoformat() for minute, zones in zone_minutes.items()},
+            {(None,): '2024-01-01', ("Asia/Tokyo",): '2024-01-02', ("America/Los_Angeles",): '2024-01-01'},
+        )
+
+    def test_windows_by_zone(self):
+        start, end = datetime(2024, 1, 1, 10, 0), datetime(2024, 1, 1, 11, 0)
+        self.assertEqual(windows_by_zone(start, end, ["Asia/Tokyo"], "UTC"), {((600, 660),): None})
+        utc = timezone.utc
+        self.assertEqual(
+            windows_by_zone(start.replace(tzinfo=utc), end.replace(tzinfo=utc), ["Asia/Tokyo", None], "UTC"),
+            {((600, 660),): (None,), ((1140, 1200),): ("Asia/Tokyo",)},
+        )
+
+
+class TestOpeningHoursIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = OpeningHoursIndex()
+        self.index.load(
+            [(1, "Lunch Place"), (2, "Night Owl")],
+            [
+                (1, start, end)
+                for start, end in schedule_intervals(['Monday', 'Tuesday'], time(11, 0), time(15, 0))
+            ] + [
+                (2, start, end)
+                for start, end in schedule_intervals(['Friday'], time(22, 0), time(2, 0))
+            ],
+        )
+
+    def names_at(self, moment):
+        return [entry.restaurant_name for entry in self.index.lookup(moment)]
+
+    def test_lookup_inside_hours(self):
+        self.assertEqual(self.names_at(datetime(2023, 10, 30, 12, 0)), ["Lunch Place"])
+
+    def test_lookup_closing_minute_is_inclusive(self):
+        self.assertEqual(self.names_at(datetime(2023, 10, 31, 15, 0)), ["Lunch Place"])
+        self.assertEqual(self.names_at(datetime(2023, 10, 31, 15, 1)), [])
+
+    def test_lookup_overnight_hours_run_into_the_next_day(self):
+        self.assertEqual(self.names_at(datetime(2023, 11, 3, 23, 30)), ["Night Owl"])
+        self.assertEqual(self.names_at(datetime(2023, 11, 4, 1, 30)), ["Night Owl"])
+        self.assertEqual(self.names_at(datetime(2023, 11, 3, 1, 30)), [])
+
+    def test_lookup_page(self):
+        self.index.load(
+            [(1, "One"), (2, "Two"), (3, "Three")],
+            [(restaurant_id, 0, 60) for restaurant_id in (1, 2, 3)],
+        )
+        self.assertEqual([entry.id for entry in self.index.lookup_page(30, limit=2)], [1, 2])
+        self.assertEqual([entry.id for entry in self.index.lookup_page(30, after_id=1)], [2, 3])
+        self.assertEqual(self.index.lookup_page(30, after_id=3), ())
+
+    def test_lookup_zones(self):
+        self.index.load(
+            [(1, "Here"), (2, "East"), (3, "Also here")],
+            [(restaurant_id, 600, 660) for restaurant_id in (1, 2, 3)],
+            zones={2: "Asia/Tokyo"},
+        )
+        self.assertEqual(self.index.zones, (None, "Asia/Tokyo"))
+        # 10:30 UTC on a Monday is 19:30 in Tokyo
+        zone_minutes = minutes_by_zone(datetime(2024, 1, 1, 10, 30, tzinfo=timezone.utc), self.index.zones, "UTC")
+        self.assertEqual([entry.id for entry in self.index.lookup_zones(zone_minutes)], [1, 3])
+        zone_minutes = minutes_by_zone(datetime(2024, 1, 1, 1, 30, tzinfo=timezone.utc), self.index.zones, "UTC")
+        self.assertEqual([entry.id for entry in self.index.lookup_zones(zone_minutes)], [2])
+
+    def test_mark_stale(self):
+        self.assertTrue(self.index.is_ready)
+        self.index.mark_stale()
+        self.assertFalse(self.index.is_ready)
+
+
+def test_get_restaurants_revalidates_with_etag(test_db):
+    response = client.get("api/v1/restaurants/2023-11-01T12:00:00")
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert 'max-age' in response.headers['Cache-Control']
+
+    hits = response_cache.hits
+    # Same minute of another week is the same answer
+    response = client.get("api/v1/restaurants/2023-11-08T12:00:30", headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response_cache.hits == hits + 1
+
+    response = client.get("api/v1/restaurants/2023-11-08T12:00:00", headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag
+
+
+def test_get_restaurants_cache_is_cleared_on_create(test_db):
+    restaurant_id = test_db.query(Restaurant.id).filter(
+        Restaurant.restaurant_name == "Test Restaurant"
+    ).scalar()
+    url = "api/v1/restaurants/2023-11-01T06:00:00"
+    before = client.get(url)
+    assert "Test Restaurant" not in before.text
+
+    generation = response_cache.generation
+    schedule = crud_schedule.create(test_db, obj_in=ScheduleCreate(
+        days="Wednesday", opening_time=time(5, 0), closing_time=time(7, 0)
+    ))
+    assert response_cache.generation == generation + 1
+    assert response_cache.stats()['size'] == 0
+    # ScheduleCreate has no restaurant, attach it outside of CRUD
+    schedule.restaurant_id = restaurant_id
+    test_db.commit()
+    response_cache.clear()
+    try:
+        after = client.get(url)
+        assert after.status_code == 200
+        assert "Test Restaurant" in [restaurant['restaurant_name'] for restaurant in after.json()['data']]
+        assert after.headers['ETag'] != before.headers['ETag']
+    finally:
+        test_db.delete(schedule)
+        test_db.commit()
+        response_cache.clear()
+
+
+def test_create_marks_the_index_stale_before_clearing_the_cache(test_db, monkeypatch):
+    index = OpeningHoursIndex()
+    index.load([], [])
+    monkeypatch.setattr('core.schedule_index.opening_hours_index', index)
+    ready_at_clear = []
+    monkeypatch.setattr(response_cache, 'clear', lambda: ready_at_clear.append(index.is_ready))
+    stamp = import_stamp(test_db)
+    restaurant = crud_restaurant.create(
+        test_db, obj_in=RestaurantCreate(restaurant_name="Pop-up", working_hours="")
+    )
+    try:
+        assert ready_at_clear == [False]
+        # Other workers, and a snapshot built before the write, go by this
+        assert import_stamp(test_db) != stamp
+    finally:
+        test_db.delete(restaurant)
+        test_db.commit()
+        MinuteResponseCache.clear(response_cache)
+
+
+def test_write_during_a_lookup_leaves_the_answer_uncached(monkeypatch):
+    from api.api_v1.endpoints import restaurant as endpoint
+
+    read = endpoint._zone_minutes_and_changes
+
+    async def read_then_write(*args):
+        result = await read(*args)
+        # A write commits after the zones and exceptions were read
+        response_cache.clear()
+        return result
+
+    monkeypatch.setattr(endpoint, '_zone_minutes_and_changes', read_then_write)
+    response_cache.clear()
+    response = client.get("api/v1/restaurants/2023-11-01T06:00:00")
+    assert response.status_code in (200, 404)
+    assert response_cache.stats()['size'] == 0
+
+
+def test_get_cache_stats():
+    response = client.get("api/v1/restaurants/stats/cache")
+    assert response.status_code == 200
+    assert set(response.json()['data']) == {'hits', 'misses', 'size', 'maxsize', 'executed', 'coalesced'}
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return object()
+
+        async def run():
+            results = await asyncio.gather(*(flight.do(720, compute) for _ in range(5)))
+            self.assertTrue(all(result is results[0] for result in results))
+            # Once done, the next call computes again
+            self.assertIsNot(await flight.do(720, compute), results[0])
+
+        asyncio.run(run())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(flight.stats(), {'executed': 2, 'coalesced': 4})
+
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("no database")
+
+        async def run():
+            return await asyncio.gather(*(flight.do(720, compute) for _ in range(3)), return_exceptions=True)
+
+        self.assertEqual([type(result) for result in asyncio.run(run())], [ValueError] * 3)
+
+    def test_a_cancelled_caller_leaves_the_computation_running(self):
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return 'done'
+
+        async def run():
+            first = asyncio.ensure_future(flight.do(720, compute))
+            second = asyncio.ensure_future(flight.do(720, compute))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(run()), 'done')
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/index.snapshot'
+        self.built = OpeningHoursIndex()
+        self.built.load(
+            [(1, "Lunch Place"), (2, "Night Owl"), (3, "Café Ünïcode"), (4, "Never Open")],
+            [
+                (1, start, end)
+                for start, end in schedule_intervals(['Monday', 'Tuesday'], time(11, 0), time(15, 0))
+            ] + [
+                (2, start, end)
+                for start, end in schedule_intervals(['Sunday'], time(22, 0), time(2, 0))
+            ] + [(3, 0, MINUTES_PER_WEEK)],
+            zones={2: "Asia/Tokyo"},
+        )
+
+    def mapped_index(self):
+        index = OpeningHoursIndex()
+        index.use_snapshot(SnapshotStore(self.path))
+        index.map_snapshot()
+        return index
+
+    def test_lookups_match_the_built_index(self):
+        SnapshotStore(self.path).publish(self.built._table)
+        mapped = self.mapped_index()
+        self.assertTrue(mapped.is_ready)
+        self.assertEqual(mapped.zones, self.built.zones)
+        for minute in range(0, MINUTES_PER_WEEK, 30):
+            self.assertEqual(list(mapped.lookup_minute(minute)), list(self.built.lookup_minute(minute)), minute)
+        self.assertEqual(
+            mapped.open_ids_by_minutes(range(0, MINUTES_PER_WEEK, 60)),
+            self.built.open_ids_by_minutes(range(0, MINUTES_PER_WEEK, 60)),
+        )
+        self.assertEqual(mapped.change_points(), self.built.change_points())
+        self.assertEqual(mapped.change_points([2, 5]), self.built.change_points([2, 5]))
+        self.assertEqual(page_after(mapped.lookup_minute(12 * 60), after_id=1), ((3, "Café Ünïcode"),))
+        at = datetime(2024, 1, 1, 0, 30, tzinfo=timezone.utc)
+        zone_minutes = minutes_by_zone(at, mapped.zones, "UTC")
+        self.assertEqual(list(mapped.lookup_zones(zone_minutes)), list(self.built.lookup_zones(zone_minutes)))
+
+    def test_publishing_replaces_the_snapshot(self):
+        store = SnapshotStore(self.path)
+        store.publish(self.built._table)
+        mapped = self.mapped_index()
+        self.assertFalse(mapped.refresh_snapshot())
+
+        self.built.load([(5, "Newcomer")], [(5, 0, 60)])
+        store.publish(self.built._table)
+        self.assertEqual(snapshot_generation(self.path), 2)
+        self.assertTrue(mapped.refresh_snapshot())
+        self.assertEqual([entry.restaurant_name for entry in mapped.lookup_minute(30)], ["Newcomer"])
+
+
+    def test_snapshot_built_from_other_data_does_not_match(self):
+        store = SnapshotStore(self.path)
+        self.assertFalse(store.matches(b'\x01' * 16))
+        store.publish(self.built._table, b'\x01' * 16)
+        self.assertTrue(store.matches(b'\x01' * 16))
+        self.assertFalse(store.matches(b'\x02' * 16))
+        self.assertEqual(self.mapped_index().stamp, b'\x01' * 16)
+
+
+class TestMinuteResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = MinuteResponseCache(maxsize=2)
+
+    def test_hits_and_misses(self):
+        self.assertIsNone(self.cache.get(1))
+        entry = self.cache.put(1, 200, b'{}')
+        self.assertEqual(self.cache.get(1), entry)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put(1, 200, b'1')
+        self.cache.put(2, 200, b'2')
+        self.cache.get(1)
+        self.cache.put(3, 200, b'3')
+        self.assertIsNone(self.cache.get(2))
+        self.assertIsNotNone(self.cache.get(1))
+
+    def test_responses_read_before_a_clear_are_not_stored(self):
+        generation = self.cache.generation
+        self.cache.clear()
+        self.cache.put(1, 200, b'old', generation=generation)
+        self.assertIsNone(self.cache.get(1))
+
+    def test_etag_matches(self):
+        etag = self.cache.put(1, 200, b'{}').etag
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(etag_matches('*', etag))
+        self.assertFalse(etag_matches('"other"', etag))
+        self.assertFalse(etag_matches(None, etag))
+
+
+def test_get_next_change(test_db, night_owl):
+    response = client.get(
+        f"api/v1/restaurants/{night_owl.id}/next-change", params={'at': "2023-11-05T20:15:30"}
+    )
+    assert response.status_code == 200
+    assert response.json()['data'] == {
+        'restaurant_id': night_owl.id,
+        'is_open': False,
+        'next_change': 'open',
+        'changes_at': "2023-11-05T22:00:00",
+    }
+
+    # Sunday night runs into Monday and closes after the closing minute
+    response = client.get(
+        f"api/v1/restaurants/{night_owl.id}/next-change", params={'at': "2023-11-05T23:00:00"}
+    )
+    assert response.json()['data']['is_open']
+    assert response.json()['data']['changes_at'] == "2023-11-06T03:01:00"
+
+
+def test_get_next_change_unknown_restaurant(test_db):
+    response = client.get("api/v1/restaurants/0/next-change")
+    assert response.status_code == 404
+
+
+def test_get_next_changes_batch(test_db, night_owl):
+    response = client.post(
+        "api/v1/restaurants/next-change:batch",
+        json={'restaurant_ids': [night_owl.id, 0], 'at': "2023-11-01T02:00:00"},
+    )
+    assert response.status_code == 200
+    assert response.json()['data'] == [{
+        'restaurant_id': night_owl.id,
+        'is_open': True,
+        'next_change': 'close',
+        'changes_at': "2023-11-01T03:01:00",
+    }]
+
+
+def test_opening_hours_index_change_points_match_sql(test_db, night_owl):
+    index = OpeningHoursIndex()
+    index.build(test_db)
+    assert index.change_points() == crud_restaurant.get_change_points(test_db)
+    assert index.change_points([night_owl.id, 0]) == crud_restaurant.get_change_points(test_db, [night_owl.id, 0])
+
+
+class TestChangePoints(unittest.TestCase):
+    def test_regular_hours(self):
+        points = change_points(schedule_intervals(['Monday'], time(9, 0), time(17, 0)))
+        self.assertEqual(points.minutes, (9 * 60, 17 * 60 + 1))
+        self.assertEqual(points.opens, (True, False))
+
+    def test_overnight_hours_on_consecutive_days_do_not_close_at_midnight(self):
+        points = change_points(schedule_intervals(['Monday', 'Tuesday'], time(20, 0), time(4, 0)))
+        self.assertEqual(len(points.minutes), 4)
+        self.assertNotIn(MINUTES_PER_DAY, points.minutes)
+        self.assertNotIn(2 * MINUTES_PER_DAY, points.minutes)
+
+    def test_hours_across_the_end_of_the_week_are_merged(self):
+        points = change_points(schedule_intervals(['Sunday', 'Monday'], time(0, 0), time(23, 59)))
+        self.assertEqual(points.minutes, (MINUTES_PER_DAY, 6 * MINUTES_PER_DAY))
+        self.assertEqual(points.opens, (False, True))
+
+    def test_restaurants_that_never_change(self):
+        always = change_points(schedule_intervals(WEEKDAYS, time(0, 0), time(23, 59)))
+        self.assertEqual(next_change(always, 100), (True, None, None))
+        self.assertEqual(next_change(change_points([]), 100), (False, None, None))
+
+    def test_next_change_wraps_around_the_week(self):
+        points = change_points(schedule_intervals(['Monday'], time(9, 0), time(17, 0)))
+        self.assertEqual(next_change(points, 9 * 60), (True, 8 * 60 + 1, False))
+        self.assertEqual(next_change(points, 17 * 60 + 1), (False, MINUTES_PER_WEEK - 8 * 60 - 1, True))
+
+
+def test_get_by_opening_hours_returns_each_restaurant_once(test_db):
+    restaurant_id = test_db.query(Restaurant.id).filter(
+        Restaurant.restaurant_name == "Test Restaurant"
+    ).scalar()
+    # Overlaps the fixture's 9 am - 5 pm every day
+    schedule = Schedule(
+        restaurant_id=restaurant_id, days="Wednesday", opening_time=time(8, 0), closing_time=time(13, 0)
+    )
+    test_db.add(schedule)
+    test_db.commit()
+    try:
+        moment = datetime(2023, 11, 1, 12, 0)
+        ids = [restaurant.id for restaurant in crud_restaurant.get_by_opening_hours(test_db, moment)]
+        assert ids.count(restaurant_id) == 1
+        rows = crud_restaurant.get_names_by_opening_hours(test_db, moment)
+        assert [row.id for row in rows] == sorted(ids)
+        assert (restaurant_id, "Test Restaurant") in rows
+    finally:
+        test_db.delete(schedule)
+        test_db.commit()
+
+
+@pytest.fixture
+def zoned_restaurants(test_db):
+    restaurants = [
+        Restaurant(restaurant_name="Early Bird", working_hours="Sun 8 am - 9 am", timezone="America/New_York"),
+        Restaurant(restaurant_name="Fruehstueck", working_hours="Sun 2 pm - 3 pm", timezone="Europe/Berlin"),
+    ]
+    for restaurant, opening in zip(restaurants, (time(8, 0), time(14, 0))):
+        restaurant.schedules.append(Schedule(
+            days="Sunday", opening_time=opening, closing_time=opening.replace(hour=opening.hour + 1)
+        ))
+        test_db.add(restaurant)
+    test_db.commit()
+    response_cache.clear()
+    yield restaurants
+    for restaurant in restaurants:
+        test_db.delete(restaurant)
+    test_db.commit()
+    response_cache.clear()
+
+
+def test_get_by_opening_hours_in_restaurant_time_zones(test_db, zoned_restaurants):
+    def names_at(moment):
+        return set(window_names(crud_restaurant.get_by_opening_hours(test_db, moment)))
+
+    # New York switched to daylight saving time at 7:00 UTC on 2024-03-10
+    assert {"Early Bird", "Test Restaurant"} <= names_at(datetime(2024, 3, 10, 12, 30, tzinfo=timezone.utc))
+    assert "Early Bird" not in names_at(datetime(2024, 3, 3, 12, 30, tzinfo=timezone.utc))
+    assert {"Early Bird", "Fruehstueck"} <= names_at(datetime(2024, 3, 3, 13, 30, tzinfo=timezone.utc))
+    # Naive times are local wherever the restaurant is
+    assert {"Early Bird", "Test Restaurant"} <= names_at(datetime(2024, 3, 10, 9, 0))
+
+
+def test_opening_hours_index_time_zones_match_sql(test_db, zoned_restaurants):
+    index = OpeningHoursIndex()
+    index.build(test_db)
+    assert set(index.zones) >= {None, "America/New_York", "Europe/Berlin"}
+
+    moment = datetime(2024, 3, 7, tzinfo=timezone.utc)
+    while moment < datetime(2024, 3, 14, tzinfo=timezone.utc):
+        from_sql = [
+            row.id for row in crud_restaurant.get_names_by_opening_hours(test_db, moment)
+        ]
+        zone_minutes = minutes_by_zone(moment, index.zones, "UTC")
+        assert [entry.id for entry in index.lookup_zones(zone_minutes)] == from_sql, moment
+        moment += timedelta(minutes=30)
+
+
+def test_get_restaurants_at_aware_datetime(test_db, zoned_restaurants):
+    def names(url):
+        response = client.get(url)
+        assert response.status_code == 200
+        return [restaurant['restaurant_name'] for restaurant in response.json()['data']]
+
+    assert "Early Bird" in names("api/v1/restaurants/2024-03-10T12:30:00Z")
+    # Same minute of the week in UTC, but an hour earlier in New York
+    assert "Early Bird" not in names("api/v1/restaurants/2024-03-03T12:30:00Z")
+    assert "Early Bird" in names("api/v1/restaurants/2024-03-10T08:30:00-04:00")
+
+
+def test_batch_windows_and_next_change_in_restaurant_time_zones(test_db, zoned_restaurants):
+    early_bird, fruehstueck = (restaurant.id for restaurant in zoned_restaurants)
+    # 8:30 in New York on the first, 7:30 on the second, a week before
+    # daylight saving time
+    timestamps = ["2024-03-10T12:30:00Z", "2024-03-03T12:30:00Z", "2024-03-10T08:30:00"]
+    response = client.post("api/v1/restaurants/open:batch", json={'timestamps': timestamps})
+    data = response.json()['data']
+    assert [early_bird in item['restaurant_ids'] for item in data] == [True, False, True]
+    for item, timestamp in zip(data, timestamps):
+        expected = crud_restaurant.get_by_opening_hours(test_db, parse_datetime(timestamp))
+        assert item['restaurant_ids'] == sorted(restaurant.id for restaurant in expected)
+    index = OpeningHoursIndex()
+    index.build(test_db)
+    zone_minutes = [minutes_by_zone(parse_datetime(timestamp), index.zones, "UTC") for timestamp in timestamps]
+    assert index.open_ids_by_zone_minutes(zone_minutes) == [item['restaurant_ids'] for item in data]
+
+    def window_names(kind, start, end):
+        response = client.get(f"api/v1/restaurants/open-{kind}", params={'start': start, 'end': end})
+        if response.status_code == 404:
+            return set()
+        return {restaurant['restaurant_name'] for restaurant in response.json()['data']}
+
+    # 8:05 - 8:55 in New York, 13:05 - 13:55 in Berlin
+    during = window_names('during', "2024-03-10T12:05:00Z", "2024-03-10T12:55:00Z")
+    assert "Early Bird" in during and "Fruehstueck" not in during
+    assert {"Early Bird", "Fruehstueck"} <= window_names('any', "2024-03-10T12:05:00Z", "2024-03-10T13:05:00Z")
+    assert "Early Bird" not in window_names('any', "2024-03-03T12:05:00Z", "2024-03-03T12:55:00Z")
+    response = client.get(
+        "api/v1/restaurants/open-any", params={'start': "2024-03-10T12:05:00Z", 'end': "2024-03-10T13:05:00"}
+    )
+    assert response.status_code == 400
+
+    response = client.get(
+        f"api/v1/restaurants/{early_bird}/next-change", params={'at': "2024-03-10T11:00:00Z"}
+    )
+    assert response.json()['data'] == {
+        'restaurant_id': early_bird,
+        'is_open': False,
+        'next_change': 'open',
+        'changes_at': "2024-03-10T12:00:00Z",
+    }
+    response = client.post(
+        "api/v1/restaurants/next-change:batch",
+        json={'restaurant_ids': [early_bird, fruehstueck], 'at': "2024-03-10T13:30:00+01:00"},
+    )
+    assert [(item['is_open'], item['changes_at']) for item in response.json()['data']] == [
+        (True, "2024-03-10T14:01:00+01:00"), (False, "2024-03-10T14:00:00+01:00"),
+    ]
+    # Now, by default, is an instant too
+    changes_at = client.get(f"api/v1/restaurants/{early_bird}/next-change").json()['data']['changes_at']
+    assert datetime.fromisoformat(changes_at).tzinfo is not None
+
+
+class TestScheduleOverrides(unittest.TestCase):
+    def setUp(self):
+        self.overrides = ScheduleOverrides.from_rows([
+            (1, "Closed", None, date(2024, 12, 25), None, None),
+            (2, "Late", 'America/New_York', date(2024, 12, 31), time(20, 0), time(2, 0)),
+            (3, "Split", None, date(2024, 12, 24), time(9, 0), time(12, 0)),
+            (3, "Split", None, date(2024, 12, 24), time(18, 0), time(22, 0)),
+        ])
+
+    def changes(self, at, zones=None):
+        minute = minute_of_week(at)
+        return self.overrides.changes({minute: zones}, {minute: at.date()})
+
+    def test_dates_without_exceptions_change_nothing(self):
+        self.assertEqual(self.changes(datetime(2024, 12, 26, 12, 0)), (set(), {}))
+
+    def test_closure_and_special_hours_replace_the_day(self):
+        self.assertEqual(self.changes(datetime(2024, 12, 25, 12, 0)), ({1}, {}))
+        self.assertEqual(self.changes(datetime(2024, 12, 24, 13, 0)), ({3}, {}))
+        closed, opened = self.changes(datetime(2024, 12, 24, 22, 0))
+        self.assertEqual((closed, list(opened)), (set(), [3]))
+
+    def test_special_hours_carry_on_past_midnight(self):
+        closed, opened = self.changes(datetime(2025, 1, 1, 1, 30))
+        self.assertEqual((closed, list(opened)), (set(), [2]))
+        # The next day otherwise keeps its weekly hours
+        self.assertEqual(self.changes(datetime(2025, 1, 1, 12, 0)), (set(), {}))
+
+    def test_only_restaurants_in_the_zones_change(self):
+        self.assertEqual(self.changes(datetime(2024, 12, 31, 21, 0), zones=(None,)), (set(), {}))
+        self.assertEqual(list(self.changes(datetime(2024, 12, 31, 21, 0), zones=('America/New_York',))[1]), [2])
+
+    def test_next_change_goes_by_the_exceptions(self):
+        # Open 10:00 to 20:00 every day by the weekly hours
+        points = change_points(schedule_intervals(WEEKDAYS, time(10, 0), time(19, 59)))
+        self.assertEqual(self.overrides.next_change(3, points, datetime(2024, 12, 24, 8, 0)), (False, 60, True))
+        self.assertEqual(self.overrides.next_change(3, points, datetime(2024, 12, 24, 12, 30)), (False, 330, True))
+        self.assertEqual(self.overrides.next_change(3, points, datetime(2024, 12, 24, 22, 30)), (False, 690, True))
+        # Closed all of Christmas Day, so it opens again the day after
+        self.assertEqual(self.overrides.next_change(1, points, datetime(2024, 12, 24, 21, 0)), (False, 2220, True))
+
+    def test_window_state_goes_by_the_exceptions(self):
+        points = change_points(schedule_intervals(WEEKDAYS, time(10, 0), time(19, 59)))
+        self.assertEqual(
+            self.overrides.window_state(3, points, datetime(2024, 12, 24, 11, 0), datetime(2024, 12, 24, 19, 0)),
+            (True, False),
+        )
+        self.assertEqual(
+            self.overrides.window_state(3, points, datetime(2024, 12, 24, 9, 30), datetime(2024, 12, 24, 11, 30)),
+            (True, True),
+        )
+        self.assertEqual(
+            self.overrides.window_state(1, points, datetime(2024, 12, 25, 9, 0), datetime(2024, 12, 25, 21, 0)),
+            (False, False),
+        )
+        # Weeks without exceptions keep the weekly hours
+        self.assertEqual(
+            self.overrides.window_state(1, points, datetime(2024, 12, 20, 12, 0), datetime(2025, 1, 20, 12, 0)),
+            (True, False),
+        )
+
+    def test_apply_changes_keeps_ids_in_order(self):
+        weekly = (RestaurantEntry(1, "Closed"), RestaurantEntry(4, "Weekly"))
+        self.assertIs(apply_changes(weekly, set(), {}), weekly)
+        self.assertEqual(
+            apply_changes(weekly, {1}, {3: RestaurantEntry(3, "Split")}),
+            (RestaurantEntry(3, "Split"), RestaurantEntry(4, "Weekly")),
+        )
+
+
+@pytest.fixture
+def holiday(test_db):
+    restaurant = test_db.query(Restaurant).filter(Restaurant.restaurant_name == "Test Restaurant").first()
+    yield restaurant.id
+    test_db.query(ScheduleException).filter(ScheduleException.restaurant_id == restaurant.id).delete()
+    test_db.commit()
+    response_cache.clear()
+
+
+def test_schedule_exceptions_override_the_weekly_hours(test_db, holiday):
+    headers = {'X-Admin-Token': settings.SECRET_KEY}
+    assert client.post(
+        f"api/v1/restaurants/{holiday}/exceptions", json={'date': '2024-12-25'}
+    ).status_code == 403
+    for body in ({'date': '2024-12-25'}, {'date': '2024-12-26', 'opening_time': '19:00', 'closing_time': '23:00'}):
+        response = client.post(f"api/v1/restaurants/{holiday}/exceptions", json=body, headers=headers)
+        assert response.status_code == 201
+
+    def names(at):
+        return [restaurant.restaurant_name for restaurant in crud_restaurant.get_by_opening_hours(test_db, at)]
+
+    assert "Test Restaurant" in names(datetime(2024, 12, 18, 12, 0))
+    assert "Test Restaurant" not in names(datetime(2024, 12, 25, 12, 0))
+    assert "Test Restaurant" not in names(datetime(2024, 12, 26, 12, 0))
+    assert "Test Restaurant" in names(datetime(2024, 12, 26, 20, 0))
+
+    response = client.get("api/v1/restaurants/2024-12-25T12:00:00")
+    assert "Test Restaurant" not in response.text
+    # Same minute of the week, a date without exceptions
+    assert "Test Restaurant" in client.get("api/v1/restaurants/2024-12-18T12:00:00").text
+
+    response = client.get(f"api/v1/restaurants/{holiday}/exceptions")
+    assert [item['date'] for item in response.json()['data']] == ['2024-12-25', '2024-12-26']
+
+    index = OpeningHoursIndex()
+    index.build(test_db)
+    for at in (datetime(2024, 12, 25, 12, 0), datetime(2024, 12, 26, 12, 0), datetime(2024, 12, 26, 20, 0)):
+        zone_minutes = crud_restaurant.minutes_by_zone(test_db, at)
+        changes = crud_restaurant.override_changes(test_db, at, zone_minutes)
+        assert list(apply_changes(index.lookup_zones(zone_minutes), *changes)) == [
+            tuple(row) for row in crud_restaurant.get_names_by_opening_hours(test_db, at)
+        ]
+
+
+def test_every_endpoint_applies_schedule_exceptions(test_db, holiday):
+    test_db.add(ScheduleException(restaurant_id=holiday, date=date(2024, 12, 25)))
+    test_db.commit()
+    response_cache.clear()
+
+    # The same timestamp, one at a time and in a batch
+    assert "Test Restaurant" not in client.get("api/v1/restaurants/2024-12-25T12:00:00").text
+    response = client.post(
+        "api/v1/restaurants/open:batch", json={'timestamps': ['2024-12-25T12:00:00', '2024-12-18T12:00:00']}
+    )
+    holiday_ids, weekly_ids = [item['restaurant_ids'] for item in response.json()['data']]
+    assert holiday not in holiday_ids
+    assert holiday in weekly_ids
+
+    def window_names(path, start, end):
+        response = client.get(f"api/v1/restaurants/{path}", params={'start': start, 'end': end})
+        return [item['restaurant_name'] for item in response.json().get('data', ())]
+
+    assert "Test Restaurant" not in window_names("open-any", '2024-12-25T10:00:00', '2024-12-25T11:00:00')
+    assert "Test Restaurant" in window_names("open-during", '2024-12-24T10:00:00', '2024-12-24T11:00:00')
+    assert "Test Restaurant" not in window_names("open-during", '2024-12-25T10:00:00', '2024-12-25T11:00:00')
+
+    response = client.get(f"api/v1/restaurants/{holiday}/next-change", params={'at': '2024-12-24T18:00:00'})
+    assert response.json()['data']['changes_at'] == '2024-12-26T09:00:00'
+    response = client.post(
+        "api/v1/restaurants/next-change:batch", json={'restaurant_ids': [holiday], 'at': '2024-12-24T18:00:00'}
+    )
+    assert response.json()['data'][0]['changes_at'] == '2024-12-26T09:00:00'
+
+
+def test_datetimes_at_the_ends_of_the_calendar():
+    # Aware ones cannot be read on every clock there
+    coalesce_requests = settings.COALESCE_REQUESTS
+    for opening_hours in ('0001-01-01T00:00:00%2B05:00', '9999-12-31T23:59:00-05:00', '0001-01-01T00:00:00Z'):
+        for coalesce in (True, False):
+            settings.COALESCE_REQUESTS = coalesce
+            try:
+                response = client.get(f"api/v1/restaurants/{opening_hours}")
+            finally:
+                settings.COALESCE_REQUESTS = coalesce_requests
+            assert response.status_code == 400, opening_hours
+    # Naive ones are local time and have no other clock to be read on
+    assert client.get("api/v1/restaurants/0001-01-01T12:00:00").status_code in (200, 404)
+    response = client.post("api/v1/restaurants/open:batch", json={'timestamps': ['0001-01-01T00:00:00+05:00']})
+    assert response.status_code == 400
+
+
+def test_acreate_raises_integrity_errors(test_db):
+    async def create_for_unknown_restaurant():
+        async with AsyncSessionLocal() as db:
+            await crud_schedule_exception.acreate(
+                db, obj_in=ScheduleExceptionCreate(restaurant_id=0, date=date(2024, 12, 25))
+            )
+
+    with pytest.raises(IntegrityError):
+        asyncio.run(create_for_unknown_restaurant())
+
+
+def test_load_exceptions_csv(test_db, holiday, tmp_path):
+    csv_file = tmp_path / 'schedule_exceptions.csv'
+    csv_file.write_text(
+        '"Restaurant Name","Date","Hours"\n'
+        '"Test Restaurant","2024-12-25","Closed"\n'
+        '"Test Restaurant","2024-12-31","10 am - 2 pm / 8 pm - 1 am"\n'
+        '"Nowhere","2024-12-31","Closed"\n'
+        '"Test Restaurant","31/12/2024","Closed"\n'
+    )
+    stamp = import_stamp(test_db)
+    report = load_exceptions_csv(test_db, csv_file)
+    # Servers running apart from the loader poll for this
+    assert import_stamp(test_db) != stamp
+    assert (report.rows, [error.line for error in report.errors]) == (4, [4, 5])
+    exceptions = crud_schedule_exception.get_by_restaurant(test_db, holiday)
+    assert [(exception.date, exception.opening_time) for exception in exceptions] == [
+        (date(2024, 12, 25), None), (date(2024, 12, 31), time(10, 0)), (date(2024, 12, 31), time(20, 0)),
+    ]
+
+
+class TestTransitionWheel(unittest.TestCase):
+    def setUp(self):
+        monday = 0
+        sunday = 6 * 24 * 60
+        self.wheel = TransitionWheel(
+            [(1, "Nine to Five"), (2, "New York Nine to Five"), (3, "Skipped Hour")],
+            [
+                (1, monday + 9 * 60, monday + 17 * 60 + 1),
+                (2, monday + 9 * 60, monday + 17 * 60 + 1),
+                (3, sunday + 2 * 60 + 30, sunday + 4 * 60 + 1),
+            ],
+            zones={2: 'America/New_York', 3: 'America/New_York'},
+        )
+
+    def transitions(self, previous, at, overrides=None):
+        opened, closed = self.wheel.transitions(previous, at, overrides)
+        return [entry.id for entry in opened], [entry.id for entry in closed]
+
+    def test_each_zone_at_its_local_minute(self):
+        # Monday 2024-01-01, New York five hours behind UTC
+        self.assertEqual(self.transitions(datetime(2024, 1, 1, 8, 59, tzinfo=timezone.utc),
+                                          datetime(2024, 1, 1, 9, 0, tzinfo=timezone.utc)), ([1], []))
+        self.assertEqual(self.transitions(datetime(2024, 1, 1, 13, 59, tzinfo=timezone.utc),
+                                          datetime(2024, 1, 1, 14, 0, tzinfo=timezone.utc)), ([2], []))
+        self.assertEqual(self.transitions(datetime(2024, 1, 1, 17, 0, tzinfo=timezone.utc),
+                                          datetime(2024, 1, 1, 17, 1, tzinfo=timezone.utc)), ([], [1]))
+
+    def test_catching_up_reports_net_changes(self):
+        self.assertEqual(self.transitions(datetime(2024, 1, 1, 8, 0, tzinfo=timezone.utc),
+                                          datetime(2024, 1, 1, 18, 0, tzinfo=timezone.utc)), ([2], []))
+
+    def test_hours_skipped_by_the_clocks_are_swept(self):
+        # New York goes from 01:59 to 03:00 on 2024-03-10, a Sunday
+        self.assertEqual(self.transitions(datetime(2024, 3, 10, 6, 59, tzinfo=timezone.utc),
+                                          datetime(2024, 3, 10, 7, 0, tzinfo=timezone.utc)), ([3], []))
+
+    def test_an_hour_repeated_by_the_clocks_is_swept_once(self):
+        # New York goes from 01:59 EDT back to 01:00 EST on 2024-11-03, a
+        # Sunday, and passes 01:30 twice
+        self.wheel = TransitionWheel(
+            [(4, "Closes At Half Past One")],
+            [(4, 6 * MINUTES_PER_DAY, 6 * MINUTES_PER_DAY + 90)],
+            zones={4: 'America/New_York'},
+        )
+        closed = []
+        at = datetime(2024, 11, 3, 5, 0, tzinfo=timezone.utc)
+        while at < datetime(2024, 11, 3, 8, 0, tzinfo=timezone.utc):
+            previous, at = at, at + timedelta(minutes=1)
+            closed.extend(self.transitions(previous, at)[1])
+        self.assertEqual(closed, [4])
+
+    def test_schedule_exceptions_take_precedence(self):
+        overrides = ScheduleOverrides.from_rows([
+            (1, "Nine to Five", None, date(2024, 1, 1), None, None),
+            (1, "Nine to Five", None, date(2024, 1, 2), time(12, 0), time(13, 0)),
+        ])
+        # Naive times are local time in every zone
+        self.assertEqual(self.transitions(datetime(2024, 1, 1, 8, 59), datetime(2024, 1, 1, 9, 0), overrides),
+                         ([2], []))
+        self.assertEqual(self.transitions(datetime(2024, 1, 2, 9, 0), datetime(2024, 1, 2, 12, 0), overrides),
+                         ([1], []))
+        self.assertEqual(self.transitions(datetime(2024, 1, 2, 13, 0), datetime(2024, 1, 2, 13, 1), overrides),
+                         ([], [1]))
+
+
+class TestTransitionFeed(unittest.TestCase):
+    def test_subscribers_share_the_messages(self):
+        async def run():
+            feed = TransitionFeed(history=2, epoch='boot')
+            first, second = feed.subscribe(), feed.subscribe()
+            for subscriber in (first, second):
+                self.assertEqual(await anext(subscriber), b': subscribed\n\n')
+            self.assertEqual(feed.subscribers, 2)
+            waiting = [asyncio.ensure_future(anext(subscriber)) for subscriber in (first, second)]
+            await asyncio.sleep(0)
+            feed.publish('opened', {'restaurants': [{'id': 1, 'restaurant_name': "Nine to Five"}]})
+            messages = await asyncio.gather(*waiting)
+            self.assertIs(messages[0], messages[1])
+            self.assertEqual(
+                messages[0],
+                b'id: boot-1\nevent: opened\ndata: {"restaurants":[{"id":1,"restaurant_name":"Nine to Five"}]}\n\n',
+            )
+            await first.aclose()
+            self.assertEqual(feed.subscribers, 1)
+
+            feed.heartbeat()
+            feed.publish('closed', {})
+            # Resuming after the first event, still kept
+            resumed = feed.subscribe(last_event_id='boot-1')
+            self.assertEqual([await anext(resumed) for _ in range(3)][1:], [b': keepalive\n\n', feed._messages[-1]])
+            # Resuming after events no longer kept
+            stale = feed.subscribe(last_event_id='boot-0')
+            await anext(stale)
+            self.assertEqual(await anext(stale), b'id: boot-1\nevent: resync\ndata: {}\n\n')
+            self.assertEqual(await anext(stale), b': keepalive\n\n')
+            # Ids from another worker or run, or ahead of this feed's
+            others = [feed.subscribe(last_event_id=event_id) for event_id in ('other-2', 'boot-9', '2')]
+            for other in others:
+                await anext(other)
+                self.assertEqual(await anext(other), b'id: boot-3\nevent: resync\ndata: {}\n\n')
+            for subscriber in (second, resumed, stale, *others):
+                await subscriber.aclose()
+            self.assertEqual(feed.subscribers, 0)
+
+        asyncio.run(run())
+
+
+def test_transition_feed_waits_in_the_loop_it_runs_in():
+    feed = TransitionFeed(history=2, epoch='boot')
+    # Built outside any running loop, as the module level feed is
+    assert feed._published is None
+
+    async def receive(event):
+        subscriber = feed.subscribe()
+        await anext(subscriber)
+        waiting = asyncio.ensure_future(anext(subscriber))
+        await asyncio.sleep(0)
+        feed.publish(event, {})
+        message = await waiting
+        await subscriber.aclose()
+        return message
+
+    async def disconnect():
+        subscriber = feed.subscribe()
+        await anext(subscriber)
+        waiting = asyncio.ensure_future(anext(subscriber))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.wait([waiting])
+        assert feed.subscribers == 0
+
+    # A client left while waiting in one loop, e.g. before a restart in the
+    # same process, and the next one waits in another
+    asyncio.run(disconnect())
+    assert asyncio.run(receive('opened')).startswith(b'id: boot-1\nevent: opened')
+    assert asyncio.run(receive('closed')).startswith(b'id: boot-2\nevent: closed')
+
+
+def test_transition_feed_sweeps_the_schedules(test_db, holiday):
+    feed = TransitionFeed(history=8)
+    previous = datetime(2024, 12, 18, 8, 59, tzinfo=timezone.utc)
+    at = previous + timedelta(minutes=1)
+    events = feed.sweep(test_db, previous, at)
+    assert [event for event, _ in events] == ['opened']
+    assert holiday in [restaurant['id'] for restaurant in events[0][1]['restaurants']]
+
+    test_db.add(ScheduleException(restaurant_id=holiday, date=date(2024, 12, 25)))
+    test_db.commit()
+    response_cache.clear()
+    overrides = crud_schedule_exception.get_overrides(test_db)
+    events = feed.sweep(test_db, previous + timedelta(days=7), at + timedelta(days=7), overrides)
+    assert events[0][0] == 'resync'
+    assert all(holiday not in [restaurant['id'] for restaurant in data.get('restaurants', ())] for _, data in events)
+
+
+def test_get_transition_events_limits_subscribers():
+    max_subscribers = settings.EVENTS_MAX_SUBSCRIBERS
+    settings.EVENTS_MAX_SUBSCRIBERS = 0
+    try:
+        response = client.get("api/v1/restaurants/events")
+    finally:
+        settings.EVENTS_MAX_SUBSCRIBERS = max_subscribers
+    assert response.status_code == 503
+
+
+def test_render_restaurant_names_matches_model_serialization():
+    names = ["Plain", 'Quote " and \\ slash', "Ünïcödé 🍕", "Tab\tnewline\n", ""]
+    expected = _render({
+        'description': "Restaurants retrieved successfully",
+        'data': [
+            RestaurantNameRead.model_validate(RestaurantEntry(i, name)).model_dump()
+            for i, name in enumerate(names)
+        ],
+    })
+    assert _render_restaurant_names(names) == expected
+    assert json.loads(_render_restaurant_names(names))['data'][1]['restaurant_name'] == names[1]
+
+
+def test_get_restaurants_pages_follow_the_cursor(test_db):
+    url = "api/v1/restaurants/2023-11-01T12:00:00"
+    everything = [restaurant['restaurant_name'] for restaurant in client.get(url).json()['data']]
+    names = []
+    params = {'limit': 7}
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page['data']) <= 7
+        names.extend(restaurant['restaurant_name'] for restaurant in page['data'])
+        if page['next_after_id'] is None:
+            break
+        params['after_id'] = page['next_after_id']
+    assert names == everything
+
+
+def test_get_restaurants_page_limit_is_bounded():
+    response = client.get("api/v1/restaurants/2023-11-01T12:00:00", params={'limit': 0})
+    assert response.status_code == 422
+
+
+def test_get_restaurants_streams_ndjson(test_db):
+    url = "api/v1/restaurants/2023-11-01T12:00:00"
+    rows = crud_restaurant.get_names_by_opening_hours(test_db, datetime(2023, 11, 1, 12, 0))
+    response = client.get(url, headers={'Accept': "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line['id'], line['restaurant_name']) for line in lines] == [tuple(row) for row in rows]
+
+    response = client.get(url, params={'after_id': rows[1].id}, headers={'Accept': "application/x-ndjson"})
+    assert [json.loads(line)['id'] for line in response.text.splitlines()] == [row.id for row in rows[2:]]
+
+
+class TestNameIndex(unittest.TestCase):
+    def setUp(self):
+        names = ["The Cheesecake Factory", "Cheese Board", "Pizzeria", None, "Chez Panisse", "CHEESE Shop"]
+        self.entries = tuple(RestaurantEntry(i, name) for i, name in enumerate(names, start=1))
+        self.index = NameIndex(self.entries)
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams("chees"), {"che", "hee", "ees"})
+        self.assertEqual(trigrams("ch"), set())
+
+    def test_matching_ignores_case(self):
+        matches = self.index.matching("Cheese", self.entries)
+        self.assertEqual([entry.id for entry in matches], [1, 2, 6])
+
+    def test_matching_walks_either_side(self):
+        # Fewer open restaurants than candidates, then the other way round
+        self.assertEqual(self.index.matching("cheese", self.entries[1:2]), self.entries[1:2])
+        self.assertEqual([entry.id for entry in self.index.matching("cheese", self.entries[1:])], [2, 6])
+        self.assertEqual(self.index.matching("panisse", self.entries), self.entries[4:5])
+
+    def test_matching_short_queries(self):
+        self.assertEqual([entry.id for entry in self.index.matching("ch", self.entries)], [1, 2, 5, 6])
+        self.assertEqual(self.index.matching("zz", self.entries[2:4]), self.entries[2:3])
+        self.assertEqual(self.index.matching("xyz", self.entries), ())
+
+
+def test_get_restaurants_filtered_by_name(test_db):
+    url = "api/v1/restaurants/2023-11-01T12:00:00"
+    everything = [restaurant['restaurant_name'] for restaurant in client.get(url).json()['data']]
+    expected = [name for name in everything if "the" in name.lower()]
+    assert expected
+
+    response = client.get(url, params={'q': "THE"})
+    assert response.status_code == 200
+    assert [restaurant['restaurant_name'] for restaurant in response.json()['data']] == expected
+    page = client.get(url, params={'q': "the", 'limit': 1}).json()
+    assert [restaurant['restaurant_name'] for restaurant in page['data']] == expected[:1]
+    # Wildcards are matched literally
+    assert client.get(url, params={'q': "%"}).status_code == 404
+    assert client.get(url, params={'q': ""}).status_code == 422
+
+    index = OpeningHoursIndex()
+    index.build(test_db)
+    at = datetime(2023, 11, 1, 12, 0)
+    for q in ("the", "Th", "%", "e_"):
+        assert list(index.name_index().matching(q, index.lookup(at))) == [
+            tuple(row) for row in crud_restaurant.get_names_by_opening_hours(test_db, at, q=q)
+        ], q
+
+
+def test_get_restaurants_reports_server_timing(test_db):
+    response_cache.clear()
+    response = client.get("api/v1/restaurants/2023-11-01T12:00:00")
+    stages = dict(
+        entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', ')
+    )
+    assert {'parse', 'cache', 'lookup', 'db', 'serialize', 'total'} <= set(stages)
+    assert all(float(duration) >= 0 for duration in stages.values())
+
+
+def test_get_metrics(test_db):
+    client.get("api/v1/restaurants/2023-11-01T12:00:00")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("text/plain")
+    for name in (
+        'http_request_duration_seconds_count',
+        'request_stage_duration_seconds_bucket',
+        'db_pool_checkout_wait_seconds_count',
+        'db_query_duration_seconds_sum',
+        'open_restaurants_returned_count',
+        'response_cache_hits_total',
+    ):
+        assert name in response.text
+    assert re.search(r'http_request_duration_seconds_count\{method="GET",route="[^"]*\{opening_hours\}"', response.text)
+
+
+class TestOccupancy(unittest.TestCase):
+    def test_merge_runs(self):
+        # Restaurant 2 has overlapping and touching intervals, given unordered
+        starts, ends, restaurants = merge_runs([2, 1, 2, 2], [100, 0, 0, 150], [150, 60, 120, 200])
+        self.assertEqual((starts.tolist(), ends.tolist(), restaurants), ([0, 0], [60, 200], 2))
+
+    def test_counts(self):
+        occupancy = WeeklyOccupancy.from_intervals([1, 1, 2], [0, 30, 30], [60, 90, MINUTES_PER_WEEK])
+        self.assertEqual(occupancy.restaurants, 2)
+        self.assertEqual(len(occupancy.counts), MINUTES_PER_WEEK)
+        self.assertEqual(occupancy.counts[[0, 29, 30, 89, 90, MINUTES_PER_WEEK - 1]].tolist(), [1, 1, 2, 2, 1, 1])
+
+    def test_empty(self):
+        occupancy = WeeklyOccupancy.from_intervals([], [], [])
+        self.assertEqual((occupancy.restaurants, int(occupancy.counts.sum())), (0, 0))
+
+    def test_bucket_counts(self):
+        occupancy = WeeklyOccupancy.from_intervals([1, 2], [0, 30], [60, 60])
+        self.assertEqual(bucket_counts(occupancy.counts, 60, 'max')[:2].tolist(), [2, 0])
+        self.assertEqual(bucket_counts(occupancy.counts, 60, 'mean')[0], 1.5)
+        with self.assertRaises(ValueError):
+            bucket_counts(occupancy.counts, 7 * 60 + 1)
+        with self.assertRaises(ValueError):
+            bucket_counts(occupancy.counts, 60, 'median')
+
+
+def test_get_occupancy_matches_open_restaurants(test_db):
+    response = client.get("api/v1/restaurants/stats/occupancy", params={'bucket': 1})
+    assert response.status_code == 200
+    data = response.json()['data']
+    assert len(data['counts']) == MINUTES_PER_WEEK
+    assert data['memory_bytes'] > 0
+    for minute in (0, 9 * 60, 2 * MINUTES_PER_DAY + 12 * 60, MINUTES_PER_WEEK - 1):
+        moment = datetime(2024, 1, 1) + timedelta(minutes=minute)
+        assert data['counts'][minute] == len(crud_restaurant.get_by_opening_hours(test_db, moment))
+
+    hourly = client.get("api/v1/restaurants/stats/occupancy", params={'aggregate': 'max'}).json()['data']
+    assert len(hourly['counts']) == 7 * 24
+    assert hourly['counts'][9] == max(data['counts'][9 * 60:10 * 60])
+
+
+def test_get_occupancy_rejects_uneven_buckets():
+    response = client.get("api/v1/restaurants/stats/occupancy", params={'bucket': 7})
+    assert response.status_code == 200
+    response = client.get("api/v1/restaurants/stats/occupancy", params={'bucket': 11})
+    assert response.status_code == 400
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('lookup_seconds', 'Lookups.', ['stage'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, 'db')
+        lines = histogram.render()
+        self.assertIn('lookup_seconds_bucket{stage="db",le="0.1"} 1', lines)
+        self.assertIn('lookup_seconds_bucket{stage="db",le="1.0"} 3', lines)
+        self.assertIn('lookup_seconds_bucket{stage="db",le="+Inf"} 4', lines)
+        self.assertIn('lookup_seconds_count{stage="db"} 4', lines)
+
+    def test_server_timing_adds_up_repeated_stages(self):
+        self.assertEqual(
+            server_timing([('db', 0.001), ('parse', 0.0005), ('db', 0.002)], 0.01),
+            'db;dur=3.000, parse;dur=0.500, total;dur=10.000',
+        )
+
+
+class TestSettings(unittest.TestCase):
+    def test_sqlite_file_backend(self):
+        settings = Settings(_env_file=None, DB_BACKEND="sqlite", SQLITE_PATH="edge.db", DATABASE_URI=None)
+        self.assertEqual(settings.DATABASE_URI, "sqlite:///edge.db")
+
+    def test_sqlite_memory_backend(self):
+        settings = Settings(_env_file=None, DB_BACKEND="sqlite-memory", DATABASE_URI=None)
+        self.assertIn("mode=memory", settings.DATABASE_URI)
+
+    def test_postgres_backend(self):
+        settings = Settings(
+            _env_file=None, DB_BACKEND="postgres", DATABASE_URI=None,
+            POSTGRES_SERVER="db", POSTGRES_USER="user", POSTGRES_PASSWORD="secret", POSTGRES_DB="restaurants",
+        )
+        self.assertEqual(settings.DATABASE_URI, "postgresql+psycopg://user:secret@db/restaurants")
+
+    def test_postgres_backend_needs_credentials(self):
+        with self.assertRaises(ValidationError):
+            Settings(_env_file=None, DB_BACKEND="postgres", DATABASE_URI=None, POSTGRES_SERVER=None)
+
+
+def test_loader_lock_on_a_sqlite_file(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'lock.db'}", connect_args={'timeout': 0.1})
+    first, second = Session(engine), Session(engine)
+    try:
+        acquire_loader_lock(first)
+        # Held until the first transaction ends, as workers loading at once
+        with pytest.raises(OperationalError):
+            acquire_loader_lock(second)
+        second.rollback()
+        first.rollback()
+        acquire_loader_lock(second)
+    finally:
+        first.close()
+        second.close()
+        engine.dispose()